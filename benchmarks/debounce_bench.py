@@ -0,0 +1,126 @@
+"""
+Бенчмарк защиты от двойных нажатий
+
+Сравнивает прежний debounce (полный обход словаря при каждом нажатии под
+общей блокировкой) с сегментированным хранилищем bot.utils.debounce:
+- хранилище заранее заполняется N активными ключами (по умолчанию 100 000)
+- затем измеряются нажатия в секунду и время нажатия (p50, p99) в одном и в
+  нескольких потоках
+
+Запуск из корня проекта:
+    python benchmarks/debounce_bench.py [--keys 100000] [--presses 20000] [--threads 1,8]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# bot.config требует токен, но бенчмарк не обращается к Max API
+os.environ.setdefault("MAX_TOKEN", "benchmark")
+# Общее хранилище не нужно: меряем работу в памяти
+os.environ["DEBOUNCE_BACKEND"] = "memory"
+
+from bot.utils import debounce  # noqa: E402
+
+ACTION = "accept_request_1"
+
+
+class LegacyDebounce:
+    """Прежний is_action_allowed: очистка полным обходом под общей блокировкой"""
+
+    def __init__(self, window):
+        self.window = window
+        self.last_actions = {}
+        self.lock = threading.Lock()
+
+    def is_action_allowed(self, chat_id, action):
+        with self.lock:
+            key = (str(chat_id), action)
+            now = time.time()
+            if key in self.last_actions and now - self.last_actions[key] < self.window:
+                return False
+            self.last_actions[key] = now
+            stale = [k for k, ts in self.last_actions.items() if now - ts > 10]
+            for k in stale:
+                del self.last_actions[k]
+            return True
+
+    def fill(self, keys):
+        # Заполняем напрямую: через is_action_allowed это O(keys^2)
+        now = time.time()
+        for i in range(keys):
+            self.last_actions[(f"fill{i}", ACTION)] = now
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(allow, presses, threads):
+    per_thread = presses // threads
+    timings = [[] for _ in range(threads)]
+
+    def worker(index):
+        samples = timings[index]
+        for i in range(per_thread):
+            chat_id = f"t{index}_{i}"
+            started = time.perf_counter()
+            allow(chat_id, ACTION)
+            samples.append(time.perf_counter() - started)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    flat = [value for samples in timings for value in samples]
+    return {
+        "throughput": len(flat) / elapsed,
+        "p50_us": percentile(flat, 0.5) * 1e6,
+        "p99_us": percentile(flat, 0.99) * 1e6,
+    }
+
+
+def fill_striped(keys):
+    for stripe in debounce._stripes:
+        stripe.last_actions.clear()
+        stripe.order.clear()
+    for i in range(keys):
+        debounce.is_action_allowed(f"fill{i}", ACTION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=100_000, help="активных ключей в хранилище")
+    parser.add_argument("--presses", type=int, default=20_000, help="нажатий для замера")
+    parser.add_argument("--legacy-presses", type=int, default=200,
+                        help="нажатий для прежней реализации (каждое — обход всех ключей)")
+    parser.add_argument("--threads", default="1,8", help="числа потоков через запятую")
+    args = parser.parse_args()
+
+    # Логи предупреждений debounce не нужны в выводе
+    debounce.logger.disabled = True
+
+    print(f"Активных ключей: {args.keys}, окно {debounce.DEBOUNCE_TIME} сек, сегментов {debounce.DEBOUNCE_STRIPES}")
+    print(f"{'реализация':<12} {'потоков':>8} {'нажатий/с':>12} {'p50, мкс':>10} {'p99, мкс':>10}")
+
+    for threads in (int(value) for value in args.threads.split(",")):
+        legacy = LegacyDebounce(debounce.DEBOUNCE_TIME)
+        legacy.fill(args.keys)
+        result = run(legacy.is_action_allowed, max(args.legacy_presses, threads), threads)
+        print(f"{'legacy':<12} {threads:>8} {result['throughput']:>12.0f} {result['p50_us']:>10.1f} {result['p99_us']:>10.1f}")
+
+        fill_striped(args.keys)
+        result = run(debounce.is_action_allowed, args.presses, threads)
+        print(f"{'striped':<12} {threads:>8} {result['throughput']:>12.0f} {result['p50_us']:>10.1f} {result['p99_us']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
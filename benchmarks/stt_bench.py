@@ -0,0 +1,296 @@
+"""
+Бенчмарк распознавания речи (Vosk)
+
+Сравнивает пути распознавания голосовых сообщений:
+- legacy — прежний transcribe_voice: ffmpeg → временный WAV → wave → Kaldi
+  (pydub вызывал тот же ffmpeg; конвертация воспроизведена здесь)
+- stream — voice.transcribe_file: ffmpeg (pipe) → VAD → Kaldi, без временных файлов
+- pool   — тот же transcribe_file в пуле процессов, как в speech_service
+
+Для каждого пути и числа одновременных заданий выводит:
+- RTF (время обработки / длительность аудио), p50/p95 задержки
+- пиковый RSS процесса, выполняющего распознавание
+- пропускную способность: секунд аудио и файлов в секунду
+
+Аудио: файлы из --fixtures (по умолчанию benchmarks/data/audio, если есть);
+иначе ffmpeg генерирует синтетические записи OGG/Opus разной длины с паузами.
+Синтетика не содержит речи, но нагружает декодер и Kaldi так же; для оценки
+качества положите в папку реальные голосовые.
+
+Работает без сети с моделью bot/models/vosk-model-small-ru-0.22.
+Нужны vosk и ffmpeg (как для самого бота).
+
+Запуск из корня проекта:
+    python benchmarks/stt_bench.py [--durations 3,15,60] [--workers 1,4] [--repeat 2]
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# bot.config требует токен, но бенчмарк не обращается к Max API
+os.environ.setdefault("MAX_TOKEN", "benchmark")
+os.environ.setdefault("VOICE_ENABLED", "true")
+
+from bot.utils import voice  # noqa: E402
+
+FIXTURES_DIR = os.path.join(ROOT, "benchmarks", "data", "audio")
+AUDIO_EXTENSIONS = (".ogg", ".oga", ".opus", ".mp3", ".m4a", ".wav")
+PATHS = ("legacy", "stream", "pool")
+
+
+# === Аудио ===
+
+def generate_fixture(path, duration):
+    """
+    Синтетическая запись OGG/Opus: тон с модуляцией, шум и паузы
+
+    Паузы по краям и внутри нужны, чтобы VAD работал как на живой речи.
+    """
+    tone = (
+        f"sine=frequency=180:sample_rate=48000:duration={duration},"
+        f"vibrato=f=5:d=0.5,tremolo=f=3:d=0.8,"
+        f"volume='if(lt(mod(t,4),3),1,0)':eval=frame"
+    )
+    subprocess.run(
+        [
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", tone,
+            "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.01:sample_rate=48000:duration={duration}",
+            "-filter_complex", "amix=inputs=2:duration=shortest",
+            "-ac", "1", "-c:a", "libopus", "-b:a", "24k", path,
+        ],
+        check=True,
+    )
+
+
+def audio_duration(path):
+    """Длительность файла в секундах (ffprobe)"""
+    output = subprocess.run(
+        [
+            "ffprobe", "-v", "error", "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1", path,
+        ],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return float(output.strip())
+
+
+def load_fixtures(fixtures_dir, durations, tmp_dir):
+    """
+    Returns:
+        list: [(path, duration), ...] от коротких к длинным
+    """
+    paths = []
+    if fixtures_dir and os.path.isdir(fixtures_dir):
+        paths = sorted(
+            path for path in glob.glob(os.path.join(fixtures_dir, "*"))
+            if path.lower().endswith(AUDIO_EXTENSIONS)
+        )
+
+    if not paths:
+        print(f"Аудио не найдено, генерируем записи: {', '.join(f'{d} сек' for d in durations)}")
+        for duration in durations:
+            path = os.path.join(tmp_dir, f"synthetic_{duration}s.ogg")
+            generate_fixture(path, duration)
+            paths.append(path)
+
+    fixtures = [(path, audio_duration(path)) for path in paths]
+    return sorted(fixtures, key=lambda fixture: fixture[1])
+
+
+# === Пути распознавания ===
+
+def convert_to_wav(input_path, output_path):
+    """Прежняя конвертация во временный WAV: mono, 16 кГц"""
+    result = subprocess.run(
+        [
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", input_path,
+            "-ac", "1", "-ar", str(voice.SAMPLE_RATE), output_path,
+        ],
+        capture_output=True,
+    )
+    return result.returncode == 0
+
+
+def legacy_transcribe(audio_path):
+    """Прежний transcribe_voice: конвертация во временный WAV и чтение через wave"""
+    # Отдельный файл на задание: одну запись могут распознавать несколько потоков
+    fd, wav_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+
+    try:
+        if not convert_to_wav(audio_path, wav_path):
+            return None
+        with wave.open(wav_path, "rb") as wf:
+            rec = voice.KaldiRecognizer(voice.vosk_model, wf.getframerate())
+            rec.SetWords(True)
+
+            results = []
+            while True:
+                data = wf.readframes(4000)
+                if len(data) == 0:
+                    break
+                if rec.AcceptWaveform(data):
+                    results.append(json.loads(rec.Result()).get('text', ''))
+            results.append(json.loads(rec.FinalResult()).get('text', ''))
+    finally:
+        os.remove(wav_path)
+
+    return ' '.join(results).strip() or None
+
+
+def _timed(fn, audio_path):
+    """Выполняет распознавание; возвращает (текст, секунды, пиковый RSS в КБ)"""
+    started = time.perf_counter()
+    text = fn(audio_path)
+    elapsed = time.perf_counter() - started
+    return text, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed_legacy(audio_path):
+    return _timed(legacy_transcribe, audio_path)
+
+
+def timed_stream(audio_path):
+    return _timed(voice.transcribe_file, audio_path)
+
+
+def init_pool_worker():
+    voice.init_worker()
+    # Логи каждого задания смешались бы с таблицей результатов
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _executor(path, workers):
+    if path == "pool":
+        # Те же настройки, что в speech_service: spawn и загрузка модели при старте
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=init_pool_worker,
+        )
+        for future in [executor.submit(voice.worker_ping) for _ in range(workers)]:
+            future.result()
+        return executor, timed_stream
+
+    # Kaldi отпускает GIL, поэтому потоки дают настоящую параллельность
+    return ThreadPoolExecutor(max_workers=workers), timed_legacy if path == "legacy" else timed_stream
+
+
+# === Измерения ===
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run(path, workers, fixtures, repeat):
+    """Распознаёт все записи repeat раз при workers одновременных заданиях"""
+    executor, fn = _executor(path, workers)
+    jobs = [fixture for _ in range(repeat) for fixture in fixtures]
+
+    try:
+        started = time.perf_counter()
+        futures = [(executor.submit(fn, audio_path), duration) for audio_path, duration in jobs]
+        results = [(future.result(), duration) for future, duration in futures]
+        wall = time.perf_counter() - started
+    finally:
+        executor.shutdown(wait=True)
+
+    latencies = [elapsed for (_, elapsed, _), _ in results]
+    audio_seconds = sum(duration for _, duration in results)
+    return {
+        "path": path,
+        "workers": workers,
+        "jobs": len(results),
+        "recognized": sum(1 for (text, _, _), _ in results if text),
+        "rtf": sum(latencies) / audio_seconds,
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 0.95),
+        "peak_rss_mb": max(rss for (_, _, rss), _ in results) / 1024,
+        "audio_per_second": audio_seconds / wall,
+        "files_per_second": len(results) / wall,
+    }
+
+
+def print_row(row):
+    print(
+        f"{row['path']:>7} | {row['workers']:>3} | {row['rtf']:>6.3f} | {row['p50']:>7.2f} | "
+        f"{row['p95']:>7.2f} | {row['peak_rss_mb']:>8.0f} | {row['audio_per_second']:>9.1f} | "
+        f"{row['files_per_second']:>7.2f} | {row['recognized']}/{row['jobs']}"
+    )
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="папка с аудио файлами")
+    parser.add_argument("--durations", type=_int_list, default=[3, 15, 60],
+                        help="длительности синтетических записей, секунды")
+    parser.add_argument("--workers", type=_int_list, default=sorted({1, os.cpu_count() or 1}),
+                        help="числа одновременных заданий")
+    parser.add_argument("--paths", default=",".join(PATHS), help=f"пути через запятую: {', '.join(PATHS)}")
+    parser.add_argument("--repeat", type=int, default=2, help="сколько раз распознавать каждую запись")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    paths = [path for path in args.paths.split(",") if path]
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        parser.error(f"неизвестные пути: {', '.join(sorted(unknown))}")
+    if not shutil.which("ffmpeg"):
+        sys.exit("Нужен ffmpeg")
+
+    started = time.perf_counter()
+    if not voice.init_vosk_model():
+        sys.exit("Модель Vosk не загружена (см. bot/models/vosk-model-small-ru-0.22)")
+    print(f"Загрузка модели: {time.perf_counter() - started:.1f} сек")
+
+    tmp_dir = tempfile.mkdtemp(prefix="stt_bench_")
+    try:
+        fixtures = load_fixtures(args.fixtures, args.durations, tmp_dir)
+        total = sum(duration for _, duration in fixtures)
+        print(f"Записей: {len(fixtures)}, всего {total:.1f} сек аудио, повторов: {args.repeat}")
+        print()
+        print(f"{'путь':>7} | {'N':>3} | {'RTF':>6} | {'p50, с':>7} | {'p95, с':>7} | "
+              f"{'RSS, МБ':>8} | {'аудио с/с':>9} | {'файл/с':>7} | распознано")
+        print("-" * 92)
+
+        rows = []
+        for path in paths:
+            for workers in args.workers:
+                row = run(path, workers, fixtures, args.repeat)
+                rows.append(row)
+                print_row(row)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print()
+    print("RTF < 1 — быстрее реального времени. RSS для legacy/stream — процесс бенчмарка")
+    print("(пик за всё время работы), для pool — максимум по рабочим процессам.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"fixtures": fixtures, "results": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
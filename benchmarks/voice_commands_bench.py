@@ -0,0 +1,118 @@
+"""
+Бенчмарк сопоставления голосовых команд
+
+Сравнивает прежний поиск подстрок (цикл по всем ключевым словам) со
+скомпилированным автоматом bot.utils.voice_commands:
+- точность на наборе фраз benchmarks/data/voice_command_samples.json
+- пропускная способность (фраз в секунду) при растущем словаре
+
+Запуск из корня проекта:
+    python benchmarks/voice_commands_bench.py [--iterations 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# bot.config требует токен, но бенчмарк не обращается к Max API
+os.environ.setdefault("MAX_TOKEN", "benchmark")
+
+from bot.utils.voice_commands import CommandMatcher  # noqa: E402
+from bot.config import VOICE_COMMANDS_FILE  # noqa: E402
+
+SAMPLES_FILE = os.path.join(ROOT, "benchmarks", "data", "voice_command_samples.json")
+CONFIDENCE_THRESHOLD = 0.3  # как в bot/handlers/voice.py
+
+
+def legacy_parse(text, commands):
+    """Прежний parse_voice_command: подстроки без нормализации"""
+    text_lower = text.lower()
+    best_match = None
+    max_matches = 0
+    for command, keywords in commands.items():
+        matches = sum(1 for keyword in keywords if keyword in text_lower)
+        if matches > max_matches:
+            max_matches = matches
+            best_match = command
+    if best_match and max_matches > 0:
+        return {"command": best_match, "confidence": min(1.0, max_matches / 2)}
+    return {"command": None, "confidence": 0.0}
+
+
+def accuracy(samples, parse):
+    correct = 0
+    errors = []
+    for sample in samples:
+        result = parse(sample["text"])
+        command = result["command"] if result["confidence"] >= CONFIDENCE_THRESHOLD else None
+        if command == sample["command"]:
+            correct += 1
+        else:
+            errors.append((sample["text"], sample["command"], command))
+    return correct / len(samples), errors
+
+
+def throughput(samples, parse, iterations):
+    texts = [sample["text"] for sample in samples]
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            parse(text)
+    elapsed = time.perf_counter() - started
+    return len(texts) * iterations / elapsed
+
+
+def grow_table(table, factor):
+    """Увеличивает словарь в factor раз синтетическими фразами"""
+    grown = {}
+    for command, phrases in table.items():
+        grown[command] = dict(phrases)
+        for i in range(1, factor):
+            for phrase, weight in phrases.items():
+                grown[command][f"{phrase} вариант{i}"] = weight
+    return grown
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--show-errors", action="store_true")
+    args = parser.parse_args()
+
+    with open(VOICE_COMMANDS_FILE, encoding="utf-8") as f:
+        table = json.load(f)["commands"]
+    with open(SAMPLES_FILE, encoding="utf-8") as f:
+        samples = json.load(f)["samples"]
+
+    print(f"Фраз в наборе: {len(samples)}, команд: {len(table)}")
+    print()
+    print(f"{'словарь':>8} | {'прежний, фраз/с':>16} | {'автомат, фраз/с':>16} | {'прежний, точн.':>14} | {'автомат, точн.':>14}")
+    print("-" * 82)
+
+    for factor in (1, 10, 100):
+        grown = grow_table(table, factor)
+        legacy_commands = {command: list(phrases) for command, phrases in grown.items()}
+        matcher = CommandMatcher(grown)
+
+        legacy = lambda text: legacy_parse(text, legacy_commands)  # noqa: E731
+        iterations = max(1, args.iterations // factor)
+
+        legacy_acc, legacy_errors = accuracy(samples, legacy)
+        matcher_acc, matcher_errors = accuracy(samples, matcher.match)
+        legacy_rate = throughput(samples, legacy, iterations)
+        matcher_rate = throughput(samples, matcher.match, iterations)
+
+        phrases = sum(len(p) for p in grown.values())
+        print(f"{phrases:>8} | {legacy_rate:>16,.0f} | {matcher_rate:>16,.0f} | {legacy_acc:>14.1%} | {matcher_acc:>14.1%}")
+
+        if args.show_errors and factor == 1:
+            for name, errors in (("прежний", legacy_errors), ("автомат", matcher_errors)):
+                for text, expected, got in errors:
+                    print(f"    [{name}] \"{text}\": ожидалось {expected}, получено {got}")
+
+
+if __name__ == "__main__":
+    main()
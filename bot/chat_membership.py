@@ -0,0 +1,262 @@
+"""
+Операции с участниками групповых чатов Max
+
+- Добавление участников одним запросом (эндпоинт принимает список user_ids)
+- Параллельное удаление с ограничением числа одновременных запросов
+- Список участников чата (для освобождения чата без данных заявки)
+- Структурированные результаты вместо сравнения строк в вызывающем коде
+- Общая HTTP-сессия с пулом соединений
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from bot.config import (
+    MAX_TOKEN,
+    MAX_API_URL,
+    MEMBERSHIP_CONCURRENCY,
+    MEMBERSHIP_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Результаты операций с участником
+MEMBER_ADDED = "added"
+MEMBER_ALREADY = "already_member"
+MEMBER_REMOVED = "removed"
+MEMBER_NOT_MEMBER = "not_member"
+MEMBER_PRIVACY = "privacy"
+MEMBER_NO_RIGHTS = "no_rights"
+MEMBER_ERROR = "error"
+
+# Результаты, после которых пользователь находится в чате
+IN_CHAT_OUTCOMES = (MEMBER_ADDED, MEMBER_ALREADY)
+# Результаты, после которых пользователя в чате нет
+OUT_OF_CHAT_OUTCOMES = (MEMBER_REMOVED, MEMBER_NOT_MEMBER)
+
+HEADERS = {'Content-Type': 'application/json'}
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=MEMBERSHIP_CONCURRENCY))
+
+_executor = ThreadPoolExecutor(max_workers=MEMBERSHIP_CONCURRENCY, thread_name_prefix="membership")
+
+
+def classify_error(message):
+    """
+    Определяет тип ошибки по тексту или коду ответа Max API
+
+    Args:
+        message: текст ошибки или error_code
+
+    Returns:
+        str: одна из констант MEMBER_*
+    """
+    text = (message or "").lower()
+
+    if 'already' in text or ('member' in text and 'not' not in text):
+        return MEMBER_ALREADY
+    if 'not.found' in text or 'not found' in text or 'not a member' in text or 'not_member' in text:
+        return MEMBER_NOT_MEMBER
+    if 'приватности' in text or 'privacy' in text:
+        return MEMBER_PRIVACY
+    if 'rights' in text or 'права' in text or 'access' in text:
+        return MEMBER_NO_RIGHTS
+    return MEMBER_ERROR
+
+
+def _members_url(chat_id):
+    return f"{MAX_API_URL}/chats/{chat_id}/members"
+
+
+def _post_members(chat_id, user_ids):
+    """Один POST /chats/{id}/members. Возвращает (success, data, status_code)"""
+    response = _session.post(
+        _members_url(chat_id),
+        headers=HEADERS,
+        params={'access_token': MAX_TOKEN},
+        json={'user_ids': list(user_ids)},
+        timeout=MEMBERSHIP_TIMEOUT,
+    )
+    try:
+        data = response.json()
+    except ValueError:
+        data = {'message': response.text}
+    return response.status_code == 200 and data.get('success', False), data, response.status_code
+
+
+def list_members(chat_id):
+    """
+    Возвращает участников чата, которых можно удалить
+
+    Владелец, администраторы и боты (в том числе сам бот) не включаются.
+
+    Args:
+        chat_id: ID группового чата
+
+    Returns:
+        list: [user_id, ...] или None при ошибке Max API
+    """
+    user_ids = []
+    marker = None
+    while True:
+        params = {'access_token': MAX_TOKEN, 'count': 100}
+        if marker:
+            params['marker'] = marker
+        try:
+            response = _session.get(
+                _members_url(chat_id),
+                headers=HEADERS,
+                params=params,
+                timeout=MEMBERSHIP_TIMEOUT,
+            )
+            if response.status_code != 200:
+                logger.error(f"Ошибка получения участников чата {chat_id}: {response.status_code} {response.text}")
+                return None
+            data = response.json()
+        except Exception as e:
+            logger.error(f"Исключение при получении участников чата {chat_id}: {e}")
+            return None
+
+        for member in data.get('members', []):
+            if member.get('is_owner') or member.get('is_admin') or member.get('is_bot'):
+                continue
+            if member.get('user_id'):
+                user_ids.append(member['user_id'])
+
+        marker = data.get('marker')
+        if not marker:
+            return user_ids
+
+
+def _outcomes_from_details(user_ids, data):
+    """
+    Разбирает поэлементные ошибки ответа (failed_user_ids / failed_user_details)
+
+    Returns:
+        dict или None, если ответ не содержит разбивки по пользователям
+    """
+    details = data.get('failed_user_details') or []
+    failed_ids = data.get('failed_user_ids') or []
+    if not details and not failed_ids:
+        return None
+
+    outcomes = {user_id: MEMBER_ADDED for user_id in user_ids}
+    for user_id in failed_ids:
+        outcomes[user_id] = classify_error(data.get('message'))
+    for detail in details:
+        outcome = classify_error(detail.get('error_code') or detail.get('message'))
+        for user_id in detail.get('user_ids', []):
+            outcomes[user_id] = outcome
+    return outcomes
+
+
+def _add_one(chat_id, user_id):
+    try:
+        success, data, status_code = _post_members(chat_id, [user_id])
+    except Exception as e:
+        logger.error(f"Исключение при добавлении {user_id} в чат {chat_id}: {e}")
+        return MEMBER_ERROR
+
+    if success:
+        return MEMBER_ADDED
+    outcome = classify_error(data.get('message'))
+    if outcome == MEMBER_ERROR:
+        logger.error(f"Ошибка добавления {user_id} в чат {chat_id}: {status_code} {data}")
+    return outcome
+
+
+def add_members(chat_id, user_ids):
+    """
+    Добавляет пользователей в чат одним запросом
+
+    Если Max API отклонил пакет целиком и не указал, какие пользователи
+    вызвали ошибку, выполняется параллельное поштучное добавление,
+    чтобы получить результат по каждому.
+
+    Args:
+        chat_id: ID группового чата
+        user_ids: список ID пользователей
+
+    Returns:
+        dict: {user_id: MEMBER_*}
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+
+    try:
+        success, data, status_code = _post_members(chat_id, user_ids)
+    except Exception as e:
+        logger.error(f"Исключение при добавлении в чат {chat_id}: {e}")
+        return {user_id: MEMBER_ERROR for user_id in user_ids}
+
+    if success:
+        outcomes = _outcomes_from_details(user_ids, data)
+        return outcomes or {user_id: MEMBER_ADDED for user_id in user_ids}
+
+    outcomes = _outcomes_from_details(user_ids, data)
+    if outcomes:
+        return outcomes
+
+    outcome = classify_error(data.get('message'))
+    if len(user_ids) == 1 or outcome == MEMBER_NO_RIGHTS:
+        # Без прав администратора повторять поштучно бессмысленно
+        return {user_id: outcome for user_id in user_ids}
+
+    logger.warning(
+        f"Пакетное добавление в чат {chat_id} отклонено ({status_code}: {data.get('message')}), "
+        "добавляем поштучно"
+    )
+    results = _executor.map(lambda user_id: _add_one(chat_id, user_id), user_ids)
+    return dict(zip(user_ids, results))
+
+
+def _remove_one(chat_id, user_id):
+    try:
+        response = _session.delete(
+            _members_url(chat_id),
+            headers=HEADERS,
+            params={'user_id': user_id, 'access_token': MAX_TOKEN},
+            timeout=MEMBERSHIP_TIMEOUT,
+        )
+    except Exception as e:
+        logger.error(f"Исключение при удалении {user_id} из чата {chat_id}: {e}")
+        return MEMBER_ERROR
+
+    if response.status_code == 200:
+        return MEMBER_REMOVED
+    if response.status_code == 404:
+        return MEMBER_NOT_MEMBER
+
+    try:
+        message = response.json().get('message')
+    except ValueError:
+        message = response.text
+    outcome = classify_error(message)
+    if outcome == MEMBER_ALREADY:
+        outcome = MEMBER_ERROR
+    if outcome == MEMBER_ERROR:
+        logger.error(f"Ошибка удаления {user_id} из чата {chat_id}: {response.status_code} {message}")
+    return outcome
+
+
+def remove_members(chat_id, user_ids):
+    """
+    Удаляет пользователей из чата параллельно (не более MEMBERSHIP_CONCURRENCY запросов)
+
+    Args:
+        chat_id: ID группового чата
+        user_ids: список ID пользователей
+
+    Returns:
+        dict: {user_id: MEMBER_*}
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    if len(user_ids) == 1:
+        return {user_ids[0]: _remove_one(chat_id, user_ids[0])}
+
+    results = _executor.map(lambda user_id: _remove_one(chat_id, user_id), user_ids)
+    return dict(zip(user_ids, results))
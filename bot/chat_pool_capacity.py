@@ -0,0 +1,242 @@
+"""
+Учёт ёмкости пула групповых чатов
+
+- Скользящая занятость пула и темпы принятия/освобождения чатов
+- Прогноз времени до исчерпания свободных чатов
+- Хуки нижнего порога (low watermark): запросить внеочередную синхронизацию
+  пула, чтобы подхватить новые группы, и предупредить модераторов
+- Очередь принятых заявок, ожидающих свободный чат (в памяти; в БД заявка
+  помечается requests.chat_queued_at, и после перезапуска очередь
+  восстанавливается, см. chat_room_manager.restore_waiting_assignments)
+"""
+import logging
+import time
+from collections import deque
+from threading import Lock
+from bot.config import (
+    CHAT_POOL_LOW_WATERMARK,
+    CHAT_POOL_RATE_WINDOW,
+    CHAT_POOL_WATERMARK_COOLDOWN,
+    CHAT_POOL_WATERMARK_CHECK_INTERVAL,
+)
+from bot.chat_room_pool import get_pool_stats
+
+logger = logging.getLogger(__name__)
+
+_lock = Lock()
+
+# Моменты принятия и освобождения чатов за последние CHAT_POOL_RATE_WINDOW секунд
+_accepts = deque()
+_releases = deque()
+# Замеры занятости: (время, доля занятых чатов)
+_occupancy_samples = deque()
+
+# Хуки нижнего порога: fn(forecast)
+_low_watermark_hooks = []
+_last_watermark_fired = 0.0
+_last_watermark_check = None
+
+# Заявки, ожидающие свободный чат (FIFO), и их ID
+_waiting = deque()
+_waiting_ids = set()
+
+
+def _trim(timestamps, now):
+    """Удаляет отметки времени старше окна"""
+    while timestamps and now - timestamps[0] > CHAT_POOL_RATE_WINDOW:
+        timestamps.popleft()
+
+
+def record_accept():
+    """Отмечает, что чат выдан заявке"""
+    now = time.monotonic()
+    with _lock:
+        _accepts.append(now)
+        _trim(_accepts, now)
+
+
+def record_release():
+    """Отмечает, что чат вернулся в пул"""
+    now = time.monotonic()
+    with _lock:
+        _releases.append(now)
+        _trim(_releases, now)
+
+
+def get_capacity_forecast():
+    """
+    Возвращает состояние пула и прогноз исчерпания
+
+    Returns:
+        dict: {'total', 'free', 'occupied', 'occupancy', 'rolling_occupancy',
+               'accept_rate', 'release_rate' (в минуту),
+               'exhaustion_eta' (секунды или None, если пул не убывает),
+               'waiting'} или None при ошибке БД
+    """
+    stats = get_pool_stats()
+    if stats is None:
+        return None
+
+    now = time.monotonic()
+    with _lock:
+        _occupancy_samples.append((now, stats['occupancy']))
+        while now - _occupancy_samples[0][0] > CHAT_POOL_RATE_WINDOW:
+            _occupancy_samples.popleft()
+        _trim(_accepts, now)
+        _trim(_releases, now)
+
+        rolling = sum(value for _, value in _occupancy_samples) / len(_occupancy_samples)
+        accept_rate = len(_accepts) / CHAT_POOL_RATE_WINDOW * 60
+        release_rate = len(_releases) / CHAT_POOL_RATE_WINDOW * 60
+        waiting = len(_waiting)
+
+    net_rate = accept_rate - release_rate
+    exhaustion_eta = stats['free'] / net_rate * 60 if net_rate > 0 else None
+    if stats['free'] == 0:
+        exhaustion_eta = 0
+
+    return {
+        'total': stats['total'],
+        'free': stats['free'],
+        'occupied': stats['occupied'],
+        'occupancy': stats['occupancy'],
+        'rolling_occupancy': rolling,
+        'accept_rate': accept_rate,
+        'release_rate': release_rate,
+        'exhaustion_eta': exhaustion_eta,
+        'waiting': waiting,
+    }
+
+
+def register_low_watermark_hook(hook):
+    """
+    Регистрирует хук, вызываемый при падении числа свободных чатов
+    до CHAT_POOL_LOW_WATERMARK (не чаще раза в CHAT_POOL_WATERMARK_COOLDOWN секунд)
+
+    Args:
+        hook: функция fn(forecast), forecast — результат get_capacity_forecast()
+    """
+    with _lock:
+        if hook not in _low_watermark_hooks:
+            _low_watermark_hooks.append(hook)
+
+
+def check_low_watermark():
+    """
+    Проверяет запас свободных чатов и при необходимости вызывает хуки
+
+    Вызывается при каждом принятии заявки, поэтому запрос к БД выполняется
+    не чаще раза в CHAT_POOL_WATERMARK_CHECK_INTERVAL секунд.
+
+    Returns:
+        dict: прогноз ёмкости или None, если проверка пропущена или ошибка БД
+    """
+    global _last_watermark_fired, _last_watermark_check
+
+    now = time.monotonic()
+    with _lock:
+        if _last_watermark_check is not None and now - _last_watermark_check < CHAT_POOL_WATERMARK_CHECK_INTERVAL:
+            return None
+        _last_watermark_check = now
+
+    forecast = get_capacity_forecast()
+    if forecast is None:
+        return None
+
+    below = forecast['free'] <= CHAT_POOL_LOW_WATERMARK or forecast['waiting'] > 0
+    with _lock:
+        if not below or now - _last_watermark_fired < CHAT_POOL_WATERMARK_COOLDOWN:
+            return forecast
+        _last_watermark_fired = now
+        hooks = list(_low_watermark_hooks)
+
+    eta = forecast['exhaustion_eta']
+    eta_text = f"{eta / 60:.0f} мин" if eta is not None else "не ожидается"
+    logger.warning(
+        f"⚠️  Мало свободных чатов: {forecast['free']}/{forecast['total']}, "
+        f"в очереди {forecast['waiting']}, исчерпание через {eta_text}"
+    )
+
+    for hook in hooks:
+        try:
+            hook(forecast)
+        except Exception as e:
+            logger.error(f"Ошибка хука нижнего порога пула чатов: {e}")
+
+    return forecast
+
+
+def _claim_new_chats_hook(forecast):
+    """Подхватывает группы, в которые бота добавили с последней синхронизации"""
+    from bot.chat_pool_initializer import request_chat_pool_sync
+    request_chat_pool_sync()
+
+
+def _notify_moderators_hook(forecast):
+    """Просит модераторов добавить бота в новые групповые чаты"""
+    from database import get_all_users_by_role
+    from bot.utils import send_message
+
+    text = (
+        "⚠️ Заканчиваются групповые чаты для связи волонтёров и нуждающихся.\n\n"
+        f"Свободно: {forecast['free']} из {forecast['total']}\n"
+        f"Ожидают чат: {forecast['waiting']}\n\n"
+        "Создайте новые группы и добавьте в них бота администратором."
+    )
+    for moderator_id in get_all_users_by_role('moderator'):
+        try:
+            send_message(moderator_id, text)
+        except Exception as e:
+            logger.error(f"Ошибка уведомления модератора {moderator_id}: {e}")
+
+
+register_low_watermark_hook(_claim_new_chats_hook)
+register_low_watermark_hook(_notify_moderators_hook)
+
+
+# === Очередь заявок, ожидающих свободный чат ===
+
+def enqueue_waiting(entry):
+    """
+    Ставит заявку в очередь ожидания свободного чата
+
+    Args:
+        entry: dict с ключами request_id, needy_user_id, volunteer_user_id,
+               on_assigned, on_failed
+
+    Returns:
+        int: позиция в очереди (начиная с 1); если заявка уже в очереди —
+             её текущая позиция
+    """
+    entry['enqueued_at'] = time.monotonic()
+    with _lock:
+        if entry['request_id'] in _waiting_ids:
+            for position, queued in enumerate(_waiting, 1):
+                if queued['request_id'] == entry['request_id']:
+                    return position
+        _waiting.append(entry)
+        _waiting_ids.add(entry['request_id'])
+        return len(_waiting)
+
+
+def pop_waiting():
+    """Достаёт первую заявку из очереди ожидания (или None)"""
+    with _lock:
+        if not _waiting:
+            return None
+        entry = _waiting.popleft()
+        _waiting_ids.discard(entry['request_id'])
+        return entry
+
+
+def return_waiting(entry):
+    """Возвращает заявку в начало очереди (свободного чата всё ещё нет)"""
+    with _lock:
+        _waiting.appendleft(entry)
+        _waiting_ids.add(entry['request_id'])
+
+
+def get_waiting_count():
+    """Количество заявок, ожидающих чат"""
+    with _lock:
+        return len(_waiting)
@@ -1,16 +1,42 @@
 """
-Автоматическая инициализация пула групповых чатов
+Автоматическая синхронизация пула групповых чатов
 
-Автоматически находит все чаты, в которых состоит бот,
-и добавляет их в пул при запуске бота.
+Фоновый поток периодически находит все чаты, в которых состоит бот,
+и сверяет их с таблицей chat_rooms набором bulk-запросов.
+Запуск бота не ждёт первой синхронизации.
 """
 import logging
+import time
+import threading
+from collections import deque
 import requests
-from bot.config import MAX_TOKEN, MAX_API_URL
+from psycopg2.extras import execute_values
+from bot.config import (
+    MAX_TOKEN,
+    MAX_API_URL,
+    CHAT_POOL_SYNC_INTERVAL,
+    CHAT_POOL_HEALTH_HISTORY,
+)
+from bot.chat_room_pool import invalidate_free_list
+from bot.chat_room_manager import drain_waiting_assignments
+from bot.chat_pool_capacity import get_waiting_count
 from database import get_connection, release_connection
 
 logger = logging.getLogger(__name__)
 
+# Глобальный флаг для остановки потока
+_stop_flag = False
+_sync_thread = None
+# Позволяет запросить внеочередную синхронизацию
+_wake_event = threading.Event()
+
+# Последний набор чатов из Max.ru: {chat_id: chat_title}
+_last_bot_chats = None
+_lock = threading.Lock()
+
+# История состояния пула (последние CHAT_POOL_HEALTH_HISTORY синхронизаций)
+_health_history = deque(maxlen=CHAT_POOL_HEALTH_HISTORY)
+
 
 def get_bot_chats():
     """
@@ -18,6 +44,8 @@ def get_bot_chats():
 
     Returns:
         list: список чатов [{'chat_id': int, 'chat_title': str}, ...]
+              или None, если список получить не удалось (частичный
+              список нельзя использовать для удаления чатов из пула)
     """
     try:
         url = f"{MAX_API_URL}/chats"
@@ -37,7 +65,7 @@ def get_bot_chats():
 
             if response.status_code != 200:
                 logger.error(f"Ошибка получения списка чатов: {response.status_code} - {response.text}")
-                break
+                return None
 
             data = response.json()
             chat_list = data.get('chats', [])
@@ -60,105 +88,203 @@ def get_bot_chats():
             if not marker:
                 break
 
-        logger.info(f"Найдено {len(chats)} групповых чатов")
+        logger.debug(f"Найдено {len(chats)} групповых чатов")
         return chats
 
     except Exception as e:
         logger.error(f"Исключение при получении списка чатов: {e}")
-        return []
+        return None
+
+
+def _apply_diff(cur, bot_chats):
+    """
+    Сверяет chat_rooms со списком чатов бота set-based запросами
+
+    Returns:
+        tuple: (добавлено, удалено, [(chat_id, request_id) занятых чатов без бота])
+    """
+    chat_ids = [chat['chat_id'] for chat in bot_chats]
+
+    # Новые чаты и переименования — одним INSERT ... ON CONFLICT
+    inserted = execute_values(cur, """
+        INSERT INTO chat_rooms (chat_id, chat_title, is_occupied)
+        VALUES %s
+        ON CONFLICT (chat_id) DO UPDATE
+        SET chat_title = EXCLUDED.chat_title
+        WHERE chat_rooms.chat_title IS DISTINCT FROM EXCLUDED.chat_title
+        RETURNING chat_id, (xmax = 0) AS inserted
+    """, [(chat['chat_id'], chat['chat_title'], False) for chat in bot_chats], fetch=True)
+    added_ids = [row[0] for row in inserted if row[1]]
+
+    # Удаляем свободные чаты, из которых бот был удалён
+    cur.execute("""
+        DELETE FROM chat_rooms
+        WHERE is_occupied = FALSE
+        AND NOT (chat_id = ANY(%s))
+        RETURNING chat_id
+    """, (chat_ids,))
+    removed_ids = [row[0] for row in cur.fetchall()]
+
+    # Занятые чаты без бота удалять нельзя — только предупреждаем
+    cur.execute("""
+        SELECT chat_id, current_request_id
+        FROM chat_rooms
+        WHERE is_occupied = TRUE
+        AND NOT (chat_id = ANY(%s))
+    """, (chat_ids,))
+    orphaned = cur.fetchall()
+
+    for chat_id in added_ids:
+        logger.info(f"➕ Добавлен чат ID: {chat_id}")
+    for chat_id in removed_ids:
+        logger.info(f"➖ Удалён чат ID: {chat_id} (бот больше не в чате)")
+    for chat_id, request_id in orphaned:
+        logger.warning(
+            f"⚠️  Чат {chat_id} занят заявкой {request_id}, "
+            "но бот больше не в чате!"
+        )
+
+    return len(added_ids), len(removed_ids), orphaned
 
 
 def sync_chat_pool():
     """
     Синхронизирует пул чатов с реальным списком чатов бота
     Добавляет новые чаты и удаляет те, из которых бот был удалён
+
+    Если список чатов не изменился с прошлой синхронизации, запись в БД
+    пропускается и обновляется только статистика пула.
+
+    Returns:
+        dict: запись о состоянии пула (см. get_pool_health)
     """
+    global _last_bot_chats
+
+    started = time.monotonic()
+    health = {
+        'time': time.time(),
+        'ok': False,
+        'added': 0,
+        'removed': 0,
+        'orphaned': 0,
+        'total': None,
+        'free': None,
+        'occupied': None,
+    }
+
+    conn = None
     try:
-        logger.info("🔄 Синхронизация пула групповых чатов...")
-
         # Получаем список чатов из Max.ru
         bot_chats = get_bot_chats()
+        if bot_chats is None:
+            return health
         if not bot_chats:
             logger.warning("⚠️  Не найдено ни одного группового чата")
-            return
+            return health
 
-        bot_chat_ids = {chat['chat_id'] for chat in bot_chats}
+        snapshot = {chat['chat_id']: chat['chat_title'] for chat in bot_chats}
+        with _lock:
+            changed = snapshot != _last_bot_chats
 
         conn = get_connection()
         if not conn:
             logger.error("Не удалось подключиться к БД для синхронизации чатов")
-            return
-
-        try:
-            with conn.cursor() as cur:
-                # Получаем список чатов из БД
-                cur.execute("SELECT id, chat_id, chat_title FROM chat_rooms")
-                db_chats = cur.fetchall()
-                db_chat_ids = {row[1] for row in db_chats}
-
-                # Находим новые чаты (есть в Max.ru, но нет в БД)
-                new_chat_ids = bot_chat_ids - db_chat_ids
-
-                # Находим удалённые чаты (есть в БД, но нет в Max.ru)
-                removed_chat_ids = db_chat_ids - bot_chat_ids
-
-                # Добавляем новые чаты
-                added_count = 0
-                for chat in bot_chats:
-                    if chat['chat_id'] in new_chat_ids:
-                        cur.execute("""
-                            INSERT INTO chat_rooms (chat_id, chat_title, is_occupied)
-                            VALUES (%s, %s, FALSE)
-                            ON CONFLICT (chat_id) DO NOTHING
-                        """, (chat['chat_id'], chat['chat_title']))
-                        added_count += 1
-                        logger.info(f"➕ Добавлен чат: {chat['chat_title']} (ID: {chat['chat_id']})")
-
-                # Удаляем чаты, из которых бот был удалён (только свободные)
-                removed_count = 0
-                for chat_id in removed_chat_ids:
-                    # Удаляем только свободные чаты (не занятые заявками)
-                    cur.execute("""
-                        DELETE FROM chat_rooms
-                        WHERE chat_id = %s AND is_occupied = FALSE
-                    """, (chat_id,))
-                    if cur.rowcount > 0:
-                        removed_count += 1
-                        logger.info(f"➖ Удалён чат ID: {chat_id} (бот больше не в чате)")
-
-                # Предупреждаем о занятых чатах, из которых бот был удалён
-                for chat_id in removed_chat_ids:
-                    cur.execute("""
-                        SELECT is_occupied, current_request_id
-                        FROM chat_rooms
-                        WHERE chat_id = %s AND is_occupied = TRUE
-                    """, (chat_id,))
-                    occupied = cur.fetchone()
-                    if occupied:
-                        logger.warning(
-                            f"⚠️  Чат {chat_id} занят заявкой {occupied[1]}, "
-                            "но бот больше не в чате!"
-                        )
-
-                conn.commit()
-
-                # Показываем статистику
-                cur.execute("SELECT COUNT(*) FROM chat_rooms WHERE is_occupied = FALSE")
-                free_count = cur.fetchone()[0]
-
-                cur.execute("SELECT COUNT(*) FROM chat_rooms WHERE is_occupied = TRUE")
-                occupied_count = cur.fetchone()[0]
-
-                logger.info("✅ Синхронизация завершена:")
-                logger.info(f"   ➕ Добавлено: {added_count}")
-                logger.info(f"   ➖ Удалено: {removed_count}")
-                logger.info(f"   🟢 Свободных чатов: {free_count}")
-                logger.info(f"   🔴 Занятых чатов: {occupied_count}")
-
-        finally:
-            release_connection(conn)
+            return health
+
+        with conn.cursor() as cur:
+            if changed:
+                added, removed, orphaned = _apply_diff(cur, bot_chats)
+                health['added'] = added
+                health['removed'] = removed
+                health['orphaned'] = len(orphaned)
+
+            cur.execute("""
+                SELECT
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE is_occupied = FALSE),
+                    COUNT(*) FILTER (WHERE is_occupied = TRUE)
+                FROM chat_rooms
+            """)
+            health['total'], health['free'], health['occupied'] = cur.fetchone()
+            conn.commit()
+
+        with _lock:
+            _last_bot_chats = snapshot
+
+        if health['added'] or health['removed']:
+            invalidate_free_list()
+            # Новые чаты сразу отдаём заявкам, ожидающим в очереди
+            if health['added'] and get_waiting_count():
+                drain_waiting_assignments()
+            logger.info("✅ Синхронизация пула чатов завершена:")
+            logger.info(f"   ➕ Добавлено: {health['added']}")
+            logger.info(f"   ➖ Удалено: {health['removed']}")
+            logger.info(f"   🟢 Свободных чатов: {health['free']}")
+            logger.info(f"   🔴 Занятых чатов: {health['occupied']}")
+
+        health['ok'] = True
+        return health
 
     except Exception as e:
         logger.error(f"Ошибка синхронизации пула чатов: {e}", exc_info=True)
         if conn:
             conn.rollback()
+        return health
+
+    finally:
+        if conn:
+            release_connection(conn)
+        health['duration'] = time.monotonic() - started
+        with _lock:
+            _health_history.append(health)
+
+
+def get_pool_health():
+    """
+    Возвращает историю состояния пула (от старых записей к новым)
+
+    Returns:
+        list: [{'time', 'ok', 'total', 'free', 'occupied',
+                'added', 'removed', 'orphaned', 'duration'}, ...]
+    """
+    with _lock:
+        return list(_health_history)
+
+
+def request_chat_pool_sync():
+    """Запрашивает внеочередную синхронизацию (не дожидаясь интервала)"""
+    _wake_event.set()
+
+
+def start_chat_pool_sync():
+    """Запускает фоновую периодическую синхронизацию пула (первая — сразу)"""
+    global _sync_thread, _stop_flag
+
+    if _sync_thread and _sync_thread.is_alive():
+        logger.warning("Синхронизация пула чатов уже запущена")
+        return
+
+    _stop_flag = False
+    _sync_thread = threading.Thread(target=_sync_loop, daemon=True)
+    _sync_thread.start()
+    logger.info("🔄 Фоновая синхронизация пула групповых чатов запущена")
+
+
+def stop_chat_pool_sync():
+    """Останавливает фоновую синхронизацию"""
+    global _stop_flag
+    _stop_flag = True
+    _wake_event.set()
+    logger.info("Синхронизация пула чатов остановлена")
+
+
+def _sync_loop():
+    """Основной цикл синхронизации"""
+    while not _stop_flag:
+        try:
+            sync_chat_pool()
+        except Exception as e:
+            logger.error(f"Ошибка в синхронизации пула чатов: {e}")
+
+        _wake_event.wait(CHAT_POOL_SYNC_INTERVAL)
+        _wake_event.clear()
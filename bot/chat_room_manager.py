@@ -2,15 +2,31 @@
 Менеджер пула групповых чатов для связи волонтёров и нуждающихся
 """
 import logging
-import requests
-from bot.config import MAX_TOKEN, MAX_API_URL
+from threading import Lock
+from database import get_request, set_request_chat_queued, get_requests_waiting_for_chat
+from bot.chat_room_pool import reserve_room, confirm_room, rollback_room, release_room
+from bot.chat_membership import (
+    add_members, remove_members,
+    MEMBER_ADDED, MEMBER_ALREADY, MEMBER_PRIVACY, MEMBER_NO_RIGHTS,
+    IN_CHAT_OUTCOMES, OUT_OF_CHAT_OUTCOMES
+)
+from bot.chat_pool_capacity import (
+    record_accept, record_release, check_low_watermark,
+    enqueue_waiting, pop_waiting, return_waiting
+)
 
 logger = logging.getLogger(__name__)
 
+_drain_lock = Lock()
+
+# Функция, восстанавливающая запись очереди ожидания по строке заявки:
+# fn(request) -> dict для enqueue_waiting или None
+_waiting_restorer = None
+
 
 def add_users_to_chat(chat_id, user_ids):
     """
-    Добавляет пользователей в групповой чат
+    Добавляет пользователей в групповой чат одним запросом
 
     Args:
         chat_id: ID группового чата
@@ -19,250 +35,267 @@ def add_users_to_chat(chat_id, user_ids):
     Returns:
         bool: True если успешно, False если ошибка
     """
-    try:
-        url = f"{MAX_API_URL}/chats/{chat_id}/members"
-        headers = {
-            'Content-Type': 'application/json'
-        }
-        params = {
-            'access_token': MAX_TOKEN
-        }
-
-        # Добавляем пользователей по одному, чтобы избежать проблем с теми, кто уже в чате
-        success_count = 0
-        for user_id in user_ids:
-            data = {
-                'user_ids': [user_id]
-            }
-
-            logger.info(f"Добавление пользователя {user_id} в чат {chat_id}")
-
-            response = requests.post(url, headers=headers, params=params, json=data, timeout=10)
-            response_data = response.json() if response.status_code == 200 else {}
-
-            if response.status_code == 200 and response_data.get('success', False):
-                logger.info(f"✓ Пользователь {user_id} успешно добавлен в чат {chat_id}")
-                success_count += 1
-            else:
-                error_msg = response_data.get('message', 'Неизвестная ошибка')
-                # Если пользователь уже в чате или другая ошибка - логируем как warning, но продолжаем
-                if 'already' in error_msg.lower() or 'member' in error_msg.lower():
-                    logger.warning(f"⚠ Пользователь {user_id} уже в чате {chat_id} или является участником")
-                    success_count += 1  # Считаем успешным, т.к. пользователь в чате
-                elif 'приватности' in error_msg.lower() or 'privacy' in error_msg.lower():
-                    logger.error(f"✗ Пользователь {user_id} не разрешает добавление в групповые чаты (настройки приватности)")
-                    logger.error(f"Response: {response.text}")
-                elif 'rights' in error_msg.lower() or 'права' in error_msg.lower():
-                    logger.error(f"✗ У бота нет прав администратора в чате {chat_id}")
-                    logger.error(f"Response: {response.text}")
-                else:
-                    logger.error(f"✗ Ошибка добавления {user_id}: {error_msg}")
-                    logger.error(f"Response: {response.text}")
-
-        # Считаем успешным, если хотя бы один пользователь добавлен/уже в чате
-        if success_count > 0:
-            logger.info(f"Операция завершена: {success_count}/{len(user_ids)} пользователей в чате {chat_id}")
-            return True
+    logger.info(f"Добавление пользователей {user_ids} в чат {chat_id}")
+    outcomes = add_members(chat_id, user_ids)
+
+    success_count = 0
+    for user_id, outcome in outcomes.items():
+        if outcome == MEMBER_ADDED:
+            logger.info(f"✓ Пользователь {user_id} успешно добавлен в чат {chat_id}")
+        elif outcome == MEMBER_ALREADY:
+            logger.warning(f"⚠ Пользователь {user_id} уже в чате {chat_id} или является участником")
+        elif outcome == MEMBER_PRIVACY:
+            logger.error(f"✗ Пользователь {user_id} не разрешает добавление в групповые чаты (настройки приватности)")
+        elif outcome == MEMBER_NO_RIGHTS:
+            logger.error(f"✗ У бота нет прав администратора в чате {chat_id}")
         else:
-            logger.error(f"Не удалось добавить ни одного пользователя в чат {chat_id}")
-            return False
+            logger.error(f"✗ Ошибка добавления {user_id} в чат {chat_id}")
 
-    except Exception as e:
-        logger.error(f"Исключение при добавлении в чат {chat_id}: {e}")
+        if outcome in IN_CHAT_OUTCOMES:
+            success_count += 1
+
+    # Считаем успешным, если хотя бы один пользователь добавлен/уже в чате
+    if success_count > 0:
+        logger.info(f"Операция завершена: {success_count}/{len(user_ids)} пользователей в чате {chat_id}")
+        return True
+    else:
+        logger.error(f"Не удалось добавить ни одного пользователя в чат {chat_id}")
         return False
 
 
 def remove_users_from_chat(chat_id, user_ids):
     """
-    Удаляет пользователей из группового чата
+    Удаляет пользователей из группового чата (запросы выполняются параллельно)
 
     Args:
         chat_id: ID группового чата
         user_ids: список ID пользователей для удаления
 
     Returns:
-        bool: True если успешно, False если ошибка
+        bool: True если все пользователи вне чата, False если ошибка
     """
-    try:
-        url = f"{MAX_API_URL}/chats/{chat_id}/members"
-        headers = {
-            'Content-Type': 'application/json'
-        }
-
-        success = True
-        for user_id in user_ids:
-            params = {
-                'user_id': user_id,
-                'access_token': MAX_TOKEN
-            }
-            response = requests.delete(url, headers=headers, params=params, timeout=10)
+    outcomes = remove_members(chat_id, user_ids)
 
-            if response.status_code == 200:
-                logger.info(f"Пользователь {user_id} удалён из чата {chat_id}")
-            else:
-                logger.error(f"Ошибка удаления {user_id} из чата {chat_id}: {response.status_code}")
-                success = False
+    success = True
+    for user_id, outcome in outcomes.items():
+        if outcome in OUT_OF_CHAT_OUTCOMES:
+            logger.info(f"Пользователь {user_id} удалён из чата {chat_id}")
+        else:
+            logger.error(f"Ошибка удаления {user_id} из чата {chat_id}: {outcome}")
+            success = False
 
-        return success
+    return success
 
-    except Exception as e:
-        logger.error(f"Исключение при удалении из чата {chat_id}: {e}")
-        return False
 
-
-def get_free_chat_room(conn):
+def release_chat_room(room_id, request_id, chat_id, user_ids):
     """
-    Находит свободный чат из пула
+    Освобождает чат: удаляет участников и помечает как свободный
 
     Args:
-        conn: подключение к БД
+        room_id: ID записи в chat_rooms
+        request_id: ID заявки, которой принадлежит чат
+        chat_id: ID группового чата Max
+        user_ids: список ID пользователей для удаления
 
     Returns:
-        dict: информация о свободном чате или None
+        bool: True если участники удалены и чат помечен свободным
     """
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT id, chat_id, chat_title
-                FROM chat_rooms
-                WHERE is_occupied = FALSE
-                ORDER BY id
-                LIMIT 1
-                FOR UPDATE SKIP LOCKED
-            """)
-            result = cur.fetchone()
+    # Удаляем пользователей из чата. Если кто-то остался в чате,
+    # не отдаём его следующей заявке — освобождение будет повторено
+    if not remove_users_from_chat(chat_id, user_ids):
+        logger.error(f"Не удалось удалить участников из чата {chat_id}")
+        return False
 
-            if result:
-                return {
-                    'id': result[0],
-                    'chat_id': result[1],
-                    'chat_title': result[2]
-                }
-            return None
+    # Помечаем чат как свободный
+    if not release_room(room_id, request_id):
+        return False
 
-    except Exception as e:
-        logger.error(f"Ошибка поиска свободного чата: {e}")
-        return None
+    record_release()
+    logger.info(f"Чат {room_id} освобождён")
+    return True
 
 
-def occupy_chat_room(conn, room_id, request_id):
+def _setup_room(room, request_id, needy_user_id, volunteer_user_id):
     """
-    Помечает чат как занятый
-
-    Args:
-        conn: подключение к БД
-        room_id: ID записи в chat_rooms
-        request_id: ID заявки
+    Добавляет участников в зарезервированный чат и подтверждает аренду
 
     Returns:
-        bool: True если успешно
+        dict: {'success': True, 'room_id': int, 'chat_id': int} или None
     """
+    room_id = room['id']
+    chat_id = room['chat_id']
+
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE chat_rooms
-                SET is_occupied = TRUE,
-                    current_request_id = %s,
-                    occupied_at = NOW()
-                WHERE id = %s
-            """, (request_id, room_id))
-            conn.commit()
-            return True
+        # Добавляем участников в чат
+        user_ids = [int(needy_user_id), int(volunteer_user_id)]
+        success = add_users_to_chat(chat_id, user_ids)
     except Exception as e:
-        logger.error(f"Ошибка занятия чата {room_id}: {e}")
-        conn.rollback()
-        return False
-
+        logger.error(f"Ошибка назначения чата для заявки {request_id}: {e}")
+        success = False
 
-def release_chat_room(conn, room_id, chat_id, user_ids):
-    """
-    Освобождает чат: удаляет участников и помечает как свободный
+    if not success:
+        logger.error(f"Не удалось добавить участников в чат {chat_id}")
+        rollback_room(room_id, request_id)
+        return None
 
-    Args:
-        conn: подключение к БД
-        room_id: ID записи в chat_rooms
-        chat_id: ID группового чата Max
-        user_ids: список ID пользователей для удаления
+    # Продлеваем аренду на время диалога и связываем заявку с чатом
+    if not confirm_room(room_id, request_id):
+        return None
 
-    Returns:
-        bool: True если успешно
-    """
-    try:
-        # Удаляем пользователей из чата
-        remove_users_from_chat(chat_id, user_ids)
-
-        # Помечаем чат как свободный
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE chat_rooms
-                SET is_occupied = FALSE,
-                    current_request_id = NULL,
-                    occupied_at = NULL
-                WHERE id = %s
-            """, (room_id,))
-            conn.commit()
-
-        logger.info(f"Чат {room_id} освобождён")
-        return True
+    record_accept()
+    logger.info(f"Чат {chat_id} назначен для заявки {request_id}")
 
-    except Exception as e:
-        logger.error(f"Ошибка освобождения чата {room_id}: {e}")
-        conn.rollback()
-        return False
+    return {
+        'success': True,
+        'room_id': room_id,
+        'chat_id': chat_id
+    }
 
 
-def assign_chat_room_to_request(conn, request_id, needy_user_id, volunteer_user_id):
+def assign_chat_room_to_request(request_id, needy_user_id, volunteer_user_id,
+                                on_assigned=None, on_failed=None):
     """
     Назначает свободный чат для заявки и добавляет в него участников
 
+    Чат сначала резервируется в пуле (короткая транзакция с арендой),
+    затем выполняются HTTP-запросы к Max API. При ошибке аренда откатывается.
+
+    Если свободных чатов нет и передан on_assigned, заявка встаёт в очередь
+    ожидания; когда чат освободится, будет вызван on_assigned(result)
+    или on_failed(None), если добавить участников не удалось.
+
     Args:
-        conn: подключение к БД
         request_id: ID заявки
         needy_user_id: ID нуждающегося (числовой)
         volunteer_user_id: ID волонтёра (числовой)
+        on_assigned: колбэк для отложенного назначения (опционально)
+        on_failed: колбэк при неудаче отложенного назначения (опционально)
 
     Returns:
-        dict: {'success': bool, 'room_id': int, 'chat_id': int} или None
+        dict: {'success': True, 'room_id': int, 'chat_id': int},
+              {'success': False, 'queued': True, 'position': int} или None
     """
-    try:
-        # Находим свободный чат
-        room = get_free_chat_room(conn)
-        if not room:
+    room = reserve_room(request_id)
+    if not room:
+        if not on_assigned:
             logger.error("Нет свободных чатов в пуле!")
+            check_low_watermark()
             return None
 
-        room_id = room['id']
-        chat_id = room['chat_id']
+        position = enqueue_waiting({
+            'request_id': request_id,
+            'needy_user_id': needy_user_id,
+            'volunteer_user_id': volunteer_user_id,
+            'on_assigned': on_assigned,
+            'on_failed': on_failed,
+        })
+        # Отметка в БД: после перезапуска заявка вернётся в очередь
+        set_request_chat_queued(request_id, True)
+        logger.warning(f"Нет свободных чатов в пуле! Заявка {request_id} в очереди ({position})")
+        check_low_watermark()
+        return {
+            'success': False,
+            'queued': True,
+            'position': position
+        }
 
-        # Добавляем участников в чат
-        user_ids = [int(needy_user_id), int(volunteer_user_id)]
-        success = add_users_to_chat(chat_id, user_ids)
+    result = _setup_room(room, request_id, needy_user_id, volunteer_user_id)
+    check_low_watermark()
+    return result
 
-        if not success:
-            logger.error(f"Не удалось добавить участников в чат {chat_id}")
-            return None
 
-        # Помечаем чат как занятый
-        occupy_chat_room(conn, room_id, request_id)
+def drain_waiting_assignments():
+    """
+    Раздаёт освободившиеся чаты заявкам из очереди ожидания
+
+    Вызывается после освобождения чатов и после синхронизации пула.
+    Заявки, которые за время ожидания были завершены или отменены,
+    из очереди выбрасываются.
 
-        # Обновляем заявку - связываем с чатом
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE requests
-                SET chat_room_id = %s
-                WHERE id = %s
-            """, (room_id, request_id))
-            conn.commit()
+    Returns:
+        int: сколько заявок получили чат
+    """
+    # Очередь разбирает только один поток за раз
+    if not _drain_lock.acquire(blocking=False):
+        return 0
 
-        logger.info(f"Чат {chat_id} назначен для заявки {request_id}")
+    assigned = 0
+    try:
+        while True:
+            entry = pop_waiting()
+            if not entry:
+                break
+
+            request_id = entry['request_id']
+            request = get_request(request_id)
+            if not request or request.get('status') != 'active':
+                logger.info(f"Заявка {request_id} больше не активна, убираем из очереди чатов")
+                set_request_chat_queued(request_id, False)
+                continue
+
+            room = reserve_room(request_id)
+            if not room:
+                return_waiting(entry)
+                break
+
+            result = _setup_room(room, request_id, entry['needy_user_id'], entry['volunteer_user_id'])
+            callback = entry['on_assigned'] if result else entry['on_failed']
+            if result:
+                assigned += 1
+                logger.info(f"Заявка {request_id} получила чат после ожидания в очереди")
+            else:
+                set_request_chat_queued(request_id, False)
 
-        return {
-            'success': True,
-            'room_id': room_id,
-            'chat_id': chat_id
-        }
+            if callback:
+                try:
+                    callback(result)
+                except Exception as e:
+                    logger.error(f"Ошибка колбэка назначения чата для заявки {request_id}: {e}")
+    finally:
+        _drain_lock.release()
 
-    except Exception as e:
-        logger.error(f"Ошибка назначения чата для заявки {request_id}: {e}")
-        conn.rollback()
-        return None
+    return assigned
+
+
+def register_waiting_restorer(restorer):
+    """
+    Регистрирует функцию восстановления очереди ожидания после перезапуска
+
+    Колбэки on_assigned/on_failed живут только в памяти, поэтому запись
+    очереди по строке заявки собирает обработчик, который их создаёт.
+
+    Args:
+        restorer: функция fn(request) -> dict для enqueue_waiting или None
+    """
+    global _waiting_restorer
+    _waiting_restorer = restorer
+
+
+def restore_waiting_assignments():
+    """
+    Возвращает в очередь ожидания заявки, отмеченные в БД (requests.chat_queued_at)
+
+    Returns:
+        int: сколько заявок восстановлено
+    """
+    if _waiting_restorer is None:
+        return 0
+
+    restored = 0
+    for request in get_requests_waiting_for_chat():
+        request_id = str(request['id'])
+        try:
+            entry = _waiting_restorer(request)
+        except Exception as e:
+            logger.error(f"Ошибка восстановления заявки {request_id} в очереди чатов: {e}")
+            continue
+
+        if not entry:
+            set_request_chat_queued(request_id, False)
+            continue
+        enqueue_waiting(entry)
+        restored += 1
+
+    if restored:
+        logger.info(f"Восстановлено заявок в очереди ожидания чатов: {restored}")
+    return restored
@@ -0,0 +1,337 @@
+"""
+Пул групповых чатов с арендой (lease)
+
+Чат резервируется одной короткой транзакцией ещё до HTTP-запросов к Max API:
+строка помечается занятой, в неё записываются ID заявки и срок аренды.
+Если добавить участников не удалось, аренда откатывается. Блокировки строк
+никогда не удерживаются во время сетевых вызовов.
+
+Список свободных чатов кэшируется в памяти (warm free-list), поэтому в
+обычном случае резервирование — это один UPDATE по первичному ключу.
+"""
+import logging
+import time
+from collections import deque
+from threading import Lock
+from database import get_connection, release_connection
+from bot.config import (
+    CHAT_ROOM_LEASE_SECONDS,
+    CHAT_ROOM_SESSION_SECONDS,
+    CHAT_ROOM_FREE_LIST_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Кэш ID свободных чатов. Это только подсказка: окончательное решение
+# принимает условный UPDATE ... WHERE is_occupied = FALSE
+_free_rooms = deque()
+_lock = Lock()
+
+# Счётчики для мониторинга пула
+_stats = {
+    "reservations": 0,
+    "misses": 0,
+    "rollbacks": 0,
+    "releases": 0,
+    "wait_total": 0.0,
+    "wait_max": 0.0,
+}
+
+
+def _room_from_row(row):
+    return {
+        'id': row[0],
+        'chat_id': row[1],
+        'chat_title': row[2]
+    }
+
+
+def _claim_cached_room(cur, request_id, lease_seconds):
+    """Пытается занять чат из кэша свободных. Возвращает строку или None"""
+    while True:
+        with _lock:
+            if not _free_rooms:
+                return None
+            room_id = _free_rooms.popleft()
+
+        cur.execute("""
+            UPDATE chat_rooms
+            SET is_occupied = TRUE,
+                current_request_id = %s,
+                occupied_at = NOW(),
+                lease_expires_at = NOW() + make_interval(secs => %s)
+            WHERE id = %s AND is_occupied = FALSE
+            RETURNING id, chat_id, chat_title
+        """, (str(request_id), lease_seconds, room_id))
+        row = cur.fetchone()
+        if row:
+            return row
+        # Чат заняли в другом процессе или удалили — пробуем следующий
+
+
+def _claim_any_room(cur, request_id, lease_seconds):
+    """Занимает любой свободный чат и заново наполняет кэш"""
+    cur.execute("""
+        UPDATE chat_rooms
+        SET is_occupied = TRUE,
+            current_request_id = %s,
+            occupied_at = NOW(),
+            lease_expires_at = NOW() + make_interval(secs => %s)
+        WHERE id = (
+            SELECT id FROM chat_rooms
+            WHERE is_occupied = FALSE
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, chat_id, chat_title
+    """, (str(request_id), lease_seconds))
+    row = cur.fetchone()
+
+    cur.execute("""
+        SELECT id FROM chat_rooms
+        WHERE is_occupied = FALSE
+        ORDER BY id
+        LIMIT %s
+    """, (CHAT_ROOM_FREE_LIST_SIZE,))
+    free_ids = [r[0] for r in cur.fetchall()]
+
+    with _lock:
+        _free_rooms.clear()
+        _free_rooms.extend(free_ids)
+
+    return row
+
+
+def reserve_room(request_id, lease_seconds=CHAT_ROOM_LEASE_SECONDS):
+    """
+    Атомарно резервирует свободный чат за заявкой
+
+    Транзакция фиксируется сразу, до любых обращений к Max API.
+
+    Args:
+        request_id: ID заявки
+        lease_seconds: срок аренды на время настройки чата
+
+    Returns:
+        dict: {'id', 'chat_id', 'chat_title'} или None, если свободных чатов нет
+    """
+    started = time.monotonic()
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            row = _claim_cached_room(cur, request_id, lease_seconds)
+            if not row:
+                row = _claim_any_room(cur, request_id, lease_seconds)
+            conn.commit()
+
+        waited = time.monotonic() - started
+        with _lock:
+            if row:
+                _stats["reservations"] += 1
+            else:
+                _stats["misses"] += 1
+            _stats["wait_total"] += waited
+            _stats["wait_max"] = max(_stats["wait_max"], waited)
+
+        if not row:
+            return None
+
+        room = _room_from_row(row)
+        logger.info(f"Чат {room['chat_id']} зарезервирован для заявки {request_id} ({waited * 1000:.0f} мс)")
+        return room
+
+    except Exception as e:
+        logger.error(f"Ошибка резервирования чата для заявки {request_id}: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def confirm_room(room_id, request_id, session_seconds=CHAT_ROOM_SESSION_SECONDS):
+    """
+    Подтверждает аренду после успешного добавления участников
+
+    Продлевает аренду на время диалога и связывает заявку с чатом.
+
+    Returns:
+        bool: True если аренда всё ещё принадлежит заявке
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE chat_rooms
+                SET lease_expires_at = NOW() + make_interval(secs => %s)
+                WHERE id = %s AND current_request_id = %s
+            """, (session_seconds, room_id, str(request_id)))
+            if cur.rowcount == 0:
+                conn.rollback()
+                logger.error(f"Аренда чата {room_id} для заявки {request_id} уже утрачена")
+                return False
+
+            cur.execute("""
+                UPDATE requests
+                SET chat_room_id = %s,
+                    chat_queued_at = NULL
+                WHERE id = %s
+            """, (room_id, str(request_id)))
+            conn.commit()
+            return True
+
+    except Exception as e:
+        logger.error(f"Ошибка подтверждения аренды чата {room_id}: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def rollback_room(room_id, request_id):
+    """
+    Откатывает аренду, если настройка чата не удалась
+
+    Чат освобождается, только если он всё ещё принадлежит этой заявке.
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE chat_rooms
+                SET is_occupied = FALSE,
+                    current_request_id = NULL,
+                    occupied_at = NULL,
+                    lease_expires_at = NULL
+                WHERE id = %s AND current_request_id = %s
+            """, (room_id, str(request_id)))
+            rolled_back = cur.rowcount > 0
+            conn.commit()
+
+        if rolled_back:
+            with _lock:
+                _stats["rollbacks"] += 1
+                _free_rooms.appendleft(room_id)
+            logger.info(f"Аренда чата {room_id} для заявки {request_id} откатена")
+        return rolled_back
+
+    except Exception as e:
+        logger.error(f"Ошибка отката аренды чата {room_id}: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def release_room(room_id, request_id):
+    """
+    Помечает чат свободным и возвращает его в кэш
+
+    Чат освобождается, только если он всё ещё принадлежит этой заявке:
+    запоздалое или повторное завершение не освободит чат следующей заявки.
+
+    Args:
+        room_id: ID записи в chat_rooms
+        request_id: ID заявки, для которой освобождается чат
+            (None — заявка удалена и ссылка на неё обнулена)
+
+    Returns:
+        bool: True если чат освобождён или уже был освобождён
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE chat_rooms
+                SET is_occupied = FALSE,
+                    current_request_id = NULL,
+                    occupied_at = NULL,
+                    lease_expires_at = NULL
+                WHERE id = %s AND is_occupied = TRUE
+                AND current_request_id IS NOT DISTINCT FROM %s
+            """, (room_id, str(request_id) if request_id is not None else None))
+            released = cur.rowcount > 0
+            conn.commit()
+
+        if not released:
+            logger.info(f"Чат {room_id} уже освобождён от заявки {request_id}")
+            return True
+
+        with _lock:
+            _stats["releases"] += 1
+            if len(_free_rooms) < CHAT_ROOM_FREE_LIST_SIZE and room_id not in _free_rooms:
+                _free_rooms.append(room_id)
+        return True
+
+    except Exception as e:
+        logger.error(f"Ошибка освобождения чата {room_id}: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def invalidate_free_list():
+    """Сбрасывает кэш свободных чатов (например, после синхронизации пула)"""
+    with _lock:
+        _free_rooms.clear()
+
+
+def get_pool_stats():
+    """
+    Возвращает состояние пула: размер, занятость и время ожидания резервирования
+
+    Returns:
+        dict: статистика пула или None при ошибке БД
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE is_occupied),
+                    COUNT(*) FILTER (WHERE is_occupied AND lease_expires_at < NOW())
+                FROM chat_rooms
+            """)
+            total, occupied, expired = cur.fetchone()
+
+        with _lock:
+            stats = dict(_stats)
+            cached = len(_free_rooms)
+
+        attempts = stats["reservations"] + stats["misses"]
+        return {
+            'total': total,
+            'occupied': occupied,
+            'free': total - occupied,
+            'expired_leases': expired,
+            'occupancy': occupied / total if total else 0.0,
+            'cached_free': cached,
+            'reservations': stats["reservations"],
+            'misses': stats["misses"],
+            'rollbacks': stats["rollbacks"],
+            'releases': stats["releases"],
+            'avg_wait_ms': stats["wait_total"] / attempts * 1000 if attempts else 0.0,
+            'max_wait_ms': stats["wait_max"] * 1000,
+        }
+
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики пула чатов: {e}")
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
@@ -0,0 +1,280 @@
+"""
+Фоновое освобождение групповых чатов
+
+- Очередь освобождения: завершение заявки только ставит задачу в очередь,
+  удаление участников и UPDATE в БД выполняются в фоновом потоке
+- Повторные попытки с экспоненциальной задержкой
+- Периодический сборщик (reaper): находит чаты, которые остались занятыми,
+  хотя заявка завершена, отменена или удалена, а также резервирования,
+  которые так и не были подтверждены до истечения аренды
+- Освобождение всегда привязано к заявке: чат, который уже принадлежит
+  другой заявке, не трогается
+"""
+import logging
+import queue
+import time
+import threading
+from database import get_connection, release_connection
+from bot.chat_room_manager import (
+    release_chat_room, drain_waiting_assignments, restore_waiting_assignments
+)
+from bot.chat_membership import list_members
+from bot.chat_pool_capacity import get_waiting_count
+from bot.config import (
+    CHAT_RELEASE_MAX_ATTEMPTS,
+    CHAT_RELEASE_RETRY_DELAY,
+    CHAT_REAPER_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Глобальный флаг для остановки потока
+_stop_flag = False
+_releaser_thread = None
+
+_release_queue = queue.Queue()
+
+# Отложенные повторы: [(время_запуска, задача)]
+_retry_jobs = []
+# (ID чата, ID заявки), которые уже стоят в очереди или ждут повтора
+_pending_rooms = set()
+_lock = threading.Lock()
+
+_stats = {
+    "released": 0,
+    "retries": 0,
+    "failed": 0,
+    "reaped": 0,
+}
+
+
+def start_chat_room_releaser():
+    """Запускает фоновый поток освобождения чатов"""
+    global _releaser_thread, _stop_flag
+
+    if _releaser_thread and _releaser_thread.is_alive():
+        logger.warning("Chat room releaser уже запущен")
+        return
+
+    _stop_flag = False
+    _releaser_thread = threading.Thread(target=_releaser_loop, daemon=True)
+    _releaser_thread.start()
+    logger.info("Chat room releaser запущен")
+
+
+def stop_chat_room_releaser():
+    """Останавливает фоновый поток"""
+    global _stop_flag
+    _stop_flag = True
+    logger.info("Chat room releaser остановлен")
+
+
+def enqueue_release(room_id, request_id):
+    """
+    Ставит чат в очередь на освобождение
+
+    Args:
+        room_id: ID записи в chat_rooms
+        request_id: ID заявки, для которой освобождается чат
+            (None — заявка удалена)
+
+    Returns:
+        bool: False если чат уже ожидает освобождения для этой заявки
+    """
+    if request_id is not None:
+        request_id = str(request_id)
+    key = (room_id, request_id)
+    with _lock:
+        if key in _pending_rooms:
+            return False
+        _pending_rooms.add(key)
+
+    _release_queue.put({"room_id": room_id, "request_id": request_id, "attempt": 0})
+    logger.info(f"Чат {room_id} поставлен в очередь на освобождение (заявка {request_id})")
+    return True
+
+
+def get_releaser_stats():
+    """Возвращает размер очереди и счётчики освобождения"""
+    with _lock:
+        stats = dict(_stats)
+        stats["retrying"] = len(_retry_jobs)
+    stats["queued"] = _release_queue.qsize()
+    return stats
+
+
+def _releaser_loop():
+    """Основной цикл: обработка очереди, повторы и периодический сборщик"""
+    next_reap = time.monotonic()
+
+    # Заявки, ожидавшие чат до перезапуска, раздаются на первом проходе сборщика
+    try:
+        restore_waiting_assignments()
+    except Exception as e:
+        logger.error(f"Ошибка восстановления очереди ожидания чатов: {e}")
+
+    while not _stop_flag:
+        try:
+            _requeue_due_retries()
+
+            if time.monotonic() >= next_reap:
+                _reap_stuck_rooms()
+                # Чаты могли освободиться без нас (откат аренды, другой процесс)
+                if get_waiting_count():
+                    drain_waiting_assignments()
+                next_reap = time.monotonic() + CHAT_REAPER_INTERVAL
+
+            try:
+                job = _release_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            _process_release(job)
+
+        except Exception as e:
+            logger.error(f"Ошибка в chat room releaser: {e}", exc_info=True)
+            time.sleep(1)
+
+
+def _requeue_due_retries():
+    """Возвращает в очередь повторы, у которых подошло время"""
+    now = time.monotonic()
+    with _lock:
+        due = [job for run_at, job in _retry_jobs if run_at <= now]
+        _retry_jobs[:] = [(run_at, job) for run_at, job in _retry_jobs if run_at > now]
+
+    for job in due:
+        _release_queue.put(job)
+
+
+def _load_room_members(room_id, request_id):
+    """
+    Получает chat_id чата и числовые user_id участников заявки
+
+    Участники берутся из заявки request_id, а не из той, что записана в чате
+    сейчас. Если заявка удалена, участники запрашиваются у Max API.
+
+    Returns:
+        tuple: (chat_id, [user_id, ...]);
+               (None, []) если чат не найден или уже не принадлежит заявке;
+               (chat_id, None) если участников получить не удалось
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT cr.chat_id, r.id, needy.user_id, volunteer.user_id
+                FROM chat_rooms cr
+                LEFT JOIN requests r ON r.id = cr.current_request_id
+                LEFT JOIN users needy ON needy.id = r.user_id
+                LEFT JOIN users volunteer ON volunteer.id = r.assigned_volunteer_id
+                WHERE cr.id = %s AND cr.is_occupied = TRUE
+                AND cr.current_request_id IS NOT DISTINCT FROM %s
+            """, (room_id, request_id))
+            row = cur.fetchone()
+    finally:
+        if conn:
+            release_connection(conn)
+
+    if not row:
+        return None, []
+
+    chat_id, found_request_id = row[0], row[1]
+    if found_request_id is None:
+        # Заявки нет — удаляем тех, кто фактически остался в чате
+        return chat_id, list_members(chat_id)
+    return chat_id, [user_id for user_id in row[2:] if user_id]
+
+
+def _process_release(job):
+    """Освобождает один чат; при ошибке планирует повтор"""
+    room_id = job["room_id"]
+    request_id = job["request_id"]
+
+    try:
+        chat_id, user_ids = _load_room_members(room_id, request_id)
+        if chat_id is None:
+            logger.info(f"Чат {room_id} уже не принадлежит заявке {request_id}, освобождение пропущено")
+            success = True
+        elif user_ids is None:
+            logger.error(f"Не удалось получить участников чата {room_id}, чат не освобождён")
+            success = False
+        else:
+            success = release_chat_room(room_id, request_id, chat_id, user_ids)
+    except Exception as e:
+        logger.error(f"Ошибка освобождения чата {room_id}: {e}")
+        success = False
+
+    key = (room_id, request_id)
+    if success:
+        with _lock:
+            _pending_rooms.discard(key)
+            _stats["released"] += 1
+        logger.info(f"Чат {room_id} освобождён (заявка {request_id})")
+
+        # Освободившийся чат сразу отдаём заявке из очереди ожидания
+        if get_waiting_count():
+            drain_waiting_assignments()
+        return
+
+    job["attempt"] += 1
+    if job["attempt"] >= CHAT_RELEASE_MAX_ATTEMPTS:
+        # Чат останется занятым; сборщик попробует снова на следующем проходе
+        with _lock:
+            _pending_rooms.discard(key)
+            _stats["failed"] += 1
+        logger.error(f"Не удалось освободить чат {room_id} после {job['attempt']} попыток")
+        return
+
+    delay = CHAT_RELEASE_RETRY_DELAY * (2 ** (job["attempt"] - 1))
+    with _lock:
+        _retry_jobs.append((time.monotonic() + delay, job))
+        _stats["retries"] += 1
+    logger.warning(f"Повтор освобождения чата {room_id} через {delay:.0f} сек (попытка {job['attempt'] + 1})")
+
+
+def _reap_stuck_rooms():
+    """
+    Находит занятые чаты, которые должны быть свободны, и ставит их в очередь
+
+    Чат считается зависшим, если его заявка завершена, отменена или удалена,
+    либо если истекла аренда резервирования, которое не было подтверждено
+    (заявка не связана с чатом). Подтверждённый чат идущего диалога не
+    освобождается, сколько бы диалог ни длился.
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT cr.id, cr.current_request_id
+                FROM chat_rooms cr
+                LEFT JOIN requests r ON r.id = cr.current_request_id
+                WHERE cr.is_occupied = TRUE
+                AND (
+                    r.id IS NULL
+                    OR r.status IN ('completed', 'cancelled')
+                    OR (
+                        cr.lease_expires_at < NOW()
+                        AND r.chat_room_id IS DISTINCT FROM cr.id
+                    )
+                )
+            """)
+            stuck_rooms = cur.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка поиска зависших чатов: {e}")
+        return
+    finally:
+        if conn:
+            release_connection(conn)
+
+    reaped = 0
+    for room_id, request_id in stuck_rooms:
+        if enqueue_release(room_id, request_id):
+            reaped += 1
+
+    if reaped:
+        with _lock:
+            _stats["reaped"] += reaped
+        logger.warning(f"Сборщик: {reaped} зависших чатов поставлено на освобождение")
@@ -36,3 +36,179 @@ HEADERS = {"Content-Type": "application/json"}
 # Пути
 DOWNLOADS_DIR = "downloads"
 MODELS_DIR = "models"
+
+# Пул групповых чатов
+# Срок аренды чата на время добавления участников (секунды)
+CHAT_ROOM_LEASE_SECONDS = int(os.getenv("CHAT_ROOM_LEASE_SECONDS", "60"))
+# Срок аренды на время диалога после успешной настройки чата (секунды);
+# по нему только видно долгие диалоги в статистике, сборщик их не освобождает
+CHAT_ROOM_SESSION_SECONDS = int(os.getenv("CHAT_ROOM_SESSION_SECONDS", "10800"))
+# Сколько свободных чатов держать в кэше в памяти
+CHAT_ROOM_FREE_LIST_SIZE = int(os.getenv("CHAT_ROOM_FREE_LIST_SIZE", "20"))
+
+# Операции с участниками групповых чатов
+# Максимум одновременных запросов к Max API при удалении/добавлении участников
+MEMBERSHIP_CONCURRENCY = int(os.getenv("MEMBERSHIP_CONCURRENCY", "4"))
+# Таймауты (подключение, чтение) в секундах
+MEMBERSHIP_TIMEOUT = (
+    float(os.getenv("MEMBERSHIP_CONNECT_TIMEOUT", "3")),
+    float(os.getenv("MEMBERSHIP_READ_TIMEOUT", "10")),
+)
+
+# Фоновое освобождение чатов
+# Сколько раз пытаться освободить чат, прежде чем оставить его сборщику
+CHAT_RELEASE_MAX_ATTEMPTS = int(os.getenv("CHAT_RELEASE_MAX_ATTEMPTS", "5"))
+# Базовая задержка перед повтором (удваивается с каждой попыткой), секунды
+CHAT_RELEASE_RETRY_DELAY = float(os.getenv("CHAT_RELEASE_RETRY_DELAY", "5"))
+# Как часто искать зависшие занятые чаты, секунды
+CHAT_REAPER_INTERVAL = int(os.getenv("CHAT_REAPER_INTERVAL", "60"))
+
+# Синхронизация пула групповых чатов
+# Интервал фоновой синхронизации, секунды
+CHAT_POOL_SYNC_INTERVAL = int(os.getenv("CHAT_POOL_SYNC_INTERVAL", "300"))
+# Сколько последних синхронизаций хранить в истории состояния пула
+CHAT_POOL_HEALTH_HISTORY = int(os.getenv("CHAT_POOL_HEALTH_HISTORY", "288"))
+
+# Ёмкость пула групповых чатов
+# Нижний порог свободных чатов, при котором срабатывают хуки (синхронизация, уведомление модераторов)
+CHAT_POOL_LOW_WATERMARK = int(os.getenv("CHAT_POOL_LOW_WATERMARK", "2"))
+# Окно для расчёта темпа принятия/освобождения чатов, секунды
+CHAT_POOL_RATE_WINDOW = int(os.getenv("CHAT_POOL_RATE_WINDOW", "900"))
+# Минимальный интервал между срабатываниями хуков нижнего порога, секунды
+CHAT_POOL_WATERMARK_COOLDOWN = int(os.getenv("CHAT_POOL_WATERMARK_COOLDOWN", "600"))
+# Минимальный интервал между проверками нижнего порога (запрос к БД), секунды
+CHAT_POOL_WATERMARK_CHECK_INTERVAL = int(os.getenv("CHAT_POOL_WATERMARK_CHECK_INTERVAL", "30"))
+
+# Распознавание речи (пул процессов Vosk)
+# Число рабочих процессов; каждый один раз загружает свою копию модели
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", "2"))
+# Максимум заданий в очереди и в работе одновременно, остальные отклоняются
+VOICE_QUEUE_SIZE = int(os.getenv("VOICE_QUEUE_SIZE", "16"))
+# Таймаут одного задания (ожидание в очереди + распознавание), секунды
+VOICE_JOB_TIMEOUT = float(os.getenv("VOICE_JOB_TIMEOUT", "120"))
+# Минимальный интервал между редактированиями сообщения с промежуточным текстом, секунды
+VOICE_PARTIAL_EDIT_INTERVAL = float(os.getenv("VOICE_PARTIAL_EDIT_INTERVAL", "2"))
+
+# Кэш результатов распознавания по содержимому файлов
+CONTENT_CACHE_ENABLED = os.getenv("CONTENT_CACHE_ENABLED", "true").lower() == "true"
+# Постоянное хранилище: postgres | disk | memory (только LRU в памяти)
+CONTENT_CACHE_BACKEND = os.getenv("CONTENT_CACHE_BACKEND", "postgres").lower()
+# Сколько записей держать в памяти
+CONTENT_CACHE_SIZE = int(os.getenv("CONTENT_CACHE_SIZE", "1000"))
+# Срок жизни записи, секунды (по умолчанию 30 дней)
+CONTENT_CACHE_TTL = int(os.getenv("CONTENT_CACHE_TTL", "2592000"))
+# Папка для CONTENT_CACHE_BACKEND=disk
+CONTENT_CACHE_DIR = os.getenv("CONTENT_CACHE_DIR", "cache")
+
+# Таблица голосовых команд (фразы и веса), загружается при старте
+VOICE_COMMANDS_FILE = os.getenv(
+    "VOICE_COMMANDS_FILE",
+    os.path.join(os.path.dirname(__file__), "voice_commands.json"),
+)
+
+# Предобработка голосовых перед распознаванием
+# Максимальная длительность голосового, секунды
+VOICE_MAX_DURATION = int(os.getenv("VOICE_MAX_DURATION", "300"))
+# Что делать с более длинными: truncate (распознать начало) | reject (отказать)
+VOICE_OVERLONG_POLICY = os.getenv("VOICE_OVERLONG_POLICY", "truncate").lower()
+# Обрезка тишины в начале и в конце (энергетический VAD)
+VOICE_VAD_ENABLED = os.getenv("VOICE_VAD_ENABLED", "true").lower() == "true"
+# Порог RMS (16-бит PCM), выше которого кусок считается речью
+VOICE_VAD_THRESHOLD = int(os.getenv("VOICE_VAD_THRESHOLD", "300"))
+
+# Клиент GigaChat Vision
+# Одновременных соединений с API GigaChat (клиент переиспользуется)
+VISION_MAX_CONNECTIONS = int(os.getenv("VISION_MAX_CONNECTIONS", "4"))
+# Таймаут запроса к GigaChat, секунды
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "60"))
+# Как долго считать список моделей актуальным, секунды
+VISION_MODELS_TTL = int(os.getenv("VISION_MODELS_TTL", "3600"))
+# Сколько раз пытаться удалить загруженный файл с сервера GigaChat
+VISION_DELETE_MAX_ATTEMPTS = int(os.getenv("VISION_DELETE_MAX_ATTEMPTS", "3"))
+# Подготовка фото перед отправкой в GigaChat
+# Максимальная длина большей стороны, пиксели
+VISION_MAX_EDGE = int(os.getenv("VISION_MAX_EDGE", "1280"))
+# Качество JPEG; снижается, пока файл не уложится в VISION_MAX_UPLOAD_BYTES
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+VISION_MAX_UPLOAD_BYTES = int(os.getenv("VISION_MAX_UPLOAD_BYTES", "400000"))
+
+# Очередь распознавания изображений
+# Потоков обработки (ждут ответа GigaChat, CPU почти не используют)
+VISION_WORKERS = int(os.getenv("VISION_WORKERS", "3"))
+# Максимум заданий в очереди
+VISION_QUEUE_SIZE = int(os.getenv("VISION_QUEUE_SIZE", "50"))
+# Максимум заданий одного пользователя (в очереди + в работе)
+VISION_USER_LIMIT = int(os.getenv("VISION_USER_LIMIT", "2"))
+# Таймаут задания (ожидание в очереди + обработка), секунды
+VISION_JOB_TIMEOUT = float(os.getenv("VISION_JOB_TIMEOUT", "120"))
+
+# Бэкенд описания изображений: gigachat | stub (локальная заглушка для нагрузочных тестов)
+VISION_BACKEND = os.getenv("VISION_BACKEND", "gigachat").lower()
+# Заглушка: задержка ответа (база + от 0 до JITTER), доля ошибок 0.0-1.0
+VISION_STUB_LATENCY = float(os.getenv("VISION_STUB_LATENCY", "2.0"))
+VISION_STUB_JITTER = float(os.getenv("VISION_STUB_JITTER", "1.0"))
+VISION_STUB_FAILURE_RATE = float(os.getenv("VISION_STUB_FAILURE_RATE", "0.0"))
+
+# Похожие снимки (перцептивный хэш)
+# Искать описание среди похожих недавних снимков того же чата
+VISION_DUP_ENABLED = os.getenv("VISION_DUP_ENABLED", "true").lower() == "true"
+# Максимальное расстояние Хэмминга между dHash (из 64 бит)
+VISION_DUP_THRESHOLD = int(os.getenv("VISION_DUP_THRESHOLD", "6"))
+# Сколько секунд снимок считается недавним
+VISION_DUP_WINDOW = int(os.getenv("VISION_DUP_WINDOW", "600"))
+# Максимум снимков в индексе
+VISION_DUP_MAX_ENTRIES = int(os.getenv("VISION_DUP_MAX_ENTRIES", "5000"))
+
+# Скачивание вложений
+# Максимальный размер фото и голосового, байты
+MEDIA_MAX_IMAGE_BYTES = int(os.getenv("MEDIA_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+MEDIA_MAX_AUDIO_BYTES = int(os.getenv("MEDIA_MAX_AUDIO_BYTES", str(20 * 1024 * 1024)))
+# Сколько байтов вложения держать в памяти, остальное — во временном файле
+MEDIA_SPOOL_BYTES = int(os.getenv("MEDIA_SPOOL_BYTES", str(1024 * 1024)))
+# Таймауты (подключение, чтение) в секундах
+MEDIA_FETCH_TIMEOUT = (
+    float(os.getenv("MEDIA_CONNECT_TIMEOUT", "5")),
+    float(os.getenv("MEDIA_READ_TIMEOUT", "30")),
+)
+# Проверять сертификаты TLS при скачивании вложений
+MEDIA_VERIFY_TLS = os.getenv("MEDIA_VERIFY_TLS", "true").lower() == "true"
+
+# Временные файлы
+# Размещать временные файлы в /dev/shm (tmpfs, в памяти) вместо DOWNLOADS_DIR
+SCRATCH_USE_RAM = os.getenv("SCRATCH_USE_RAM", "false").lower() == "true"
+# Файлы старше этого возраста удаляются уборщиком, секунды
+SCRATCH_MAX_AGE = int(os.getenv("SCRATCH_MAX_AGE", "3600"))
+# Как часто запускать уборку, секунды
+SCRATCH_JANITOR_INTERVAL = int(os.getenv("SCRATCH_JANITOR_INTERVAL", "600"))
+
+# Состояния диалогов (ждём документы, пишет жалобу и т.п.)
+# Бэкенд: memory — в памяти процесса, postgres — UNLOGGED таблица (общая для нескольких процессов)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+# Срок жизни состояния по умолчанию, секунды
+STATE_DEFAULT_TTL = int(os.getenv("STATE_DEFAULT_TTL", "3600"))
+# Максимум записей в памяти (бэкенд memory)
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))
+# Как часто удалять истёкшие записи, секунды
+STATE_SWEEP_INTERVAL = int(os.getenv("STATE_SWEEP_INTERVAL", "300"))
+
+# Защита от двойных нажатий (debounce)
+# Время ожидания между одинаковыми действиями, секунды
+DEBOUNCE_TIME = float(os.getenv("DEBOUNCE_TIME", "2"))
+# Число сегментов с отдельными блокировками
+DEBOUNCE_STRIPES = int(os.getenv("DEBOUNCE_STRIPES", "64"))
+# memory — в пределах процесса, postgres — общая таблица для нескольких процессов
+DEBOUNCE_BACKEND = os.getenv("DEBOUNCE_BACKEND", "memory").lower()
+
+# Обработка нажатий на кнопки
+# Потоков, выполняющих обработчики кнопок
+CALLBACK_WORKERS = int(os.getenv("CALLBACK_WORKERS", "4"))
+# Если обработчик не ответил за это время (секунды), отправляется промежуточный ответ
+CALLBACK_ACK_BUDGET = float(os.getenv("CALLBACK_ACK_BUDGET", "0.5"))
+# Текст промежуточного ответа
+CALLBACK_INTERIM_TEXT = os.getenv("CALLBACK_INTERIM_TEXT", "⏳ Выполняется...")
+
+# Кэш меню
+# Сколько секунд хранится роль и статус пользователя (изменения в этом процессе сбрасывают кэш сразу)
+MENU_CACHE_TTL = int(os.getenv("MENU_CACHE_TTL", "300"))
+# Максимум пользователей в кэше
+MENU_CACHE_MAX_ENTRIES = int(os.getenv("MENU_CACHE_MAX_ENTRIES", "10000"))
@@ -1,21 +1,27 @@
 """
 Обработчики callback запросов
+
+Payload кнопок сопоставляются с таблицей маршрутов callback_router
+(bot.utils.router): аргументы разбираются и проверяются до вызова
+обработчика, неизвестный или повреждённый payload отклоняется сразу.
 """
 
 import logging
-from database import get_user
+from collections import namedtuple
 from bot.utils import answer_callback, send_message
 from bot.utils.debounce import is_action_allowed
+from bot.utils.callback_service import CallbackAck, submit_callback
+from bot.utils.router import Router
 from .menu import (
     handle_role_selection,
-    show_needy_menu,
-    show_volunteer_menu,
+    show_menu_for_user,
     show_moderator_menu,
 )
 from .requests import (
     handle_request_call,
     handle_accept_request,
     handle_complete_request,
+    handle_cancel_request,
     handle_add_tag,
     handle_skip_tags,
     handle_rate_volunteer,
@@ -47,6 +53,109 @@ from .volunteer import show_volunteer_stats, show_active_requests_list
 
 logger = logging.getLogger(__name__)
 
+# Нажатие кнопки: передаётся первым аргументом каждому обработчику маршрута
+Press = namedtuple("Press", "ack chat_id username user_id message_id")
+
+callback_router = Router("callback")
+
+
+def _chat_route(patterns, handler, critical=False):
+    """Маршрут для обработчика вида handler(chat_id, *аргументы_шаблона)"""
+    callback_router.add(
+        patterns,
+        lambda press, **params: handler(press.chat_id, *params.values()),
+        critical=critical,
+    )
+
+
+# Выбор роли
+@callback_router.route("role_volunteer")
+def _role_volunteer(press):
+    handle_role_selection(press.chat_id, "volunteer", press.username, press.user_id, press.message_id)
+
+
+@callback_router.route("role_needy")
+def _role_needy(press):
+    handle_role_selection(press.chat_id, "needy", press.username, press.user_id, press.message_id)
+
+
+# Кнопка "Меню"
+@callback_router.route("menu")
+def _menu(press):
+    if not show_menu_for_user(press.chat_id):
+        send_message(press.chat_id, "Используйте /start для регистрации")
+
+
+# Навигационные кнопки
+@callback_router.route(["show_menu", "refresh_menu"])
+def _refresh_menu(press):
+    show_menu_for_user(press.chat_id)
+
+
+_chat_route("moderator_menu", show_moderator_menu)
+
+
+# Функции нуждающегося
+@callback_router.route("request_call", critical=True)
+def _request_call(press):
+    handle_request_call(press.chat_id, press.username, press.user_id, press.message_id)
+
+
+_chat_route("image_to_text", handle_image_to_text_request, critical=True)
+# _chat_route("sos", handle_sos, critical=True)  # Закомментировано
+_chat_route("voice_to_text", handle_voice_to_text_request, critical=True)
+
+
+@callback_router.route("text_to_voice")
+def _text_to_voice(press):
+    press.ack.answer("Эта функция скоро будет доступна!")
+
+
+# Обработка запросов волонтёров
+@callback_router.route("accept_request_{request_id:id}", critical=True)
+def _accept_request(press, request_id):
+    if handle_accept_request(press.chat_id, request_id, press.username, press.ack.callback_id):
+        press.ack.answer()
+    else:
+        press.ack.answer("Этот запрос уже принят другим волонтёром")
+
+
+_chat_route("complete_request_{request_id:id}", handle_complete_request, critical=True)
+_chat_route("cancel_request_{request_id:id}", handle_cancel_request, critical=True)
+_chat_route("add_tag_{request_id:id}_{tag}", handle_add_tag)
+_chat_route("skip_tags_{request_id:id}", handle_skip_tags)
+_chat_route("rate_volunteer_{request_id:id}_{rating:int}", handle_rate_volunteer)
+
+# Функции волонтёра
+_chat_route("my_stats", show_volunteer_stats)
+_chat_route("active_requests", show_active_requests_list)
+
+# Верификация волонтеров
+_chat_route("request_verification", handle_verification_request, critical=True)
+
+# Запросы на описание фото
+_chat_route("request_photo_description", handle_photo_description_request, critical=True)
+_chat_route("volunteer_photo_requests", show_photo_requests_for_volunteer)
+_chat_route("take_photo_{request_id:int}", handle_take_photo_request, critical=True)
+_chat_route("view_photo_{request_id:int}", handle_take_photo_request)
+_chat_route("photo_helpful_{request_id:int}", handle_photo_helpful, critical=True)
+_chat_route("photo_not_helpful_{request_id:int}", handle_photo_not_helpful, critical=True)
+
+# Жалобы
+_chat_route("complaint_{request_id:id}", handle_complaint)
+
+# Модератор - Верификация
+_chat_route("mod_verifications", show_verification_requests)
+_chat_route("mod_verify_{request_id:int}", show_verification_request_details)
+_chat_route("mod_approve_{request_id:int}", approve_verification)
+_chat_route("mod_reject_{request_id:int}", reject_verification)
+
+# Модератор - Жалобы
+_chat_route("mod_complaints", show_complaints)
+_chat_route("mod_complaint_{complaint_id:int}", show_complaint_details)
+_chat_route("mod_block_{complaint_id:int}", block_volunteer)
+_chat_route("mod_dismiss_{complaint_id:int}", dismiss_complaint)
+
 
 def handle_callback(update):
     """Обработка callback query"""
@@ -76,225 +185,20 @@ def handle_callback(update):
 
     logger.info(f"Callback от {username}: {payload}")
 
-    # Проверяем debounce для критичных действий
-    critical_actions = [
-        "request_call",
-        "image_to_text",
-        "voice_to_text",  # "sos" закомментировано
-        "request_verification",
-        "request_photo_description",
-    ]
-
-    # Также проверяем действия, начинающиеся с определённых префиксов
-    critical_prefixes = [
-        "accept_request_",
-        "complete_request_",
-        "cancel_request_",
-        "take_photo_",
-        "photo_helpful_",
-        "photo_not_helpful_",
-    ]
-
-    is_critical = payload in critical_actions or any(
-        payload.startswith(prefix) for prefix in critical_prefixes
-    )
+    matched = callback_router.match(payload)
+    if matched is None:
+        logger.warning(f"Неизвестный payload: {payload}")
+        answer_callback(callback_id, "Неизвестная команда")
+        return
 
-    if is_critical and not is_action_allowed(chat_id, payload):
+    # Проверяем debounce для критичных действий
+    route, _ = matched
+    if route.critical and not is_action_allowed(chat_id, payload):
         answer_callback(callback_id, "⏳ Подождите немного перед повторным действием")
         return
 
-    # Выбор роли
-    if payload == "role_volunteer":
-        handle_role_selection(chat_id, "volunteer", username, user_id, message_id)
-        answer_callback(callback_id)
-
-    elif payload == "role_needy":
-        handle_role_selection(chat_id, "needy", username, user_id, message_id)
-        answer_callback(callback_id)
-
-    # Кнопка "Меню"
-    elif payload == "menu":
-        user = get_user(chat_id)
-        if user:
-            role = user.get("role")
-            if role == "needy":
-                show_needy_menu(chat_id)
-            elif role == "volunteer":
-                show_volunteer_menu(chat_id)
-            elif role == "moderator":
-                show_moderator_menu(chat_id)
-        else:
-            send_message(chat_id, "Используйте /start для регистрации")
-        answer_callback(callback_id)
-
-    # Функции нуждающегося
-    elif payload == "request_call":
-        handle_request_call(chat_id, username, user_id, message_id)
-        answer_callback(callback_id)
-
-    elif payload == "image_to_text":
-        handle_image_to_text_request(chat_id)
-        answer_callback(callback_id)
-
-    # elif payload == "sos":  # Закомментировано
-    #     handle_sos(chat_id, username, user_id)
-    #     answer_callback(callback_id)
-
-    elif payload == "voice_to_text":
-        handle_voice_to_text_request(chat_id)
-        answer_callback(callback_id)
-
-    elif payload == "text_to_voice":
-        answer_callback(callback_id, "Эта функция скоро будет доступна!")
-
-    # Обработка запросов волонтёров
-    elif payload.startswith("accept_request_"):
-        request_id = payload.replace("accept_request_", "")
-        success = handle_accept_request(chat_id, request_id, username, callback_id)
-        if success:
-            answer_callback(callback_id)
-        else:
-            answer_callback(callback_id, "Этот запрос уже принят другим волонтёром")
-
-    elif payload.startswith("complete_request_"):
-        request_id = payload.replace("complete_request_", "")
-        handle_complete_request(chat_id, request_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("cancel_request_"):
-        request_id = int(payload.replace("cancel_request_", ""))
-        from .requests import handle_cancel_request
-
-        handle_cancel_request(chat_id, request_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("add_tag_"):
-        # Формат: add_tag_{request_id}_{tag}
-        parts = payload.replace("add_tag_", "").split("_", 1)
-        if len(parts) == 2:
-            request_id, tag = parts
-            handle_add_tag(chat_id, request_id, tag)
-        answer_callback(callback_id)
-
-    elif payload.startswith("skip_tags_"):
-        request_id = payload.replace("skip_tags_", "")
-        handle_skip_tags(chat_id, request_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("rate_volunteer_"):
-        # Формат: rate_volunteer_{request_id}_{rating}
-        parts = payload.replace("rate_volunteer_", "").rsplit("_", 1)
-        if len(parts) == 2:
-            request_id, rating = parts
-            handle_rate_volunteer(chat_id, request_id, int(rating))
-        answer_callback(callback_id)
-
-    # Функции волонтёра
-    elif payload == "my_stats":
-        show_volunteer_stats(chat_id)
-        answer_callback(callback_id)
-
-    elif payload == "active_requests":
-        show_active_requests_list(chat_id)
-        answer_callback(callback_id)
-
-    # Верификация волонтеров
-    elif payload == "request_verification":
-        handle_verification_request(chat_id)
-        answer_callback(callback_id)
-
-    # Запросы на описание фото
-    elif payload == "request_photo_description":
-        handle_photo_description_request(chat_id)
-        answer_callback(callback_id)
-
-    elif payload == "volunteer_photo_requests":
-        show_photo_requests_for_volunteer(chat_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("take_photo_"):
-        request_id = int(payload.replace("take_photo_", ""))
-        handle_take_photo_request(chat_id, request_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("view_photo_"):
-        request_id = int(payload.replace("view_photo_", ""))
-        handle_take_photo_request(chat_id, request_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("photo_helpful_"):
-        request_id = int(payload.replace("photo_helpful_", ""))
-        handle_photo_helpful(chat_id, request_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("photo_not_helpful_"):
-        request_id = int(payload.replace("photo_not_helpful_", ""))
-        handle_photo_not_helpful(chat_id, request_id)
-        answer_callback(callback_id)
-
-    # Жалобы
-    elif payload.startswith("complaint_"):
-        request_id = payload.replace("complaint_", "")
-        handle_complaint(chat_id, request_id)
-        answer_callback(callback_id)
-
-    # Модератор - Верификация
-    elif payload == "mod_verifications":
-        show_verification_requests(chat_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("mod_verify_"):
-        request_id = int(payload.replace("mod_verify_", ""))
-        show_verification_request_details(chat_id, request_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("mod_approve_"):
-        request_id = int(payload.replace("mod_approve_", ""))
-        approve_verification(chat_id, request_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("mod_reject_"):
-        request_id = int(payload.replace("mod_reject_", ""))
-        reject_verification(chat_id, request_id)
-        answer_callback(callback_id)
-
-    # Модератор - Жалобы
-    elif payload == "mod_complaints":
-        show_complaints(chat_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("mod_complaint_"):
-        complaint_id = int(payload.replace("mod_complaint_", ""))
-        show_complaint_details(chat_id, complaint_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("mod_block_"):
-        complaint_id = int(payload.replace("mod_block_", ""))
-        block_volunteer(chat_id, complaint_id)
-        answer_callback(callback_id)
-
-    elif payload.startswith("mod_dismiss_"):
-        complaint_id = int(payload.replace("mod_dismiss_", ""))
-        dismiss_complaint(chat_id, complaint_id)
-        answer_callback(callback_id)
-
-    # Навигационные кнопки
-    elif payload == "show_menu" or payload == "refresh_menu" or payload == "menu":
-        # Показываем меню в зависимости от роли пользователя
-        user = get_user(chat_id)
-        if user:
-            if user.get("role") == "needy":
-                show_needy_menu(chat_id)
-            elif user.get("role") == "volunteer":
-                show_volunteer_menu(chat_id)
-            elif user.get("role") == "moderator":
-                show_moderator_menu(chat_id)
-        answer_callback(callback_id)
-
-    elif payload == "moderator_menu":
-        show_moderator_menu(chat_id)
-        answer_callback(callback_id)
-
-    else:
-        logger.warning(f"Неизвестный payload: {payload}")
-        answer_callback(callback_id, "Неизвестная команда")
+    # Отвечаем на нажатие сразу или по истечении CALLBACK_ACK_BUDGET,
+    # сам обработчик выполняется в фоне
+    ack = CallbackAck(callback_id, chat_id)
+    press = Press(ack, chat_id, username, user_id, message_id)
+    submit_callback(ack, lambda: callback_router.dispatch(matched, press))
@@ -2,12 +2,20 @@
 Обработчики распознавания изображений
 """
 import logging
-import os
-import time
 from datetime import datetime
 from database import get_request, create_request, complete_request
-from bot.utils import send_message, download_image, describe_image, send_message_with_menu_button
-from bot.config import DOWNLOADS_DIR
+from bot.utils import send_message, send_message_with_menu_button
+from bot.utils.vision import fetch_image, describe_image_file, get_vision_backend, VisionError
+from bot.utils.content_cache import KIND_IMAGE_DESCRIPTION, file_digest, cache_get, cache_put
+from bot.utils.vision_service import (
+    submit_vision_job,
+    check_deadline,
+    VisionQueueFull,
+    VisionUserLimit,
+    VisionJobTimeout,
+)
+from bot.utils.image_index import image_dhash, find_similar, remember
+from bot.config import CONTENT_CACHE_ENABLED, VISION_DUP_ENABLED
 
 logger = logging.getLogger(__name__)
 
@@ -21,33 +29,97 @@ def handle_image_to_text_request(chat_id):
 
     send_message_with_menu_button(chat_id, "📷 Отправьте мне фотографию, и я опишу что на ней изображено.\n\nПросто прикрепите фото к следующему сообщению.")
 
+def _describe_cached(chat_id, source):
+    """
+    Описание изображения с кэшем по SHA-256 скачанных байтов
+
+    Если точного совпадения нет, ищется похожий недавний снимок из этого
+    же чата (перцептивный хэш): повторный кадр того же предмета не
+    отправляется в модель заново.
+    """
+    # Описания заглушки хранятся отдельно и не попадают к пользователям GigaChat
+    backend = get_vision_backend().name
+    kind = KIND_IMAGE_DESCRIPTION if backend == "gigachat" else f"{KIND_IMAGE_DESCRIPTION}_{backend}"
+
+    digest = None
+    if CONTENT_CACHE_ENABLED:
+        digest = file_digest(source)
+        description = cache_get(kind, digest)
+        if description:
+            logger.info(f"Описание изображения найдено в кэше ({digest[:12]})")
+            return description
+
+    image_hash = None
+    if VISION_DUP_ENABLED:
+        try:
+            image_hash = image_dhash(source)
+        except Exception as e:
+            logger.warning(f"Не удалось вычислить перцептивный хэш: {e}")
+        if image_hash is not None:
+            description = find_similar(chat_id, image_hash)
+            if description:
+                return description
+
+    try:
+        description = describe_image_file(source)
+    except VisionError as e:
+        # Ошибки не кэшируем
+        return str(e)
+
+    if digest:
+        cache_put(kind, digest, description)
+    if image_hash is not None:
+        remember(chat_id, image_hash, description)
+    return description
+
 def handle_image_processing(chat_id, image_url):
-    """Обработка полученного изображения"""
+    """
+    Обработка полученного изображения
+
+    Изображение ставится в очередь сервиса распознавания изображений;
+    описание отправляется пользователю из фонового потока.
+    """
+    try:
+        position = submit_vision_job(
+            chat_id,
+            lambda deadline: _process_image(chat_id, image_url, deadline),
+            on_timeout=lambda: send_message_with_menu_button(
+                chat_id, "❌ Не удалось обработать изображение вовремя. Попробуйте ещё раз позже."
+            ),
+        )
+    except VisionUserLimit:
+        send_message_with_menu_button(chat_id, "⏳ Дождитесь описания предыдущих фото, затем отправьте следующее.")
+        return
+    except VisionQueueFull:
+        send_message_with_menu_button(chat_id, "⏳ Сейчас слишком много изображений. Попробуйте через минуту.")
+        return
+
+    if position:
+        send_message_with_menu_button(chat_id, f"⏳ Изображение в очереди, вы {position + 1}-й. Описание придёт автоматически.")
+
+def _process_image(chat_id, image_url, deadline):
+    """Задание очереди: скачивание, описание и отправка результата"""
     try:
         # Отправляем сообщение о начале обработки
         send_message_with_menu_button(chat_id, "⏳ Обрабатываю изображение, подождите немного...")
 
-        # Скачиваем изображение
-        image_filename = f"image_{chat_id}_{int(time.time())}.jpg"
-        image_path = os.path.join(DOWNLOADS_DIR, image_filename)
-
-        if not download_image(image_url, image_path):
+        # Скачиваем изображение во временный буфер (уменьшается перед загрузкой в GigaChat)
+        source = fetch_image(image_url)
+        if source is None:
             send_message_with_menu_button(chat_id, "❌ Ошибка при скачивании изображения. Попробуйте ещё раз.")
             return
 
-        # Распознаём изображение
-        description = describe_image(image_path)
+        with source:
+            check_deadline(deadline)
+
+            # Распознаём изображение (повторно присланные фото берём из кэша)
+            description = _describe_cached(chat_id, source)
 
         # Отправляем результат
         send_message_with_menu_button(chat_id, f"📝 Описание изображения:\n\n{description}")
 
-        # Удаляем временный файл изображения
-        try:
-            os.remove(image_path)
-            logger.info(f"Временный файл {image_path} удалён")
-        except:
-            pass
-
+    except VisionJobTimeout:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при обработке изображения: {e}", exc_info=True)
         send_message_with_menu_button(chat_id, f"❌ Произошла ошибка при обработке изображения: {str(e)}")
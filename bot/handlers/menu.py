@@ -3,7 +3,8 @@
 """
 import logging
 from database import save_user
-from bot.utils import send_message, send_message_with_keyboard, send_message_with_reply_keyboard
+from bot.utils import send_message, send_message_with_keyboard, send_message_with_reply_keyboard, send_prepared_message
+from bot.utils.menu_cache import get_user_profile, get_user_role, get_menu_payload
 from bot.config import VISION_MODEL_ENABLED
 
 logger = logging.getLogger(__name__)
@@ -21,8 +22,8 @@ def show_role_selection(chat_id):
         buttons
     )
 
-def show_needy_menu(chat_id):
-    """Показывает главное меню для нуждающегося"""
+def _build_needy_menu():
+    """Текст и кнопки меню нуждающегося (собирается один раз, см. menu_cache)"""
     # Изменяем текст кнопки в зависимости от статуса нейронки
     image_button_text = "Автоматическое описание фото"
     if not VISION_MODEL_ENABLED:
@@ -42,52 +43,37 @@ def show_needy_menu(chat_id):
     if not VISION_MODEL_ENABLED:
         menu_text += "\n\n⚠️ Vision Model работает в режиме заглушек"
 
-    # Отправляем с inline клавиатурой
-    send_message_with_keyboard(
-        chat_id,
-        menu_text,
-        inline_buttons
-    )
-
-def show_volunteer_menu(chat_id):
-    """Показывает главное меню для волонтёра"""
-    from database import get_volunteer_info
-
-    # Получаем информацию о волонтере
-    volunteer_info = get_volunteer_info(chat_id)
-
-    if not volunteer_info:
-        send_message(chat_id, "Ошибка загрузки данных волонтера.")
-        return
+    return menu_text, inline_buttons
 
-    verification_status = volunteer_info.get('verification_status', 'unverified')
-    is_blocked = volunteer_info.get('is_blocked', False)
-
-    # Статусы
-    status_emoji = {
-        'unverified': '🆕',
-        'pending': '⏳',
-        'verified': '✅',
-        'trusted': '⭐'
-    }
-
-    status_text = {
-        'unverified': 'Новичок (не верифицирован)',
-        'pending': 'На проверке',
-        'verified': 'Верифицирован',
-        'trusted': 'Доверенный'
-    }
-
-    welcome_text = f"""
+def show_needy_menu(chat_id):
+    """Показывает главное меню для нуждающегося"""
+    send_prepared_message(chat_id, get_menu_payload(("needy",), _build_needy_menu), "меню нуждающегося")
+
+# Статусы
+VOLUNTEER_STATUS_EMOJI = {
+    'unverified': '🆕',
+    'pending': '⏳',
+    'verified': '✅',
+    'trusted': '⭐'
+}
+
+VOLUNTEER_STATUS_TEXT = {
+    'unverified': 'Новичок (не верифицирован)',
+    'pending': 'На проверке',
+    'verified': 'Верифицирован',
+    'trusted': 'Доверенный'
+}
+
+def _volunteer_welcome_text(verification_status):
+    return f"""
 Добро пожаловать, волонтёр!
 
-{status_emoji.get(verification_status, '❓')} Статус: {status_text.get(verification_status, 'Неизвестен')}
+{VOLUNTEER_STATUS_EMOJI.get(verification_status, '❓')} Статус: {VOLUNTEER_STATUS_TEXT.get(verification_status, 'Неизвестен')}
 """
 
-    if is_blocked:
-        welcome_text += f"\n🚫 ВЫ ЗАБЛОКИРОВАНЫ\nПричина: {volunteer_info.get('block_reason', 'Не указана')}"
-        send_message(chat_id, welcome_text)
-        return
+def _build_volunteer_menu(verification_status):
+    """Текст и кнопки меню волонтёра для статуса верификации"""
+    welcome_text = _volunteer_welcome_text(verification_status)
 
     # Inline кнопки
     inline_buttons = [
@@ -102,21 +88,32 @@ def show_volunteer_menu(chat_id):
     elif verification_status == 'pending':
         welcome_text += "\n⏳ Ваша заявка на верификацию рассматривается."
 
-    send_message_with_keyboard(
-        chat_id,
-        welcome_text,
-        inline_buttons
-    )
+    return welcome_text, inline_buttons
 
-def show_moderator_menu(chat_id):
-    """Показывает меню модератора"""
-    from database import get_user
+def show_volunteer_menu(chat_id):
+    """Показывает главное меню для волонтёра"""
+    # Роль и статус — из кэша, БД только при первом обращении или после изменения
+    profile = get_user_profile(chat_id)
 
-    user = get_user(chat_id)
-    if not user or user['role'] != 'moderator':
-        send_message(chat_id, "У вас нет доступа к панели модератора.")
+    if not profile or profile["role"] != "volunteer":
+        send_message(chat_id, "Ошибка загрузки данных волонтера.")
         return
 
+    verification_status = profile["verification_status"]
+
+    if profile["is_blocked"]:
+        welcome_text = _volunteer_welcome_text(verification_status)
+        welcome_text += f"\n🚫 ВЫ ЗАБЛОКИРОВАНЫ\nПричина: {profile['block_reason'] or 'Не указана'}"
+        send_message(chat_id, welcome_text)
+        return
+
+    payload = get_menu_payload(
+        ("volunteer", verification_status),
+        lambda: _build_volunteer_menu(verification_status),
+    )
+    send_prepared_message(chat_id, payload, "меню волонтёра")
+
+def _build_moderator_menu():
     text = """
 🛡️ **Панель модератора**
 
@@ -130,7 +127,34 @@ def show_moderator_menu(chat_id):
         ]
     ]
 
-    send_message_with_keyboard(chat_id, text, buttons)
+    return text, buttons
+
+def show_moderator_menu(chat_id):
+    """Показывает меню модератора"""
+    if get_user_role(chat_id) != 'moderator':
+        send_message(chat_id, "У вас нет доступа к панели модератора.")
+        return
+
+    send_prepared_message(chat_id, get_menu_payload(("moderator",), _build_moderator_menu), "меню модератора")
+
+def show_menu_for_user(chat_id):
+    """
+    Показывает меню по роли пользователя
+
+    Returns:
+        bool: False если пользователь не зарегистрирован
+    """
+    role = get_user_role(chat_id)
+    if role is None:
+        return False
+
+    if role == "needy":
+        show_needy_menu(chat_id)
+    elif role == "volunteer":
+        show_volunteer_menu(chat_id)
+    elif role == "moderator":
+        show_moderator_menu(chat_id)
+    return True
 
 def handle_role_selection(chat_id, role, username, user_id=None, start_message_id=None):
     """Обработка выбора роли пользователем"""
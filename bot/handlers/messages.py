@@ -5,10 +5,11 @@
 import logging
 from database import get_user, save_user
 from bot.utils import send_message
+from bot.utils.router import Router
 from .menu import (
     show_role_selection,
     show_needy_menu,
-    show_volunteer_menu,
+    show_menu_for_user,
     show_moderator_menu,
 )
 from .image import handle_image_processing
@@ -69,6 +70,35 @@ def handle_switch_role(chat_id, username, user_id=None):
         show_needy_menu(chat_id)
 
 
+# Текстовые команды: точное совпадение без учёта регистра и пробелов по краям
+command_router = Router("command", normalize=lambda text: text.strip().lower())
+
+command_router.add(["/start", "start", "старт"], handle_start)
+command_router.add(["/switch_role", "/switch"], handle_switch_role)
+
+
+# "Обновить" = показать меню заново
+@command_router.route(["/menu", "menu", "меню", "📋 меню", "🔄 обновить", "обновить", "update"])
+def handle_menu_command(chat_id, username, user_id):
+    if not show_menu_for_user(chat_id):
+        send_message(chat_id, "Используйте /start для регистрации")
+
+
+@command_router.route("/moderator")
+def handle_moderator_command(chat_id, username, user_id):
+    """Временная команда для назначения модератора (для тестирования)"""
+    user = get_user(chat_id)
+    if user:
+        save_user(chat_id, "moderator", username)
+        send_message(
+            chat_id,
+            "✅ Вы назначены модератором!\n\nИспользуйте /menu для доступа к панели модерации.",
+        )
+        show_moderator_menu(chat_id)
+    else:
+        send_message(chat_id, "Сначала используйте /start для регистрации")
+
+
 def handle_message(update):
     """Обработка входящего сообщения"""
     message = update.get("message", {})
@@ -126,18 +156,12 @@ def handle_message(update):
         logger.info(f"Получено изображение из чата {chat_id}: {image_url}")
 
         # Проверяем, ждем ли мы фото для описания
-        if (
-            chat_id in photo_description_states
-            and photo_description_states[chat_id] == "waiting_for_photo"
-        ):
+        if photo_description_states.get(chat_id) == "waiting_for_photo":
             handle_photo_for_description(chat_id, attachments)
             return
 
         # Проверяем, ждем ли мы документы для верификации
-        if (
-            chat_id in verification_states
-            and verification_states[chat_id] == "waiting_for_documents"
-        ):
+        if verification_states.get(chat_id) == "waiting_for_documents":
             handle_verification_documents(chat_id, text, attachments)
             return
 
@@ -150,7 +174,7 @@ def handle_message(update):
         logger.info(f"Получено голосовое сообщение из чата {chat_id}: {voice_url}")
 
         # Проверяем режим обработки голоса
-        if chat_id in voice_mode and voice_mode[chat_id] == "text_only":
+        if voice_mode.get(chat_id) == "text_only":
             # Только распознавание текста, без команд
             handle_voice_to_text_only(chat_id, voice_url)
         else:
@@ -165,82 +189,40 @@ def handle_message(update):
     logger.info(f"Сообщение от {username} ({chat_id}): {text}")
 
     # Обработка команд
-    if text.strip().lower() in ["/start", "start", "старт"]:
-        handle_start(chat_id, username, user_id)
-    elif text.strip().lower() in ["/menu", "menu", "меню", "📋 меню"]:
-        user = get_user(chat_id)
-        if user:
-            role = user.get("role")
-            if role == "needy":
-                show_needy_menu(chat_id)
-            elif role == "volunteer":
-                show_volunteer_menu(chat_id)
-            elif role == "moderator":
-                show_moderator_menu(chat_id)
-        else:
-            send_message(chat_id, "Используйте /start для регистрации")
-    elif text.strip().lower() in ["🔄 обновить", "обновить", "update"]:
-        # Обновить = показать меню заново
-        user = get_user(chat_id)
-        if user:
-            role = user.get("role")
-            if role == "needy":
-                show_needy_menu(chat_id)
-            elif role == "volunteer":
-                show_volunteer_menu(chat_id)
-            elif role == "moderator":
-                show_moderator_menu(chat_id)
+    matched = command_router.match(text)
+    if matched:
+        command_router.dispatch(matched, chat_id, username, user_id)
+        return
+
+    # Проверяем состояния ожидания ввода
+
+    # Обработка описания фото от волонтера
+    if photo_description_states.get(chat_id, "").startswith("describing_"):
+        if handle_photo_description(chat_id, text):
+            return
+
+    # Обработка причины жалобы
+    if chat_id in complaint_states:
+        if handle_complaint_reason(chat_id, text):
+            return
+
+    # Обработка документов для верификации (текстовый комментарий)
+    if verification_states.get(chat_id) == "waiting_for_documents":
+        send_message(
+            chat_id,
+            "⚠️ Пожалуйста, отправьте фото или файлы документов (паспорт, справка о несудимости).\n\nВаш комментарий будет сохранен.",
+        )
+        return
+
+    # Эхо для зарегистрированных пользователей
+    user = get_user(chat_id)
+    if user:
+        role = user.get("role")
+        if role == "moderator":
+            send_message(chat_id, "Используйте /menu для вызова панели модератора")
         else:
-            send_message(chat_id, "Используйте /start для регистрации")
-    elif text.strip().lower() in ["/switch_role", "/switch"]:
-        handle_switch_role(chat_id, username, user_id)
-    elif text.strip().lower() == "/moderator":
-        # Временная команда для назначения модератора (для тестирования)
-        user = get_user(chat_id)
-        if user:
-            save_user(chat_id, "moderator", username)
             send_message(
-                chat_id,
-                "✅ Вы назначены модератором!\n\nИспользуйте /menu для доступа к панели модерации.",
+                chat_id, f"Вы написали: {text}\n\nИспользуйте /menu для вызова меню"
             )
-            show_moderator_menu(chat_id)
-        else:
-            send_message(chat_id, "Сначала используйте /start для регистрации")
     else:
-        # Проверяем состояния ожидания ввода
-
-        # Обработка описания фото от волонтера
-        if chat_id in photo_description_states:
-            state = photo_description_states[chat_id]
-            if state.startswith("describing_"):
-                if handle_photo_description(chat_id, text):
-                    return
-
-        # Обработка причины жалобы
-        if chat_id in complaint_states:
-            if handle_complaint_reason(chat_id, text):
-                return
-
-        # Обработка документов для верификации (текстовый комментарий)
-        if (
-            chat_id in verification_states
-            and verification_states[chat_id] == "waiting_for_documents"
-        ):
-            send_message(
-                chat_id,
-                "⚠️ Пожалуйста, отправьте фото или файлы документов (паспорт, справка о несудимости).\n\nВаш комментарий будет сохранен.",
-            )
-            return
-
-        # Эхо для зарегистрированных пользователей
-        user = get_user(chat_id)
-        if user:
-            role = user.get("role")
-            if role == "moderator":
-                send_message(chat_id, "Используйте /menu для вызова панели модератора")
-            else:
-                send_message(
-                    chat_id, f"Вы написали: {text}\n\nИспользуйте /menu для вызова меню"
-                )
-        else:
-            send_message(chat_id, "Используйте /start для начала работы")
+        send_message(chat_id, "Используйте /start для начала работы")
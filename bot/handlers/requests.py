@@ -10,11 +10,13 @@ from database import (
     create_review, add_tags_to_user,
     get_volunteer_info, create_complaint, log_action,
     get_available_volunteers_for_wave, update_request_wave,
-    volunteer_has_active_request, get_connection, release_connection,
+    volunteer_has_active_request,
     get_active_request_for_user
 )
 from bot.utils import send_message, send_message_with_keyboard, create_user_mention, send_message_with_keyboard_and_menu
-from bot.chat_room_manager import assign_chat_room_to_request, release_chat_room
+from bot.utils.state_store import StateStore
+from bot.chat_room_manager import assign_chat_room_to_request, register_waiting_restorer
+from bot.chat_room_releaser import enqueue_release
 
 logger = logging.getLogger(__name__)
 
@@ -163,49 +165,106 @@ def handle_accept_request(volunteer_chat_id, request_id, volunteer_username, cal
         send_message(volunteer_chat_id, "⚠️ Ошибка: не удалось получить ID пользователей. Попробуйте позже.")
         return False
 
-    # Назначаем групповой чат для общения
-    conn = get_connection()
-    if conn:
-        try:
-            chat_result = assign_chat_room_to_request(
-                conn,
-                request_id,
-                needy_user_id,
-                volunteer_user_id
-            )
+    # Назначаем групповой чат для общения.
+    # Если свободных чатов нет, заявка ждёт в очереди и чат будет выдан позже
+    on_assigned, on_failed = _chat_room_callbacks(request_id, volunteer_chat_id, needy_chat_id,
+                                                  volunteer_username, volunteer_user_id)
+
+    try:
+        chat_result = assign_chat_room_to_request(
+            request_id,
+            needy_user_id,
+            volunteer_user_id,
+            on_assigned=on_assigned,
+            on_failed=on_failed
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при назначении чата: {e}")
+        send_message(volunteer_chat_id, "⚠️ Произошла ошибка при создании чата.")
+        return False
 
-            if chat_result and chat_result['success']:
-                logger.info(f"Участники добавлены в групповой чат {chat_result['chat_id']}")
-            else:
-                logger.error(f"Не удалось назначить групповой чат для заявки {request_id}")
-
-                # Отправляем сообщения обоим пользователям о проблеме
-                send_message(volunteer_chat_id,
-                    "⚠️ Не удалось создать групповой чат.\n\n"
-                    "Возможные причины:\n"
-                    "• У нуждающегося настройки приватности запрещают добавление в группы\n"
-                    "• Технические проблемы\n\n"
-                    "Пожалуйста, свяжитесь с нуждающимся напрямую или обратитесь к администратору."
-                )
-
-                send_message(needy_chat_id,
-                    "⚠️ Волонтёр принял ваш запрос, но не удалось создать групповой чат.\n\n"
-                    "Пожалуйста, проверьте настройки приватности в Max.ru:\n"
-                    "Настройки → Приватность → Групповые чаты → Разрешить добавление\n\n"
-                    "Или попробуйте создать новый запрос позже."
-                )
-                return False
+    if chat_result and chat_result.get('queued'):
+        logger.info(f"Заявка {request_id} ожидает свободный чат (позиция {chat_result['position']})")
+        send_message(
+            volunteer_chat_id,
+            "✅ Вы приняли запрос!\n\n"
+            "⏳ Все групповые чаты сейчас заняты. Как только чат освободится, "
+            "вы и нуждающийся будете добавлены в него автоматически."
+        )
+        send_message(
+            needy_chat_id,
+            "✅ Волонтёр принял ваш запрос!\n\n"
+            "⏳ Все групповые чаты сейчас заняты. Как только чат освободится, "
+            "вы будете добавлены в него автоматически."
+        )
+        return True
 
-        except Exception as e:
-            logger.error(f"Ошибка при назначении чата: {e}")
-            send_message(volunteer_chat_id, "⚠️ Произошла ошибка при создании чата.")
-            return False
-        finally:
-            release_connection(conn)
-    else:
-        logger.error("Не удалось получить подключение к БД")
+    if not chat_result or not chat_result['success']:
+        logger.error(f"Не удалось назначить групповой чат для заявки {request_id}")
+        _notify_chat_room_failed(volunteer_chat_id, needy_chat_id)
         return False
 
+    logger.info(f"Участники добавлены в групповой чат {chat_result['chat_id']}")
+    _notify_request_accepted(request_id, volunteer_chat_id, needy_chat_id,
+                             volunteer_username, volunteer_user_id)
+    return True
+
+def _chat_room_callbacks(request_id, volunteer_chat_id, needy_chat_id, volunteer_username, volunteer_user_id):
+    """Колбэки отложенного назначения чата: (on_assigned, on_failed)"""
+    def on_assigned(result):
+        _notify_request_accepted(request_id, volunteer_chat_id, needy_chat_id,
+                                 volunteer_username, volunteer_user_id)
+
+    def on_failed(result):
+        _notify_chat_room_failed(volunteer_chat_id, needy_chat_id)
+
+    return on_assigned, on_failed
+
+def _restore_waiting_assignment(request):
+    """Запись очереди ожидания чата для заявки, принятой до перезапуска бота"""
+    request_id = str(request["id"])
+    needy_chat_id = request.get("user_id")
+    volunteer_chat_id = request.get("assigned_volunteer_id")
+
+    needy = get_user(needy_chat_id)
+    volunteer = get_user(volunteer_chat_id)
+    needy_user_id = needy.get("user_id") if needy else None
+    volunteer_user_id = volunteer.get("user_id") if volunteer else None
+    if not needy_user_id or not volunteer_user_id:
+        logger.error(f"Заявка {request_id}: нет user_id участников, в очередь чатов не возвращена")
+        return None
+
+    on_assigned, on_failed = _chat_room_callbacks(request_id, volunteer_chat_id, needy_chat_id,
+                                                  volunteer.get("name"), volunteer_user_id)
+    return {
+        'request_id': request_id,
+        'needy_user_id': needy_user_id,
+        'volunteer_user_id': volunteer_user_id,
+        'on_assigned': on_assigned,
+        'on_failed': on_failed,
+    }
+
+register_waiting_restorer(_restore_waiting_assignment)
+
+def _notify_chat_room_failed(volunteer_chat_id, needy_chat_id):
+    """Сообщает обоим участникам, что групповой чат создать не удалось"""
+    send_message(volunteer_chat_id,
+        "⚠️ Не удалось создать групповой чат.\n\n"
+        "Возможные причины:\n"
+        "• У нуждающегося настройки приватности запрещают добавление в группы\n"
+        "• Технические проблемы\n\n"
+        "Пожалуйста, свяжитесь с нуждающимся напрямую или обратитесь к администратору."
+    )
+
+    send_message(needy_chat_id,
+        "⚠️ Волонтёр принял ваш запрос, но не удалось создать групповой чат.\n\n"
+        "Пожалуйста, проверьте настройки приватности в Max.ru:\n"
+        "Настройки → Приватность → Групповые чаты → Разрешить добавление\n\n"
+        "Или попробуйте создать новый запрос позже."
+    )
+
+def _notify_request_accepted(request_id, volunteer_chat_id, needy_chat_id, volunteer_username, volunteer_user_id):
+    """Уведомляет волонтёра и нуждающегося, что чат готов, и даёт кнопки завершения"""
     # Уведомляем волонтёра с кнопкой завершения диалога
     buttons = [
         [{"type": "callback", "text": "✅ Завершить диалог", "payload": f"complete_request_{request_id}"}]
@@ -236,8 +295,6 @@ def handle_accept_request(volunteer_chat_id, request_id, volunteer_username, cal
     ]
     send_message_with_keyboard(needy_chat_id, text, needy_buttons, markup=markup)
 
-    return True
-
 def handle_complete_request(chat_id, request_id):
     """Обработка завершения диалога (может быть вызвано волонтёром или нуждающимся)"""
     # Получаем информацию о запросе ДО завершения
@@ -262,39 +319,13 @@ def handle_complete_request(chat_id, request_id):
         send_message(chat_id, "❌ Вы не участвуете в этой заявке")
         return
 
-    # Получаем числовые user_id для удаления из чата
-    needy = get_user(needy_chat_id)
-    volunteer = get_user(volunteer_chat_id_req)
-
-    needy_user_id = needy.get("user_id") if needy else None
-    volunteer_user_id = volunteer.get("user_id") if volunteer else None
-
-    # Освобождаем чат, если был назначен
-    if chat_room_id and needy_user_id and volunteer_user_id:
-        conn = get_connection()
-        try:
-            # Получаем информацию о чате
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT chat_id FROM chat_rooms WHERE id = %s
-                """, (chat_room_id,))
-                result = cur.fetchone()
-
-                if result:
-                    chat_id = result[0]
-                    # Освобождаем чат (удаляем участников и помечаем как свободный)
-                    user_ids = [needy_user_id, volunteer_user_id]
-                    from bot.chat_room_manager import release_chat_room
-                    release_chat_room(conn, chat_room_id, chat_id, user_ids)
-                    logger.info(f"Чат {chat_id} освобождён для заявки {request_id}")
-        except Exception as e:
-            logger.error(f"Ошибка при освобождении чата: {e}")
-        finally:
-            release_connection(conn)
-
     # Завершаем запрос
     complete_request(request_id)
 
+    # Освобождаем чат в фоне: удаление участников и UPDATE не задерживают ответ
+    if chat_room_id:
+        enqueue_release(chat_room_id, request_id)
+
     # Логируем действие
     log_action(chat_id, "complete_request", "request", request_id,
                details={"completed_by": "volunteer" if is_volunteer else "needy"})
@@ -412,8 +443,8 @@ def handle_rate_volunteer(needy_chat_id, request_id, rating):
     else:
         send_message(needy_chat_id, "❌ Не удалось сохранить оценку. Попробуйте позже.")
 
-# Словарь для хранения состояний жалоб
-complaint_states = {}
+# Состояния жалоб: {"request_id", "volunteer_id"} по chat_id нуждающегося
+complaint_states = StateStore("complaint", ttl=3600)
 
 def handle_complaint(needy_chat_id, request_id):
     """Обработка жалобы на волонтера"""
@@ -440,19 +471,19 @@ def handle_complaint(needy_chat_id, request_id):
 Модераторы рассмотрят вашу жалобу и примут необходимые меры.
 """
 
-    complaint_states[needy_chat_id] = {
+    complaint_states.set(needy_chat_id, {
         "request_id": request_id,
         "volunteer_id": volunteer_id
-    }
+    })
 
     send_message(needy_chat_id, text)
 
 def handle_complaint_reason(needy_chat_id, reason):
     """Обработка причины жалобы"""
-    if needy_chat_id not in complaint_states:
+    state = complaint_states.get(needy_chat_id)
+    if not state:
         return False
 
-    state = complaint_states[needy_chat_id]
     request_id = state['request_id']
     volunteer_id = state['volunteer_id']
 
@@ -490,10 +521,10 @@ def handle_complaint_reason(needy_chat_id, reason):
             except Exception as e:
                 logger.error(f"Ошибка отправки уведомления модератору {moderator_id}: {e}")
 
-        del complaint_states[needy_chat_id]
+        complaint_states.pop(needy_chat_id)
     else:
         send_message(needy_chat_id, "❌ Ошибка при отправке жалобы. Попробуйте позже.")
-        del complaint_states[needy_chat_id]
+        complaint_states.pop(needy_chat_id)
 
     return True
 
@@ -6,12 +6,13 @@ import time
 from datetime import datetime
 from database import get_all_users_by_role, create_request
 from bot.utils import send_message, send_message_with_keyboard, send_location, create_user_mention, send_message_with_keyboard_and_menu
+from bot.utils.state_store import StateStore
 
 logger = logging.getLogger(__name__)
 
-# Временное хранилище для SOS запросов (пока не в БД)
+# SOS запросы, ожидающие геолокацию (пока не в таблице заявок)
 # TODO: Добавить в PostgreSQL таблицу для SOS запросов
-sos_requests = {}
+sos_requests = StateStore("sos", ttl=3600)
 
 def handle_sos(chat_id, username, user_id=None):
     """Обработка кнопки SOS"""
@@ -27,8 +28,8 @@ def handle_sos(chat_id, username, user_id=None):
         "type": "sos"
     }
 
-    # Сохраняем в памяти (временно)
-    sos_requests[str(chat_id)] = sos_request
+    # Сохраняем до получения геолокации
+    sos_requests.set(chat_id, sos_request)
 
     # Отправляем кнопку запроса геолокации с кнопкой меню
     buttons = [
@@ -43,7 +44,7 @@ def handle_sos(chat_id, username, user_id=None):
 def handle_sos_location(chat_id, username, user_id, location):
     """Обработка получения геолокации для SOS"""
     # Находим активный SOS запрос от этого пользователя
-    sos_request = sos_requests.get(str(chat_id))
+    sos_request = sos_requests.get(chat_id)
 
     if not sos_request or sos_request.get("status") != "sos_pending_location":
         from bot.utils import send_message_with_menu_button
@@ -78,6 +79,7 @@ def handle_sos_location(chat_id, username, user_id, location):
     # Помечаем запрос как завершённый
     sos_request["status"] = "completed"
     sos_request["completed_at"] = datetime.now().isoformat()
+    sos_requests.set(chat_id, sos_request)
 
     from bot.utils import send_message_with_menu_button
     send_message_with_menu_button(chat_id, f"✅ Сигнал SOS с вашим местоположением отправлен {volunteers_notified} волонтёрам!")
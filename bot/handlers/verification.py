@@ -3,6 +3,7 @@
 """
 import logging
 from bot.utils import send_message, send_message_with_keyboard, send_message_with_menu_button, send_message_with_keyboard_and_menu
+from bot.utils.state_store import StateStore
 from database import (
     get_user,
     get_volunteer_info,
@@ -17,9 +18,10 @@ from database import (
 
 logger = logging.getLogger(__name__)
 
-# Словарь для отслеживания состояний
-verification_states = {}
-photo_description_states = {}
+# Состояния диалогов (с TTL: брошенный диалог не висит вечно)
+verification_states = StateStore("verification", ttl=3600)
+# Волонтёр пишет описание дольше, чем нуждающийся выбирает фото
+photo_description_states = StateStore("photo_description", ttl=2 * 3600)
 
 def handle_verification_request(chat_id):
     """Обрабатывает запрос на верификацию"""
@@ -54,15 +56,12 @@ def handle_verification_request(chat_id):
 Также можете написать комментарий о себе.
 """
 
-    verification_states[chat_id] = "waiting_for_documents"
+    verification_states.set(chat_id, "waiting_for_documents")
     send_message(chat_id, text)
 
 def handle_verification_documents(chat_id, message_text, attachments):
     """Обрабатывает отправку документов для верификации"""
-    if chat_id not in verification_states:
-        return False
-
-    if verification_states[chat_id] != "waiting_for_documents":
+    if verification_states.get(chat_id) != "waiting_for_documents":
         return False
 
     # Собираем ссылки на документы
@@ -91,10 +90,10 @@ def handle_verification_documents(chat_id, message_text, attachments):
             f"✅ Заявка на верификацию #{request_id} отправлена модераторам!\n\n"
             "⏳ Ожидайте проверки. Вы получите уведомление о результате."
         )
-        del verification_states[chat_id]
+        verification_states.pop(chat_id)
     else:
         send_message(chat_id, "❌ Ошибка при создании заявки. Попробуйте позже.")
-        del verification_states[chat_id]
+        verification_states.pop(chat_id)
 
     return True
 
@@ -115,15 +114,12 @@ def handle_photo_description_request(chat_id):
 Волонтер-человек посмотрит на фото и опишет его вам текстом или голосом.
 """
 
-    photo_description_states[chat_id] = "waiting_for_photo"
+    photo_description_states.set(chat_id, "waiting_for_photo")
     send_message_with_menu_button(chat_id, text)
 
 def handle_photo_for_description(chat_id, attachments):
     """Обрабатывает отправку фото для описания - использует волновую систему"""
-    if chat_id not in photo_description_states:
-        return False
-
-    if photo_description_states[chat_id] != "waiting_for_photo":
+    if photo_description_states.get(chat_id) != "waiting_for_photo":
         return False
 
     # Ищем фото в attachments
@@ -181,10 +177,10 @@ def handle_photo_for_description(chat_id, attachments):
                 "⏳ Ожидайте, скоро волонтёр возьмёт ваш запрос."
             )
 
-        del photo_description_states[chat_id]
+        photo_description_states.pop(chat_id)
     else:
         send_message_with_menu_button(chat_id, "❌ Ошибка при создании запроса. Попробуйте позже.")
-        del photo_description_states[chat_id]
+        photo_description_states.pop(chat_id)
 
     return True
 
@@ -259,7 +255,7 @@ def handle_take_photo_request(chat_id, request_id):
             send_message_with_menu_button(chat_id, text)
 
             # Сохраняем состояние
-            photo_description_states[chat_id] = f"describing_{request_id}"
+            photo_description_states.set(chat_id, f"describing_{request_id}")
 
             # Уведомляем нуждающегося
             send_message_with_menu_button(
@@ -273,11 +269,8 @@ def handle_take_photo_request(chat_id, request_id):
 
 def handle_photo_description(chat_id, message_text):
     """Обрабатывает описание фото от волонтера"""
-    if chat_id not in photo_description_states:
-        return False
-
-    state = photo_description_states[chat_id]
-    if not state.startswith("describing_"):
+    state = photo_description_states.get(chat_id)
+    if not state or not state.startswith("describing_"):
         return False
 
     request_id = int(state.split("_")[1])
@@ -315,10 +308,10 @@ def handle_photo_description(chat_id, message_text):
                 buttons
             )
 
-        del photo_description_states[chat_id]
+        photo_description_states.pop(chat_id)
     else:
         send_message(chat_id, "❌ Ошибка при отправке описания.")
-        del photo_description_states[chat_id]
+        photo_description_states.pop(chat_id)
 
     return True
 
@@ -2,11 +2,13 @@
 Обработчик голосовых сообщений
 """
 import logging
-import os
+import threading
 import time
-from bot.utils.voice import transcribe_voice, parse_voice_command, download_voice
-from bot.utils import send_message, send_message_with_menu_button
-from bot.config import DOWNLOADS_DIR
+from bot.utils.voice import transcribe_voice, parse_voice_command
+from bot.utils.speech_service import submit_url_transcription, submit_url_command, add_transcription_callback
+from bot.utils import send_message, send_message_with_menu_button, edit_message, get_message_id
+from bot.utils.state_store import StateStore
+from bot.config import VOICE_ENABLED, VOICE_PARTIAL_EDIT_INTERVAL, VOICE_MAX_DURATION
 from .requests import handle_request_call
 from .image import handle_image_to_text_request
 # from .sos import handle_sos  # Закомментировано
@@ -14,8 +16,9 @@ from .menu import show_needy_menu
 
 logger = logging.getLogger(__name__)
 
-# Словарь для хранения режима обработки голоса: {chat_id: "text_only" | "commands"}
-voice_mode = {}
+# Режим обработки голоса: "text_only" | "commands" по chat_id
+# Режим "только текст" ждёт одно голосовое, поэтому живёт недолго
+voice_mode = StateStore("voice_mode", ttl=600)
 
 def handle_voice_to_text_request(chat_id):
     """
@@ -23,7 +26,7 @@ def handle_voice_to_text_request(chat_id):
     Просто просим пользователя отправить голосовое сообщение
     """
     # Устанавливаем режим "только текст"
-    voice_mode[chat_id] = "text_only"
+    voice_mode.set(chat_id, "text_only")
 
     send_message_with_menu_button(
         chat_id,
@@ -31,47 +34,125 @@ def handle_voice_to_text_request(chat_id):
         "Эта функция только распознаёт речь, но не выполняет команды."
     )
 
+class _ProgressiveReply:
+    """
+    Статусное сообщение, в котором по мере распознавания показывается текст
+
+    Промежуточный текст редактируется не чаще раза в
+    VOICE_PARTIAL_EDIT_INTERVAL секунд; короткие сообщения успевают
+    распознаться раньше и сразу получают итоговый текст.
+    """
+
+    def __init__(self, chat_id, message_id):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self._lock = threading.Lock()
+        self._last_edit = time.monotonic()
+        self._last_text = None
+        self._finished = False
+
+    def update(self, text):
+        """Показывает промежуточный текст (вызывается из фонового потока)"""
+        with self._lock:
+            if self._finished or not self.message_id or text == self._last_text:
+                return
+            if time.monotonic() - self._last_edit < VOICE_PARTIAL_EDIT_INTERVAL:
+                return
+            self._last_edit = time.monotonic()
+            self._last_text = text
+            edit_message(self.message_id, f"🎤 Распознаю речь...\n\n\"{text}…\"")
+
+    def finish(self, text):
+        """Заменяет статус итоговым текстом (или отправляет новое сообщение)"""
+        with self._lock:
+            self._finished = True
+            if self.message_id and edit_message(self.message_id, text):
+                return
+        send_message_with_menu_button(self.chat_id, text)
+
+def _start_transcription(chat_id, voice_url, on_text, reply=None, command_mode=False):
+    """
+    Ставит голосовое сообщение в очередь потокового распознавания
+
+    Аудио скачивается и декодируется рабочим процессом без временных файлов.
+    on_text(result) вызывается в фоновом потоке, когда распознавание завершено
+    успешно; об ошибках пользователь уведомляется здесь же.
+
+    Args:
+        reply: _ProgressiveReply для промежуточного текста (необязательно)
+        command_mode: распознавать по грамматике команд; on_text получает
+                      dict {"text", "confidence", "mode"} вместо строки
+
+    Returns:
+        bool: True если задание поставлено в очередь
+    """
+    def notify(text):
+        if reply:
+            reply.finish(text)
+        else:
+            send_message_with_menu_button(chat_id, text)
+
+    if not VOICE_ENABLED:
+        notify(transcribe_voice(None))
+        return False
+
+    busy_text = "⏳ Сейчас слишком много голосовых сообщений. Попробуйте через минуту."
+
+    if command_mode:
+        future = submit_url_command(voice_url)
+    else:
+        future = submit_url_transcription(voice_url, on_progress=reply.update if reply else None)
+    if future is None:
+        notify(busy_text)
+        return False
+
+    def on_done(result, error):
+        text = result.get("text") if command_mode and result else result
+        if error == 'busy':
+            notify(busy_text)
+        elif error == 'timeout':
+            notify("❌ Сообщение слишком длинное, не удалось распознать его вовремя.")
+        elif error == 'too_long':
+            notify(
+                f"❌ Голосовое слишком длинное. Отправьте сообщение короче "
+                f"{max(1, VOICE_MAX_DURATION // 60)} мин."
+            )
+        elif not text:
+            notify("❌ Не удалось распознать речь. Попробуйте ещё раз.")
+        else:
+            on_text(result)
+
+    add_transcription_callback(future, on_done)
+    return True
+
 def handle_voice_to_text_only(chat_id, voice_url):
     """
     Обработка голосового сообщения ТОЛЬКО для преобразования в текст
     (без распознавания и выполнения команд)
 
+    Распознавание выполняется в пуле процессов. Для длинных сообщений
+    статусное сообщение редактируется по мере готовности сегментов,
+    в конце в него записывается итоговый текст.
+
     Args:
         chat_id: ID чата
         voice_url: URL голосового сообщения
     """
     try:
         # Уведомляем пользователя
-        send_message_with_menu_button(chat_id, "🎤 Распознаю речь...")
-
-        # Скачиваем аудио файл
-        voice_filename = f"voice_{chat_id}_{int(time.time())}.ogg"
-        voice_path = os.path.join(DOWNLOADS_DIR, voice_filename)
+        status = send_message_with_menu_button(chat_id, "🎤 Распознаю речь...")
+        reply = _ProgressiveReply(chat_id, get_message_id(status))
 
-        if not download_voice(voice_url, voice_path):
-            send_message_with_menu_button(chat_id, "❌ Ошибка при скачивании голосового сообщения")
-            return
+        # Сбрасываем режим обработки голоса
+        voice_mode.pop(chat_id)
 
-        # Распознаём речь
         logger.info(f"Распознаём голосовое для текста от {chat_id}")
-        text = transcribe_voice(voice_path)
 
-        if not text:
-            send_message_with_menu_button(chat_id, "❌ Не удалось распознать речь. Попробуйте ещё раз.")
-        else:
+        def on_text(text):
             # Отправляем только текст, без команд
-            send_message_with_menu_button(chat_id, f"📝 Распознанный текст:\n\n\"{text}\"")
+            reply.finish(f"📝 Распознанный текст:\n\n\"{text}\"")
 
-        # Сбрасываем режим обработки голоса
-        if chat_id in voice_mode:
-            del voice_mode[chat_id]
-
-        # Удаляем временный файл
-        try:
-            os.remove(voice_path)
-            logger.info(f"Временный файл {voice_path} удалён")
-        except:
-            pass
+        _start_transcription(chat_id, voice_url, on_text, reply)
 
     except Exception as e:
         logger.error(f"Ошибка обработки голосового для текста: {e}", exc_info=True)
@@ -82,7 +163,8 @@ def handle_voice_message(chat_id, voice_url, username, user_id):
     Обработка голосового сообщения
 
     1. Скачивает аудио
-    2. Распознаёт речь с помощью Whisper
+    2. Распознаёт речь с помощью Vosk (в пуле процессов): сначала по
+       грамматике фраз команд, при "[unk]" — полностью
     3. Определяет команду
     4. Выполняет команду
     """
@@ -90,34 +172,34 @@ def handle_voice_message(chat_id, voice_url, username, user_id):
         # Уведомляем пользователя
         send_message_with_menu_button(chat_id, "🎤 Обрабатываю голосовое сообщение...")
 
-        # Скачиваем аудио файл
-        voice_filename = f"voice_{chat_id}_{int(time.time())}.ogg"
-        voice_path = os.path.join(DOWNLOADS_DIR, voice_filename)
+        logger.info(f"Распознаём голосовое сообщение от {chat_id}")
 
-        if not download_voice(voice_url, voice_path):
-            send_message_with_menu_button(chat_id, "❌ Ошибка при скачивании голосового сообщения")
-            return
+        def on_text(result):
+            # Показываем распознанный текст
+            send_message_with_menu_button(chat_id, f"📝 Вы сказали:\n\"{result['text']}\"")
+            handle_voice_command_text(chat_id, result['text'], username, user_id, result.get('confidence'))
 
-        # Распознаём речь
-        logger.info(f"Распознаём голосовое сообщение от {chat_id}")
-        text = transcribe_voice(voice_path)
+        _start_transcription(chat_id, voice_url, on_text, command_mode=True)
 
-        if not text:
-            send_message_with_menu_button(chat_id, "❌ Не удалось распознать речь. Попробуйте ещё раз.")
-            # Удаляем временный файл
-            try:
-                os.remove(voice_path)
-            except:
-                pass
-            return
+    except Exception as e:
+        logger.error(f"Ошибка обработки голосового сообщения: {e}", exc_info=True)
+        send_message_with_menu_button(chat_id, f"❌ Произошла ошибка при обработке голосового сообщения")
 
-        # Показываем распознанный текст
-        send_message_with_menu_button(chat_id, f"📝 Вы сказали:\n\"{text}\"")
+def handle_voice_command_text(chat_id, text, username, user_id, recognizer_confidence=None):
+    """
+    Определяет команду по распознанному тексту и выполняет её
 
+    Args:
+        recognizer_confidence: уверенность распознавателя с грамматикой;
+                               если задана, заменяет оценку по ключевым словам
+    """
+    try:
         # Определяем команду
         result = parse_voice_command(text)
         command = result.get("command")
         confidence = result.get("confidence", 0.0)
+        if command and recognizer_confidence is not None:
+            confidence = recognizer_confidence
 
         logger.info(f"Распознана команда: {command} (уверенность: {confidence:.2f})")
 
@@ -136,16 +218,9 @@ def handle_voice_message(chat_id, voice_url, username, user_id):
                 "• \"Опиши картинку\""
             )
 
-        # Удаляем временный файл
-        try:
-            os.remove(voice_path)
-            logger.info(f"Временный файл {voice_path} удалён")
-        except:
-            pass
-
     except Exception as e:
-        logger.error(f"Ошибка обработки голосового сообщения: {e}", exc_info=True)
-        send_message_with_menu_button(chat_id, f"❌ Произошла ошибка при обработке голосового сообщения")
+        logger.error(f"Ошибка выполнения голосовой команды: {e}", exc_info=True)
+        send_message_with_menu_button(chat_id, "❌ Произошла ошибка при выполнении голосовой команды")
 
 def execute_voice_command(chat_id, command, username, user_id, confidence):
     """
@@ -4,6 +4,9 @@
 from .max_api import (
     get_updates,
     send_message,
+    send_prepared_message,
+    edit_message,
+    get_message_id,
     send_message_with_keyboard,
     send_message_with_reply_keyboard,
     answer_callback,
@@ -15,13 +18,11 @@ from .max_api import (
 )
 from .vision import (
     init_vision_model,
-    describe_image,
-    download_image
+    describe_image
 )
 from .voice import (
     transcribe_voice,
-    parse_voice_command,
-    download_voice
+    parse_voice_command
 )
 from .messaging import (
     send_message_with_menu_button,
@@ -31,6 +32,9 @@ from .messaging import (
 __all__ = [
     'get_updates',
     'send_message',
+    'send_prepared_message',
+    'edit_message',
+    'get_message_id',
     'send_message_with_keyboard',
     'send_message_with_reply_keyboard',
     'answer_callback',
@@ -41,10 +45,8 @@ __all__ = [
     'create_user_mention',
     'init_vision_model',
     'describe_image',
-    'download_image',
     'transcribe_voice',
     'parse_voice_command',
-    'download_voice',
     'send_message_with_menu_button',
     'send_message_with_keyboard_and_menu'
 ]
@@ -0,0 +1,248 @@
+"""
+Выполнение нажатий на кнопки (callback) в фоне с быстрым ответом
+
+Клиент Max показывает индикатор загрузки, пока бот не ответил на callback.
+Раньше ответ отправлялся после обработчика (принятие заявки — это выдача
+чата и несколько HTTP-запросов), и пользователь нажимал кнопку ещё раз.
+
+- Обработчик выполняется в пуле фоновых потоков, цикл получения обновлений
+  не ждёт его
+- Если обработчик не ответил за CALLBACK_ACK_BUDGET секунд, на callback
+  отправляется промежуточный ответ CALLBACK_INTERIM_TEXT
+- Ответ обработчика, пришедший после промежуточного, отправляется
+  сообщением в чат: повторно ответить на callback нельзя
+- Нажатия одного чата выполняются по очереди, в порядке поступления
+"""
+import logging
+import threading
+import time
+from collections import deque
+from bot.config import (
+    CALLBACK_WORKERS,
+    CALLBACK_ACK_BUDGET,
+    CALLBACK_INTERIM_TEXT,
+)
+
+logger = logging.getLogger(__name__)
+
+ERROR_TEXT = "❌ Не удалось выполнить действие. Попробуйте ещё раз."
+
+_stop_flag = False
+_workers = []
+_acker_thread = None
+
+_lock = threading.Lock()
+_ready = threading.Condition(_lock)
+# Задания по чатам: {chat_id: deque[(ack, fn)]}; в _ready_chats — чаты,
+# у которых есть задания и ни одно не выполняется
+_chat_jobs = {}
+_ready_chats = deque()
+_active_chats = set()
+
+# Промежуточные ответы: (deadline, ack) в порядке нажатий. Бюджет одинаков
+# для всех нажатий, поэтому очередь упорядочена по deadline
+_pending_acks = deque()
+_ack_ready = threading.Condition(_lock)
+
+_stats = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "interim_acks": 0,
+    "followups": 0,
+    "acked": 0,
+    "total_ack_time": 0.0,
+}
+
+
+class CallbackAck:
+    """
+    Ответ на один callback
+
+    answer() можно вызывать из любого потока сколько угодно раз: на
+    callback уходит только первый ответ, текст последующих — сообщением.
+    """
+
+    def __init__(self, callback_id, chat_id):
+        self.callback_id = callback_id
+        self.chat_id = chat_id
+        self.created = time.monotonic()
+        self.answered = False
+        self._lock = threading.Lock()
+
+    def answer(self, text=None):
+        """Отвечает на callback; если ответ уже отправлен — пишет text в чат"""
+        from bot.utils import answer_callback, send_message
+
+        with self._lock:
+            first = not self.answered
+            self.answered = True
+
+        if first:
+            answer_callback(self.callback_id, text)
+            with _lock:
+                _stats["acked"] += 1
+                _stats["total_ack_time"] += time.monotonic() - self.created
+        elif text:
+            send_message(self.chat_id, text)
+            with _lock:
+                _stats["followups"] += 1
+
+    def answer_interim(self):
+        """Промежуточный ответ, если обработчик ещё не ответил"""
+        from bot.utils import answer_callback
+
+        with self._lock:
+            if self.answered:
+                return
+            self.answered = True
+
+        answer_callback(self.callback_id, CALLBACK_INTERIM_TEXT)
+        with _lock:
+            _stats["interim_acks"] += 1
+            _stats["acked"] += 1
+            _stats["total_ack_time"] += time.monotonic() - self.created
+
+
+def start_callback_service():
+    """Запускает потоки обработки нажатий и поток промежуточных ответов"""
+    global _stop_flag, _acker_thread
+
+    with _lock:
+        if any(worker.is_alive() for worker in _workers):
+            logger.warning("Сервис обработки нажатий уже запущен")
+            return
+        _stop_flag = False
+        _workers.clear()
+        for i in range(CALLBACK_WORKERS):
+            worker = threading.Thread(target=_worker_loop, name=f"callback-{i + 1}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+        _acker_thread = threading.Thread(target=_acker_loop, name="callback-acker", daemon=True)
+        _acker_thread.start()
+
+    logger.info(f"Сервис обработки нажатий запущен ({CALLBACK_WORKERS} потоков, ответ за {CALLBACK_ACK_BUDGET} сек)")
+
+
+def stop_callback_service():
+    """Останавливает потоки; невыполненные нажатия отбрасываются"""
+    global _stop_flag
+
+    with _lock:
+        _stop_flag = True
+        dropped = sum(len(jobs) for jobs in _chat_jobs.values())
+        _chat_jobs.clear()
+        _ready_chats.clear()
+        _pending_acks.clear()
+        _ready.notify_all()
+        _ack_ready.notify_all()
+
+    if dropped:
+        logger.warning(f"Сервис обработки нажатий остановлен, отменено нажатий: {dropped}")
+    else:
+        logger.info("Сервис обработки нажатий остановлен")
+
+
+def submit_callback(ack, fn):
+    """
+    Ставит обработку нажатия в очередь
+
+    Args:
+        ack: CallbackAck этого нажатия
+        fn: функция без аргументов; отвечает через ack.answer()
+    """
+    with _lock:
+        running = any(worker.is_alive() for worker in _workers) and not _stop_flag
+        _stats["submitted"] += 1
+        if running:
+            jobs = _chat_jobs.setdefault(ack.chat_id, deque())
+            jobs.append((ack, fn))
+            if len(jobs) == 1 and ack.chat_id not in _active_chats:
+                _ready_chats.append(ack.chat_id)
+                _ready.notify()
+
+            _pending_acks.append((ack.created + CALLBACK_ACK_BUDGET, ack))
+            _ack_ready.notify()
+            return
+
+    # Сервис не запущен — выполняем в текущем потоке
+    _run(ack, fn)
+
+
+def _worker_loop():
+    while True:
+        with _lock:
+            while not _ready_chats and not _stop_flag:
+                _ready.wait()
+            if _stop_flag:
+                return
+            chat_id = _ready_chats.popleft()
+            jobs = _chat_jobs.get(chat_id)
+            if not jobs:
+                _chat_jobs.pop(chat_id, None)
+                continue
+            ack, fn = jobs.popleft()
+            _active_chats.add(chat_id)
+
+        try:
+            _run(ack, fn)
+        finally:
+            with _lock:
+                _active_chats.discard(chat_id)
+                if _chat_jobs.get(chat_id):
+                    _ready_chats.append(chat_id)
+                    _ready.notify()
+                else:
+                    _chat_jobs.pop(chat_id, None)
+
+
+def _run(ack, fn):
+    try:
+        fn()
+        counter = "completed"
+    except Exception as e:
+        logger.error(f"Ошибка обработки нажатия в чате {ack.chat_id}: {e}", exc_info=True)
+        counter = "failed"
+
+    try:
+        if counter == "failed":
+            ack.answer(ERROR_TEXT)
+        elif not ack.answered:
+            # Обработчик не ответил сам — убираем индикатор загрузки
+            ack.answer()
+    except Exception as e:
+        logger.error(f"Ошибка ответа на нажатие: {e}")
+
+    with _lock:
+        _stats[counter] += 1
+
+
+def _acker_loop():
+    while True:
+        with _lock:
+            while not _stop_flag:
+                if _pending_acks:
+                    wait = _pending_acks[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    _ack_ready.wait(wait)
+                else:
+                    _ack_ready.wait()
+            if _stop_flag:
+                return
+            _, ack = _pending_acks.popleft()
+
+        try:
+            ack.answer_interim()
+        except Exception as e:
+            logger.error(f"Ошибка промежуточного ответа на нажатие: {e}")
+
+
+def get_callback_stats():
+    """Возвращает счётчики сервиса обработки нажатий"""
+    with _lock:
+        stats = dict(_stats)
+        stats["queued"] = sum(len(jobs) for jobs in _chat_jobs.values())
+        stats["active"] = len(_active_chats)
+    stats["avg_ack_time"] = stats.pop("total_ack_time") / stats["acked"] if stats["acked"] else 0.0
+    return stats
@@ -0,0 +1,312 @@
+"""
+Кэш результатов по содержимому файлов (content-addressed)
+
+Ключ — SHA-256 скачанных байтов, поэтому пересланное повторно голосовое
+или фото не распознаётся заново.
+
+- Первый уровень: LRU в памяти процесса
+- Второй уровень: PostgreSQL (таблица content_cache) или файлы на диске
+- У каждой записи есть срок жизни (TTL)
+- Счётчики попаданий по видам кэша
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from threading import Lock
+from bot.config import (
+    CONTENT_CACHE_BACKEND,
+    CONTENT_CACHE_SIZE,
+    CONTENT_CACHE_TTL,
+    CONTENT_CACHE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+# Виды кэшируемых результатов
+KIND_TRANSCRIPT = "transcript"
+KIND_VOICE_COMMAND = "voice_command"
+KIND_IMAGE_DESCRIPTION = "image_description"
+
+# Размер куска при подсчёте хэша файла
+DIGEST_CHUNK_BYTES = 65536
+
+# Как часто удалять просроченные записи из постоянного хранилища, секунды
+PURGE_INTERVAL = 3600
+# Временные файлы моложе этого могут ещё записываться, очистка их не трогает
+TMP_GRACE_SECONDS = 600
+
+# {(kind, digest): (value, expires_at)}
+_memory = OrderedDict()
+_lock = Lock()
+_last_purge = 0.0
+
+# {kind: {"memory_hits", "persistent_hits", "misses", "stores"}}
+_stats = {}
+
+
+def file_digest(f):
+    """
+    SHA-256 содержимого двоичного файла (hex)
+
+    Файл читается кусками, после подсчёта перематывается в начало.
+    """
+    f.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(DIGEST_CHUNK_BYTES), b""):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def _count(kind, counter):
+    kind_stats = _stats.setdefault(kind, {
+        "memory_hits": 0,
+        "persistent_hits": 0,
+        "misses": 0,
+        "stores": 0,
+    })
+    kind_stats[counter] += 1
+
+
+def _remember(kind, digest, value, expires_at):
+    """Кладёт запись в LRU в памяти (вызывается под _lock)"""
+    key = (kind, digest)
+    _memory[key] = (value, expires_at)
+    _memory.move_to_end(key)
+    while len(_memory) > CONTENT_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+def cache_get(kind, digest):
+    """
+    Ищет результат по хэшу содержимого
+
+    Args:
+        kind: KIND_TRANSCRIPT или KIND_IMAGE_DESCRIPTION
+        digest: результат file_digest()
+
+    Returns:
+        str: сохранённый результат или None
+    """
+    now = time.time()
+    key = (kind, digest)
+
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                _memory.move_to_end(key)
+                _count(kind, "memory_hits")
+                return entry[0]
+            del _memory[key]
+
+    try:
+        entry = _persistent_get(kind, digest, now)
+    except Exception as e:
+        logger.error(f"Ошибка чтения кэша {kind}: {e}")
+        entry = None
+
+    with _lock:
+        if entry is None:
+            _count(kind, "misses")
+            return None
+        _remember(kind, digest, *entry)
+        _count(kind, "persistent_hits")
+    return entry[0]
+
+
+def cache_put(kind, digest, value, ttl=CONTENT_CACHE_TTL):
+    """Сохраняет результат в памяти и в постоянном хранилище"""
+    if not value:
+        return
+
+    now = time.time()
+    expires_at = now + ttl
+
+    with _lock:
+        _remember(kind, digest, value, expires_at)
+        _count(kind, "stores")
+
+    try:
+        _persistent_put(kind, digest, value, ttl, expires_at)
+        _maybe_purge(now)
+    except Exception as e:
+        logger.error(f"Ошибка записи кэша {kind}: {e}")
+
+
+def get_cache_stats():
+    """
+    Возвращает счётчики кэша по видам
+
+    Returns:
+        dict: {kind: {'memory_hits', 'persistent_hits', 'misses', 'stores',
+                      'hit_rate'}, 'memory_entries': int, 'backend': str}
+    """
+    with _lock:
+        stats = {kind: dict(counters) for kind, counters in _stats.items()}
+        memory_entries = len(_memory)
+
+    for counters in stats.values():
+        hits = counters["memory_hits"] + counters["persistent_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = hits / lookups if lookups else 0.0
+
+    stats["memory_entries"] = memory_entries
+    stats["backend"] = CONTENT_CACHE_BACKEND
+    return stats
+
+
+def _maybe_purge(now):
+    global _last_purge
+
+    with _lock:
+        if now - _last_purge < PURGE_INTERVAL:
+            return
+        _last_purge = now
+
+    _persistent_purge(now)
+
+
+# === Постоянное хранилище ===
+
+def _persistent_get(kind, digest, now):
+    """Returns: (value, expires_at) или None"""
+    if CONTENT_CACHE_BACKEND == "postgres":
+        return _pg_get(kind, digest, now)
+    if CONTENT_CACHE_BACKEND == "disk":
+        return _disk_get(kind, digest, now)
+    return None
+
+
+def _persistent_put(kind, digest, value, ttl, expires_at):
+    if CONTENT_CACHE_BACKEND == "postgres":
+        _pg_put(kind, digest, value, ttl)
+    elif CONTENT_CACHE_BACKEND == "disk":
+        _disk_put(kind, digest, value, expires_at)
+
+
+def _persistent_purge(now):
+    if CONTENT_CACHE_BACKEND == "postgres":
+        _pg_purge()
+    elif CONTENT_CACHE_BACKEND == "disk":
+        _disk_purge(now)
+
+
+def _pg_execute(query, params=(), fetch=False):
+    """Выполняет запрос к content_cache (таблица создаётся из db/schema.sql)"""
+    from database import get_connection, release_connection
+
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            result = cur.fetchone() if fetch else cur.rowcount
+        conn.commit()
+        return result
+    except Exception:
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def _pg_get(kind, digest, now):
+    row = _pg_execute("""
+        SELECT value, EXTRACT(EPOCH FROM expires_at - NOW())
+        FROM content_cache
+        WHERE kind = %s AND digest = %s AND expires_at > NOW()
+    """, (kind, digest), fetch=True)
+    # Срок считаем относительно NOW() базы, чтобы не зависеть от часовых поясов
+    return (row[0], now + float(row[1])) if row else None
+
+
+def _pg_put(kind, digest, value, ttl):
+    _pg_execute("""
+        INSERT INTO content_cache (kind, digest, value, expires_at)
+        VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+        ON CONFLICT (kind, digest) DO UPDATE
+        SET value = EXCLUDED.value,
+            expires_at = EXCLUDED.expires_at
+    """, (kind, digest, value, ttl))
+
+
+def _pg_purge():
+    purged = _pg_execute("DELETE FROM content_cache WHERE expires_at <= NOW()")
+    if purged:
+        logger.info(f"Кэш: удалено {purged} просроченных записей")
+
+
+def _disk_path(kind, digest):
+    return os.path.join(CONTENT_CACHE_DIR, kind, digest[:2], f"{digest}.json")
+
+
+def _disk_get(kind, digest, now):
+    path = _disk_path(kind, digest)
+    try:
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if entry["expires_at"] <= now:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    return entry["value"], entry["expires_at"]
+
+
+def _disk_put(kind, digest, value, expires_at):
+    path = _disk_path(kind, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Пишем во временный файл и переименовываем, чтобы не оставить битую запись.
+    # Имя временного файла уникально: один ключ могут писать несколько потоков
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=os.path.dirname(path),
+        prefix=f"{os.path.basename(path)}.", suffix=".tmp", delete=False,
+    ) as f:
+        tmp_path = f.name
+        try:
+            json.dump({"value": value, "expires_at": expires_at}, f, ensure_ascii=False)
+        except Exception:
+            f.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+
+def _disk_purge(now):
+    purged = 0
+    for root, _, files in os.walk(CONTENT_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(".tmp"):
+                # Удаляем только брошенные временные файлы, не те, что пишутся сейчас
+                try:
+                    expired = time.time() - os.path.getmtime(path) > TMP_GRACE_SECONDS
+                except OSError:
+                    expired = False
+            else:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        expired = json.load(f)["expires_at"] <= now
+                except (OSError, ValueError, KeyError):
+                    expired = False
+            if expired:
+                try:
+                    os.remove(path)
+                    purged += 1
+                except OSError:
+                    pass
+
+    if purged:
+        logger.info(f"Кэш: удалено {purged} просроченных файлов")
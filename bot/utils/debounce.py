@@ -1,19 +1,130 @@
 """
 Система защиты от множественных нажатий (debounce)
+
+- Записи хранятся в сегментах (lock striping): сегмент выбирается по chat_id,
+  нажатия разных пользователей не ждут одну общую блокировку
+- В каждом сегменте — словарь и очередь записей в порядке нажатий. Окно
+  одинаково для всех действий, поэтому порядок нажатий совпадает с порядком
+  истечения: устаревшие записи снимаются с головы очереди, амортизированно
+  O(1) на нажатие вместо полного обхода словаря
+- DEBOUNCE_BACKEND=postgres дополнительно сверяет нажатие с UNLOGGED
+  таблицей debounce_actions: повтор отсекается, даже если обновления
+  обрабатывают разные процессы бота
 """
 import time
 import logging
+from collections import deque
 from threading import Lock
+from bot.config import DEBOUNCE_TIME, DEBOUNCE_STRIPES, DEBOUNCE_BACKEND
 
 logger = logging.getLogger(__name__)
 
-# Хранилище последних действий пользователей
-# Формат: {(chat_id, action): timestamp}
-_last_actions = {}
-_lock = Lock()
+# Как часто удалять истёкшие записи из таблицы, секунды
+PG_SWEEP_INTERVAL = 60
+
+
+class _Stripe:
+    """Сегмент хранилища: {(chat_id, action): время нажатия} и очередь нажатий"""
+
+    __slots__ = ("lock", "last_actions", "order")
+
+    def __init__(self):
+        self.lock = Lock()
+        self.last_actions = {}
+        # (время нажатия, ключ) в порядке нажатий; повторно нажатый ключ
+        # остаётся в очереди и со старым временем, такие записи пропускаются
+        self.order = deque()
+
+    def evict(self, now):
+        """Снимает с головы очереди истёкшие записи (вызывается под lock)"""
+        order = self.order
+        while order and now - order[0][0] >= DEBOUNCE_TIME:
+            pressed_at, key = order.popleft()
+            if self.last_actions.get(key) == pressed_at:
+                del self.last_actions[key]
+
+
+_stripes = [_Stripe() for _ in range(DEBOUNCE_STRIPES)]
+_stats_lock = Lock()
+_stats = {
+    "allowed": 0,
+    "rejected": 0,
+    "backend_errors": 0,
+}
+
+
+def _stripe_for(chat_id):
+    return _stripes[hash(chat_id) % DEBOUNCE_STRIPES]
+
+
+def _check_local(chat_id, action, now):
+    """Проверка и запись нажатия в памяти процесса"""
+    key = (chat_id, action)
+    stripe = _stripe_for(chat_id)
+
+    with stripe.lock:
+        stripe.evict(now)
+        last = stripe.last_actions.get(key)
+        if last is not None and now - last < DEBOUNCE_TIME:
+            return False
+        stripe.last_actions[key] = now
+        stripe.order.append((now, key))
+        return True
+
+
+class PostgresDebounceBackend:
+    """
+    Нажатия в UNLOGGED таблице debounce_actions
+
+    Проверка и запись — один запрос: строка вставляется или обновляется,
+    только если прежняя запись истекла. RETURNING пуст — действие уже
+    выполнялось в пределах окна (возможно, в другом процессе).
+    """
+
+    def __init__(self):
+        self._last_sweep = 0.0
+        self._lock = Lock()
+
+    def try_acquire(self, chat_id, action):
+        from database import get_connection, release_connection
+
+        conn = None
+        try:
+            conn = get_connection()
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO debounce_actions (key, expires_at)
+                    VALUES (%s, clock_timestamp() + make_interval(secs => %s))
+                    ON CONFLICT (key) DO UPDATE
+                    SET expires_at = EXCLUDED.expires_at
+                    WHERE debounce_actions.expires_at <= clock_timestamp()
+                    RETURNING 1
+                """, (f"{chat_id}:{action}", DEBOUNCE_TIME))
+                allowed = cur.fetchone() is not None
+
+                if self._sweep_due():
+                    cur.execute("DELETE FROM debounce_actions WHERE expires_at <= clock_timestamp()")
+            conn.commit()
+            return allowed
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                release_connection(conn)
+
+    def _sweep_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep < PG_SWEEP_INTERVAL:
+                return False
+            self._last_sweep = now
+            return True
+
+
+_backend = PostgresDebounceBackend() if DEBOUNCE_BACKEND == "postgres" else None
 
-# Время ожидания между одинаковыми действиями (в секундах)
-DEBOUNCE_TIME = 2  # 2 секунды
 
 def is_action_allowed(chat_id, action):
     """
@@ -26,42 +137,65 @@ def is_action_allowed(chat_id, action):
     Returns:
         bool: True если действие разрешено, False если нужно подождать
     """
-    with _lock:
-        key = (str(chat_id), action)
-        current_time = time.time()
-
-        # Проверяем, было ли это действие недавно
-        if key in _last_actions:
-            time_since_last = current_time - _last_actions[key]
+    chat_id = str(chat_id)
 
-            if time_since_last < DEBOUNCE_TIME:
-                logger.warning(f"Debounce: пользователь {chat_id} пытается повторить действие '{action}' слишком быстро")
-                return False
-
-        # Разрешаем действие и сохраняем время
-        _last_actions[key] = current_time
+    # Повтор в этом же процессе отсекается без обращения к БД
+    allowed = _check_local(chat_id, action, time.monotonic())
 
-        # Очищаем старые записи (старше 10 секунд)
-        _cleanup_old_actions(current_time)
+    if allowed and _backend is not None:
+        try:
+            allowed = _backend.try_acquire(chat_id, action)
+        except Exception as e:
+            # Без БД остаётся защита в пределах процесса
+            logger.error(f"Debounce: ошибка общего хранилища, проверка только локально: {e}")
+            with _stats_lock:
+                _stats["backend_errors"] += 1
 
-        return True
+    with _stats_lock:
+        _stats["allowed" if allowed else "rejected"] += 1
 
-def _cleanup_old_actions(current_time):
-    """Удаляет старые записи из кэша"""
-    keys_to_remove = []
+    if not allowed:
+        logger.warning(f"Debounce: пользователь {chat_id} пытается повторить действие '{action}' слишком быстро")
+    return allowed
 
-    for key, timestamp in _last_actions.items():
-        if current_time - timestamp > 10:  # Старше 10 секунд
-            keys_to_remove.append(key)
-
-    for key in keys_to_remove:
-        del _last_actions[key]
 
 def clear_action(chat_id, action):
     """
     Принудительно очищает действие (используется когда нужно разрешить повторное действие)
+
+    Запись в очереди сегмента остаётся и будет пропущена при вытеснении.
     """
-    with _lock:
-        key = (str(chat_id), action)
-        if key in _last_actions:
-            del _last_actions[key]
+    chat_id = str(chat_id)
+    stripe = _stripe_for(chat_id)
+    with stripe.lock:
+        stripe.last_actions.pop((chat_id, action), None)
+
+    if _backend is not None:
+        from database import get_connection, release_connection
+
+        conn = None
+        try:
+            conn = get_connection()
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM debounce_actions WHERE key = %s", (f"{chat_id}:{action}",))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Debounce: ошибка очистки действия в общем хранилище: {e}")
+            if conn:
+                conn.rollback()
+        finally:
+            if conn:
+                release_connection(conn)
+
+
+def get_debounce_stats():
+    """Возвращает счётчики debounce"""
+    with _stats_lock:
+        stats = dict(_stats)
+    entries = 0
+    for stripe in _stripes:
+        with stripe.lock:
+            entries += len(stripe.last_actions)
+    stats["entries"] = entries
+    stats["backend"] = DEBOUNCE_BACKEND
+    return stats
@@ -0,0 +1,200 @@
+"""
+Поиск почти одинаковых изображений (перцептивный хэш)
+
+Незрячие пользователи часто присылают несколько снимков одного предмета
+подряд: повтор, чуть сдвинутый кадр. Такие снимки отличаются побайтово,
+поэтому кэш по SHA-256 их не находит.
+
+- dHash 64 бита: разность яркости соседних пикселей уменьшенного до 9x8
+  изображения; устойчив к пересжатию, масштабу и небольшим сдвигам
+- BK-дерево по расстоянию Хэмминга: поиск хэшей в пределах порога без
+  перебора всех записей
+- Записи живут VISION_DUP_WINDOW секунд и ищутся только среди снимков
+  того же чата: описание чужого фото не должно попасть другому человеку
+"""
+import logging
+import time
+from threading import Lock
+from PIL import Image, ImageOps
+from bot.config import (
+    VISION_DUP_THRESHOLD,
+    VISION_DUP_WINDOW,
+    VISION_DUP_MAX_ENTRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Размер, до которого уменьшается изображение: 9x8 даёт 8x8 = 64 сравнения
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+
+
+def image_dhash(source):
+    """
+    dHash изображения
+
+    Args:
+        source: двоичный файловый объект с изображением
+
+    Returns:
+        int: 64-битный хэш
+    """
+    source.seek(0)
+    with Image.open(source) as img:
+        # Для JPEG декодирование сразу в уменьшенном масштабе
+        img.draft("L", (HASH_WIDTH * 8, HASH_HEIGHT * 8))
+        img = ImageOps.exif_transpose(img)
+        small = img.convert("L").resize((HASH_WIDTH, HASH_HEIGHT), Image.LANCZOS)
+        pixels = list(small.getdata())
+
+    value = 0
+    for row in range(HASH_HEIGHT):
+        offset = row * HASH_WIDTH
+        for col in range(HASH_WIDTH - 1):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    BK-дерево по расстоянию Хэмминга
+
+    Узел: [hash, items, {distance: child}]; items — записи с этим хэшем.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, threshold):
+        """
+        Returns:
+            list: [(distance, item), ...] для хэшей не дальше threshold
+        """
+        found = []
+        if self._root is None:
+            return found
+
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= threshold:
+                found.extend((distance, item) for item in node[1])
+            # Неравенство треугольника: дальше искать только в этих ветках
+            for edge, child in node[2].items():
+                if distance - threshold <= edge <= distance + threshold:
+                    stack.append(child)
+        return found
+
+    def items(self):
+        """Все записи: [(hash, item), ...]"""
+        result = []
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            result.extend((node[0], item) for item in node[1])
+            stack.extend(node[2].values())
+        return result
+
+
+_tree = BKTree()
+_lock = Lock()
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "stored": 0,
+    "rebuilds": 0,
+}
+
+
+def find_similar(chat_id, image_hash, now=None):
+    """
+    Ищет описание недавнего похожего снимка из того же чата
+
+    Returns:
+        str: описание ближайшего снимка в пределах VISION_DUP_THRESHOLD или None
+    """
+    now = now or time.time()
+    with _lock:
+        best = None
+        for distance, (item_chat_id, description, created_at) in _tree.search(image_hash, VISION_DUP_THRESHOLD):
+            if now - created_at > VISION_DUP_WINDOW:
+                continue
+            if item_chat_id == chat_id and (best is None or distance < best[0]):
+                best = (distance, description)
+
+        if best is None:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+
+    logger.info(f"Найден похожий снимок (расстояние {best[0]} из 64), описание взято из кэша")
+    return best[1]
+
+
+def remember(chat_id, image_hash, description, now=None):
+    """Добавляет описанный снимок в индекс"""
+    now = now or time.time()
+    with _lock:
+        _tree.add(image_hash, (chat_id, description, now))
+        _stats["stored"] += 1
+        if _tree.size > VISION_DUP_MAX_ENTRIES:
+            _rebuild(now)
+
+
+def _rebuild(now):
+    """
+    Пересобирает дерево без истёкших записей (вызывается под _lock)
+
+    Из BK-дерева нельзя дёшево удалять, поэтому устаревшие записи
+    вычищаются пересборкой, когда дерево переполняется.
+    """
+    global _tree
+
+    alive = [
+        (value, item) for value, item in _tree.items()
+        if now - item[2] <= VISION_DUP_WINDOW
+    ]
+    # Оставляем не больше половины лимита (самые свежие), чтобы пересборки были редкими
+    alive.sort(key=lambda entry: entry[1][2])
+    alive = alive[-(VISION_DUP_MAX_ENTRIES // 2):]
+
+    tree = BKTree()
+    for value, item in alive:
+        tree.add(value, item)
+    _tree = tree
+    _stats["rebuilds"] += 1
+
+
+def get_index_stats():
+    """Возвращает счётчики индекса похожих снимков"""
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = _tree.size
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
@@ -52,6 +52,54 @@ def send_message(chat_id, text, attachments=None, markup=None):
         logger.error(f"Ошибка отправки сообщения: {response.status_code}, {response.text}")
         return None
 
+def send_prepared_message(chat_id, body, label="сообщение"):
+    """
+    Отправляет сообщение с заранее сериализованным телом
+
+    Args:
+        chat_id: ID чата
+        body: JSON тела запроса (bytes), например из bot.utils.menu_cache
+        label: что отправлено (для логов)
+    """
+    params = _add_token({"chat_id": chat_id})
+
+    response = requests.post(f"{BASE_URL}/messages", headers=HEADERS, params=params, data=body)
+
+    if response.status_code == 200:
+        logger.info(f"Отправлено в чат {chat_id}: {label}")
+        return response.json()
+    else:
+        logger.error(f"Ошибка отправки сообщения: {response.status_code}, {response.text}")
+        return None
+
+def edit_message(message_id, text, attachments=None):
+    """
+    Редактирует текст ранее отправленного сообщения
+
+    Если attachments не переданы, вложения (клавиатура) остаются прежними.
+    """
+    params = _add_token({"message_id": message_id})
+
+    data = {"text": text}
+
+    if attachments is not None:
+        data["attachments"] = attachments
+
+    response = requests.put(f"{BASE_URL}/messages", headers=HEADERS, params=params, json=data)
+
+    if response.status_code == 200:
+        logger.info(f"Сообщение {message_id} отредактировано: {text}")
+        return response.json()
+    else:
+        logger.error(f"Ошибка редактирования сообщения: {response.status_code}, {response.text}")
+        return None
+
+def get_message_id(response):
+    """Достаёт ID сообщения (mid) из ответа send_message"""
+    if not response:
+        return None
+    return response.get("message", {}).get("body", {}).get("mid")
+
 def send_message_with_reply_keyboard(chat_id, text, buttons):
     """
     Отправляет сообщение с обычной клавиатурой (reply keyboard)
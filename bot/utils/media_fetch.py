@@ -0,0 +1,200 @@
+"""
+Потоковое скачивание вложений (фото, голосовые)
+
+- Тело ответа читается кусками, размер ограничен сверху: по Content-Length
+  ещё до чтения и по фактически прочитанным байтам
+- Тип проверяется по сигнатуре первых байтов (magic); если сигнатура
+  неизвестна — по Content-Type. HTML-страница с ошибкой вместо файла
+  отклоняется сразу
+- iter_media отдаёт куски по мере скачивания: декодер (ffmpeg) начинает
+  работу до окончания загрузки
+- fetch_media складывает тело в SpooledTemporaryFile: в памяти держится
+  не больше MEDIA_SPOOL_BYTES на задание, остальное уходит во временный файл
+  (фото для описания)
+- save_media пишет тело в файл по мере скачивания (голосовые, которые
+  читает рабочий процесс распознавания)
+- Сертификаты TLS проверяются (MEDIA_VERIFY_TLS)
+"""
+import logging
+import tempfile
+import requests
+from bot.config import (
+    MEDIA_MAX_IMAGE_BYTES,
+    MEDIA_MAX_AUDIO_BYTES,
+    MEDIA_SPOOL_BYTES,
+    MEDIA_FETCH_TIMEOUT,
+    MEDIA_VERIFY_TLS,
+)
+from bot.utils.scratch import get_scratch_dir
+
+logger = logging.getLogger(__name__)
+
+KIND_IMAGE = "image"
+KIND_AUDIO = "audio"
+
+CHUNK_BYTES = 16384
+
+_MAX_BYTES = {
+    KIND_IMAGE: MEDIA_MAX_IMAGE_BYTES,
+    KIND_AUDIO: MEDIA_MAX_AUDIO_BYTES,
+}
+
+# Сигнатуры форматов: (смещение, байты)
+_SIGNATURES = {
+    KIND_IMAGE: (
+        (0, b"\xff\xd8\xff"),           # JPEG
+        (0, b"\x89PNG\r\n\x1a\n"),      # PNG
+        (0, b"GIF87a"),
+        (0, b"GIF89a"),
+        (8, b"WEBP"),                   # RIFF....WEBP
+        (0, b"BM"),                     # BMP
+        (4, b"ftypheic"),
+        (4, b"ftypheix"),
+        (4, b"ftypmif1"),
+        (0, b"II*\x00"),                # TIFF
+        (0, b"MM\x00*"),
+    ),
+    KIND_AUDIO: (
+        (0, b"OggS"),                   # Ogg (Opus, Vorbis)
+        (0, b"ID3"),                    # MP3 с тегами
+        (0, b"\xff\xfb"),               # MP3
+        (0, b"\xff\xf3"),
+        (0, b"\xff\xf2"),
+        (0, b"\xff\xf1"),               # AAC ADTS
+        (0, b"\xff\xf9"),
+        (8, b"WAVE"),                   # RIFF....WAVE
+        (4, b"ftyp"),                   # M4A / MP4
+        (0, b"\x1a\x45\xdf\xa3"),       # WebM / Matroska
+        (0, b"#!AMR"),
+        (0, b"fLaC"),
+    ),
+}
+
+# Сколько первых байтов нужно для проверки сигнатуры
+SNIFF_BYTES = 16
+
+
+class MediaFetchError(Exception):
+    """Вложение не скачано (текст — для логов)"""
+
+
+class MediaTooLarge(MediaFetchError):
+    """Вложение больше допустимого размера"""
+
+
+class MediaTypeMismatch(MediaFetchError):
+    """Содержимое не похоже на ожидаемый тип вложения"""
+
+
+def sniff_kind(head):
+    """
+    Определяет вид вложения по первым байтам
+
+    Returns:
+        str: KIND_IMAGE, KIND_AUDIO или None, если сигнатура неизвестна
+    """
+    for kind, signatures in _SIGNATURES.items():
+        for offset, magic in signatures:
+            if head[offset:offset + len(magic)] == magic:
+                return kind
+    return None
+
+
+def _check_type(kind, head, content_type):
+    sniffed = sniff_kind(head)
+    if sniffed == kind:
+        return
+    if sniffed is None and content_type.startswith(f"{kind}/"):
+        return
+    raise MediaTypeMismatch(f"Ожидался {kind}, получено {sniffed or content_type or 'неизвестно'}")
+
+
+def iter_media(url, kind, max_bytes=None, timeout=MEDIA_FETCH_TIMEOUT):
+    """
+    Отдаёт тело вложения кусками по мере скачивания
+
+    Тип и размер проверяются до того, как первый кусок отдан потребителю.
+
+    Args:
+        url: URL вложения
+        kind: KIND_IMAGE или KIND_AUDIO
+        max_bytes: предел размера (по умолчанию MEDIA_MAX_IMAGE_BYTES / MEDIA_MAX_AUDIO_BYTES)
+
+    Yields:
+        bytes: куски тела ответа
+
+    Raises:
+        MediaTooLarge, MediaTypeMismatch, requests.RequestException
+    """
+    max_bytes = max_bytes or _MAX_BYTES[kind]
+
+    with requests.get(url, stream=True, timeout=timeout, verify=MEDIA_VERIFY_TLS) as response:
+        response.raise_for_status()
+
+        declared = response.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise MediaTooLarge(f"Вложение {int(declared) // 1024} КБ больше лимита {max_bytes // 1024} КБ")
+
+        content_type = response.headers.get("content-type", "").lower()
+        received = 0
+        head = b""
+
+        for chunk in response.iter_content(CHUNK_BYTES):
+            if not chunk:
+                continue
+
+            received += len(chunk)
+            if received > max_bytes:
+                raise MediaTooLarge(f"Вложение больше лимита {max_bytes // 1024} КБ")
+
+            if head is not None:
+                # Первые байты копим, пока их не хватит для сигнатуры
+                head += chunk
+                if len(head) < SNIFF_BYTES:
+                    continue
+                _check_type(kind, head, content_type)
+                chunk, head = head, None
+
+            yield chunk
+
+        if head:
+            _check_type(kind, head, content_type)
+            yield head
+
+
+def fetch_media(url, kind, max_bytes=None):
+    """
+    Скачивает вложение во временный буфер (в памяти до MEDIA_SPOOL_BYTES)
+
+    Returns:
+        SpooledTemporaryFile: буфер, перемотанный в начало; закрыть после использования
+
+    Raises:
+        MediaFetchError, requests.RequestException
+    """
+    # Сверх MEDIA_SPOOL_BYTES буфер уходит в каталог временных файлов (может быть tmpfs)
+    buffer = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_BYTES, dir=get_scratch_dir())
+    try:
+        for chunk in iter_media(url, kind, max_bytes):
+            buffer.write(chunk)
+    except Exception:
+        buffer.close()
+        raise
+
+    buffer.seek(0)
+    return buffer
+
+
+def save_media(url, save_path, kind, max_bytes=None):
+    """
+    Скачивает вложение в файл по мере получения (в памяти — один кусок)
+
+    При ошибке файл может остаться недокачанным; удаляет его вызывающий код.
+
+    Raises:
+        MediaFetchError, requests.RequestException
+    """
+    with open(save_path, "wb") as f:
+        for chunk in iter_media(url, kind, max_bytes):
+            f.write(chunk)
+
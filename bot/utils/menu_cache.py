@@ -0,0 +1,180 @@
+"""
+Кэш меню: профили пользователей и готовые тела сообщений меню
+
+- Профиль (роль, статус верификации, блокировка) загружается из БД один
+  раз и хранится до MENU_CACHE_TTL секунд; database сообщает об изменении
+  роли или статуса (add_user_change_listener), и запись сбрасывается сразу
+- Меню зависит только от роли и статуса верификации, поэтому тело запроса
+  (JSON с текстом и клавиатурой) строится и сериализуется один раз на
+  вариант и переиспользуется для всех пользователей
+- Обычное нажатие "📋 Меню" не обращается ни к БД, ни к построению кнопок
+- TTL ограничивает устаревание, если роль изменил другой процесс бота
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+from bot.config import MENU_CACHE_TTL, MENU_CACHE_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+# {chat_id: (профиль, expires_at)} в порядке последнего обращения
+_profiles = OrderedDict()
+# {chat_id: [поколение, число загрузок]} — только для профилей, которые
+# сейчас загружаются из БД; invalidate_user увеличивает поколение, и
+# загрузка, начатая до сброса, не попадает в кэш
+_loading = {}
+# {вариант меню: bytes}
+_payloads = {}
+_lock = Lock()
+_listener_registered = False
+
+_stats = {
+    "profile_hits": 0,
+    "profile_misses": 0,
+    "invalidations": 0,
+    "stale_loads": 0,
+    "payloads_built": 0,
+}
+
+
+def _load_profile(chat_id):
+    from database import get_user, get_volunteer_info
+
+    user = get_user(chat_id)
+    if not user:
+        return None
+
+    profile = {
+        "role": user.get("role"),
+        "verification_status": None,
+        "is_blocked": False,
+        "block_reason": None,
+    }
+    if profile["role"] == "volunteer":
+        volunteer_info = get_volunteer_info(chat_id)
+        if not volunteer_info:
+            return None
+        profile["verification_status"] = volunteer_info.get("verification_status", "unverified")
+        profile["is_blocked"] = volunteer_info.get("is_blocked", False)
+        profile["block_reason"] = volunteer_info.get("block_reason")
+    return profile
+
+
+def _ensure_listener():
+    """Подписка на изменения пользователей в database (один раз)"""
+    global _listener_registered
+
+    if _listener_registered:
+        return
+    from database import add_user_change_listener
+
+    with _lock:
+        if _listener_registered:
+            return
+        _listener_registered = True
+    add_user_change_listener(invalidate_user)
+
+
+def get_user_profile(chat_id):
+    """
+    Профиль пользователя для построения меню
+
+    Returns:
+        dict: {"role", "verification_status", "is_blocked", "block_reason"}
+              или None, если пользователь не зарегистрирован (не кэшируется)
+    """
+    _ensure_listener()
+    key = str(chat_id)
+    now = time.monotonic()
+
+    with _lock:
+        entry = _profiles.get(key)
+        if entry is not None and entry[1] > now:
+            _profiles.move_to_end(key)
+            _stats["profile_hits"] += 1
+            return entry[0]
+        _stats["profile_misses"] += 1
+        loading = _loading.setdefault(key, [0, 0])
+        loading[1] += 1
+        generation = loading[0]
+
+    try:
+        profile = _load_profile(chat_id)
+    finally:
+        with _lock:
+            loading[1] -= 1
+            stale = loading[0] != generation
+            if loading[1] == 0:
+                del _loading[key]
+
+    if profile is None:
+        return None
+
+    with _lock:
+        if stale:
+            # Профиль изменился во время загрузки: прочитанное могло устареть
+            _stats["stale_loads"] += 1
+            return profile
+        _profiles[key] = (profile, now + MENU_CACHE_TTL)
+        _profiles.move_to_end(key)
+        while len(_profiles) > MENU_CACHE_MAX_ENTRIES:
+            _profiles.popitem(last=False)
+    return profile
+
+
+def get_user_role(chat_id):
+    """Роль пользователя или None"""
+    profile = get_user_profile(chat_id)
+    return profile["role"] if profile else None
+
+
+def invalidate_user(chat_id):
+    """Сбрасывает профиль: роль или статус пользователя изменились"""
+    key = str(chat_id)
+    with _lock:
+        loading = _loading.get(key)
+        if loading is not None:
+            loading[0] += 1
+        if _profiles.pop(key, None) is not None:
+            _stats["invalidations"] += 1
+
+
+def get_menu_payload(variant, build):
+    """
+    Готовое тело сообщения меню
+
+    Args:
+        variant: ключ варианта меню, например ("volunteer", "verified")
+        build: функция без аргументов, возвращает (text, buttons);
+               вызывается только при первом обращении к варианту
+
+    Returns:
+        bytes: JSON тела запроса POST /messages
+    """
+    payload = _payloads.get(variant)
+    if payload is not None:
+        return payload
+
+    text, buttons = build()
+    data = {
+        "text": text,
+        "attachments": [{"type": "inline_keyboard", "payload": {"buttons": buttons}}],
+    }
+    payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    with _lock:
+        # Параллельная сборка того же варианта даёт одинаковый результат
+        _payloads.setdefault(variant, payload)
+        _stats["payloads_built"] += 1
+    return payload
+
+
+def get_menu_cache_stats():
+    """Возвращает счётчики кэша меню"""
+    with _lock:
+        stats = dict(_stats)
+        stats["profiles"] = len(_profiles)
+        stats["payloads"] = len(_payloads)
+    return stats
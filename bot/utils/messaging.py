@@ -3,9 +3,25 @@
 """
 import logging
 from .max_api import send_message as _send_message_api, send_message_with_keyboard as _send_message_with_keyboard_api
+from .menu_cache import get_user_role
 
 logger = logging.getLogger(__name__)
 
+# Клавиатура с кнопкой "📋 Меню" для send_message_with_menu_button
+MENU_KEYBOARD = {
+    "type": "inline_keyboard",
+    "payload": {
+        "buttons": [[{
+            "type": "message",
+            "text": "📋 Меню",
+            "payload": "/menu"
+        }]]
+    }
+}
+
+# Строка с кнопкой "Назад в меню" для send_message_with_keyboard_and_menu
+BACK_TO_MENU_ROW = [{"type": "callback", "text": "🔙 Назад в меню", "payload": "menu"}]
+
 def send_message_with_menu_button(chat_id, text, attachments=None, markup=None, add_menu_button=True):
     """
     Отправляет сообщение с автоматическим добавлением кнопки меню для нуждающихся
@@ -20,29 +36,9 @@ def send_message_with_menu_button(chat_id, text, attachments=None, markup=None,
     if not add_menu_button:
         return _send_message_api(chat_id, text, attachments, markup)
 
-    # Проверяем, нуждающийся ли это
-    from database import get_user
-    user = get_user(chat_id)
-
-    # Добавляем кнопку меню только для нуждающихся
-    if user and user.get('role') == 'needy':
-        # Создаём клавиатуру с кнопкой меню
-        keyboard_buttons = [[{
-            "type": "message",
-            "text": "📋 Меню",
-            "payload": "/menu"
-        }]]
-
-        # Добавляем клавиатуру к сообщению
-        if not attachments:
-            attachments = []
-
-        attachments.append({
-            "type": "inline_keyboard",
-            "payload": {
-                "buttons": keyboard_buttons
-            }
-        })
+    # Добавляем кнопку меню только для нуждающихся (роль — из кэша меню)
+    if get_user_role(chat_id) == 'needy':
+        attachments = (attachments or []) + [MENU_KEYBOARD]
 
     return _send_message_api(chat_id, text, attachments, markup)
 
@@ -56,22 +52,16 @@ def send_message_with_keyboard_and_menu(chat_id, text, buttons, add_menu_button=
         buttons: Inline кнопки
         add_menu_button: Добавлять ли кнопку "Назад в меню" (по умолчанию True)
     """
-    # Проверяем, нуждающийся ли это
-    from database import get_user
-    user = get_user(chat_id)
-
-    # Добавляем кнопку "Назад в меню" только для нуждающихся
-    if add_menu_button and user and user.get('role') == 'needy':
-        # Проверяем, нет ли уже кнопки меню
-        has_menu_button = False
-        for row in buttons:
-            for btn in row:
-                if btn.get('payload') == 'menu' or btn.get('text') == '🔙 Назад в меню':
-                    has_menu_button = True
-                    break
+    # Добавляем кнопку "Назад в меню" только для нуждающихся (роль — из кэша меню)
+    if add_menu_button and get_user_role(chat_id) == 'needy':
+        has_menu_button = any(
+            btn.get('payload') == 'menu' or btn.get('text') == '🔙 Назад в меню'
+            for row in buttons
+            for btn in row
+        )
 
         # Добавляем кнопку меню, если её ещё нет
         if not has_menu_button:
-            buttons = buttons + [[{"type": "callback", "text": "🔙 Назад в меню", "payload": "menu"}]]
+            buttons = buttons + [BACK_TO_MENU_ROW]
 
     return _send_message_with_keyboard_api(chat_id, text, buttons)
@@ -0,0 +1,238 @@
+"""
+Таблица маршрутов для payload кнопок и текстовых команд
+
+Маршрут — шаблон и обработчик:
+    router.add("menu", show_menu)                               # точное совпадение
+    router.add("accept_request_{request_id:id}", accept)        # префикс + аргументы
+    router.add("rate_volunteer_{request_id:id}_{rating:int}", rate)
+
+- Точные шаблоны ищутся в словаре, шаблоны с аргументами — по префиксному
+  дереву (trie) от литерала до первого аргумента: поиск за O(длины payload)
+  вместо перебора всех веток if/elif
+- Хвост payload проверяется скомпилированным регулярным выражением и
+  приводится к типам один раз, до вызова обработчика: неверный payload
+  отклоняется без обращения к обработчику и к БД
+- По каждому маршруту считаются вызовы, ошибки и время выполнения
+
+Типы аргументов:
+    int — целое число (SERIAL id)
+    id  — строковый идентификатор из букв, цифр и дефиса (id заявок)
+    str — любая непустая строка без пробелов (по умолчанию)
+"""
+import logging
+import re
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+# Payload длиннее этого отклоняется сразу (у Max ограничение на payload кнопки)
+MAX_PAYLOAD_LENGTH = 256
+
+_TYPES = {
+    "int": (r"\d+", int),
+    "id": (r"[0-9A-Za-z\-]+", str),
+    "str": (r"\S+", str),
+}
+
+_PLACEHOLDER = re.compile(r"\{(\w+)(?::(\w+))?\}")
+
+# Ключ, под которым в узле дерева лежат маршруты, оканчивающиеся в этом узле
+_ROUTES = None
+
+
+class Route:
+    """Маршрут: шаблон, обработчик и счётчики"""
+
+    __slots__ = ("name", "handler", "critical", "prefix", "tail", "converters",
+                 "calls", "errors", "total_time", "max_time")
+
+    def __init__(self, name, handler, critical, prefix, tail, converters):
+        self.name = name
+        self.handler = handler
+        self.critical = critical
+        self.prefix = prefix
+        self.tail = tail
+        self.converters = converters
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def parse(self, payload):
+        """Аргументы из хвоста payload или None, если он не подходит"""
+        match = self.tail.fullmatch(payload, len(self.prefix))
+        if match is None:
+            return None
+        try:
+            return {key: self.converters[key](value) for key, value in match.groupdict().items()}
+        except ValueError:
+            return None
+
+
+def _compile(pattern):
+    """
+    Разбирает шаблон
+
+    Returns:
+        tuple: (литеральный префикс, regex хвоста или None, {аргумент: тип})
+    """
+    first = _PLACEHOLDER.search(pattern)
+    if first is None:
+        return pattern, None, {}
+
+    prefix = pattern[:first.start()]
+    regex = []
+    converters = {}
+    position = first.start()
+    for placeholder in _PLACEHOLDER.finditer(pattern, position):
+        name, type_name = placeholder.group(1), placeholder.group(2) or "str"
+        if type_name not in _TYPES:
+            raise ValueError(f"Неизвестный тип аргумента {type_name} в шаблоне {pattern}")
+        if name in converters:
+            raise ValueError(f"Аргумент {name} повторяется в шаблоне {pattern}")
+        regex.append(re.escape(pattern[position:placeholder.start()]))
+        regex.append(f"(?P<{name}>{_TYPES[type_name][0]})")
+        converters[name] = _TYPES[type_name][1]
+        position = placeholder.end()
+    regex.append(re.escape(pattern[position:]))
+
+    return prefix, re.compile("".join(regex)), converters
+
+
+class Router:
+    """
+    Таблица маршрутов
+
+    Args:
+        name: имя таблицы (для логов)
+        normalize: функция приведения входной строки (например, к нижнему регистру)
+    """
+
+    def __init__(self, name, normalize=None):
+        self.name = name
+        self.normalize = normalize
+        self._exact = {}
+        self._trie = {}
+        self._routes = []
+        self._lock = Lock()
+        self._rejected = 0
+
+    def add(self, patterns, handler, critical=False, name=None):
+        """
+        Регистрирует обработчик
+
+        Args:
+            patterns: шаблон или список шаблонов
+            handler: функция handler(*args, **аргументы_шаблона), args — из dispatch
+            critical: действие защищается от двойных нажатий
+            name: имя маршрута в статистике (по умолчанию — первый шаблон)
+        """
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        name = name or patterns[0]
+
+        for pattern in patterns:
+            prefix, tail, converters = _compile(pattern)
+            route = Route(name, handler, critical, prefix, tail, converters)
+            self._routes.append(route)
+
+            if tail is None:
+                if pattern in self._exact:
+                    raise ValueError(f"Шаблон {pattern} уже зарегистрирован в {self.name}")
+                self._exact[pattern] = route
+                continue
+
+            node = self._trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(_ROUTES, []).append(route)
+
+    def route(self, patterns, critical=False, name=None):
+        """Декоратор для add"""
+        def decorator(handler):
+            self.add(patterns, handler, critical=critical, name=name)
+            return handler
+        return decorator
+
+    def match(self, payload):
+        """
+        Ищет маршрут
+
+        Returns:
+            tuple: (Route, {аргумент: значение}) или None
+        """
+        if not payload or len(payload) > MAX_PAYLOAD_LENGTH:
+            return self._reject(payload)
+        if self.normalize:
+            payload = self.normalize(payload)
+
+        route = self._exact.get(payload)
+        if route is not None:
+            return route, {}
+
+        # Префиксы, совпавшие по пути в дереве; проверяем от самого длинного
+        candidates = []
+        node = self._trie
+        for char in payload:
+            node = node.get(char)
+            if node is None:
+                break
+            if _ROUTES in node:
+                candidates.append(node[_ROUTES])
+
+        for routes in reversed(candidates):
+            for route in routes:
+                params = route.parse(payload)
+                if params is not None:
+                    return route, params
+
+        return self._reject(payload)
+
+    def _reject(self, payload):
+        logger.debug(f"{self.name}: нет маршрута для {payload!r:.80}")
+        with self._lock:
+            self._rejected += 1
+        return None
+
+    def dispatch(self, matched, *args):
+        """
+        Вызывает обработчик найденного маршрута и учитывает время
+
+        Args:
+            matched: результат match()
+            args: аргументы обработчика перед аргументами шаблона
+        """
+        route, params = matched
+        started = time.perf_counter()
+        try:
+            return route.handler(*args, **params)
+        except Exception:
+            with self._lock:
+                route.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                route.calls += 1
+                route.total_time += elapsed
+                if elapsed > route.max_time:
+                    route.max_time = elapsed
+
+    def get_stats(self):
+        """Счётчики по маршрутам: {имя: {calls, errors, avg_ms, max_ms}}"""
+        stats = {}
+        with self._lock:
+            # У маршрута с несколькими шаблонами счётчики складываются по имени
+            for route in self._routes:
+                entry = stats.setdefault(route.name, {"calls": 0, "errors": 0, "total": 0.0, "max_ms": 0.0})
+                entry["calls"] += route.calls
+                entry["errors"] += route.errors
+                entry["total"] += route.total_time
+                entry["max_ms"] = max(entry["max_ms"], route.max_time * 1000)
+            rejected = self._rejected
+
+        for entry in stats.values():
+            total = entry.pop("total")
+            entry["avg_ms"] = total * 1000 / entry["calls"] if entry["calls"] else 0.0
+        return {"routes": stats, "rejected": rejected}
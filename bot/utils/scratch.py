@@ -0,0 +1,158 @@
+"""
+Временные файлы (scratch)
+
+- Уникальные имена (tempfile), одинаковые секунды и чаты не конфликтуют
+- new_scratch_path/remove_scratch: файл живёт, пока его не удалит владелец
+  (голосовое для рабочего процесса распознавания удаляется по завершении
+  задания)
+- Фоновый уборщик (janitor) удаляет файлы старше SCRATCH_MAX_AGE: остатки
+  после аварийного завершения процесса или забытые файлы
+- SCRATCH_USE_RAM=true размещает файлы в /dev/shm (tmpfs), если он есть
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from bot.config import (
+    DOWNLOADS_DIR,
+    SCRATCH_USE_RAM,
+    SCRATCH_MAX_AGE,
+    SCRATCH_JANITOR_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Каталог в tmpfs (Linux); общий для всех процессов бота на машине
+RAM_DIR = "/dev/shm/max-bot"
+
+_stop_flag = False
+_janitor_thread = None
+_scratch_dir = None
+_lock = threading.Lock()
+
+_stats = {
+    "created": 0,
+    "swept": 0,
+}
+
+
+def get_scratch_dir():
+    """Каталог временных файлов (создаётся при первом обращении)"""
+    global _scratch_dir
+
+    with _lock:
+        if _scratch_dir is None:
+            path = DOWNLOADS_DIR
+            if SCRATCH_USE_RAM:
+                if os.path.isdir(os.path.dirname(RAM_DIR)):
+                    path = RAM_DIR
+                else:
+                    logger.warning(f"{os.path.dirname(RAM_DIR)} недоступен, временные файлы будут в {DOWNLOADS_DIR}")
+            os.makedirs(path, exist_ok=True)
+            _scratch_dir = path
+        return _scratch_dir
+
+
+def new_scratch_path(prefix, suffix=""):
+    """
+    Создаёт пустой файл с уникальным именем
+
+    Удалять файл должен вызывающий код (remove_scratch), забытые файлы
+    удаляет уборщик по возрасту.
+
+    Returns:
+        str: путь к файлу
+    """
+    fd, path = tempfile.mkstemp(prefix=f"{prefix}_", suffix=suffix, dir=get_scratch_dir())
+    os.close(fd)
+    with _lock:
+        _stats["created"] += 1
+    return path
+
+
+def remove_scratch(path):
+    """Удаляет временный файл; отсутствие файла — не ошибка"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить временный файл {path}: {e}")
+
+
+def sweep_scratch(max_age=SCRATCH_MAX_AGE):
+    """
+    Удаляет файлы старше max_age секунд
+
+    Returns:
+        int: сколько файлов удалено
+    """
+    directory = get_scratch_dir()
+    cutoff = time.time() - max_age
+    swept = 0
+
+    try:
+        entries = list(os.scandir(directory))
+    except OSError as e:
+        logger.error(f"Ошибка чтения {directory}: {e}")
+        return 0
+
+    for entry in entries:
+        try:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                swept += 1
+        except OSError:
+            # Файл удалили параллельно или он занят — попробуем в следующий раз
+            continue
+
+    if swept:
+        with _lock:
+            _stats["swept"] += swept
+        logger.info(f"Удалено забытых временных файлов: {swept}")
+    return swept
+
+
+def start_scratch_janitor():
+    """Запускает фоновый поток уборки временных файлов"""
+    global _janitor_thread, _stop_flag
+
+    if _janitor_thread and _janitor_thread.is_alive():
+        logger.warning("Уборщик временных файлов уже запущен")
+        return
+
+    directory = get_scratch_dir()
+    _stop_flag = False
+    _janitor_thread = threading.Thread(target=_janitor_loop, daemon=True)
+    _janitor_thread.start()
+    logger.info(f"Уборщик временных файлов запущен ({directory}, старше {SCRATCH_MAX_AGE} сек)")
+
+
+def stop_scratch_janitor():
+    """Останавливает фоновый поток"""
+    global _stop_flag
+    _stop_flag = True
+    logger.info("Уборщик временных файлов остановлен")
+
+
+def _janitor_loop():
+    # Первая уборка сразу: после аварийного завершения остаются файлы
+    while not _stop_flag:
+        try:
+            sweep_scratch()
+        except Exception as e:
+            logger.error(f"Ошибка уборки временных файлов: {e}", exc_info=True)
+
+        for _ in range(SCRATCH_JANITOR_INTERVAL):
+            if _stop_flag:
+                break
+            time.sleep(1)
+
+
+def get_scratch_stats():
+    """Возвращает счётчики временных файлов"""
+    with _lock:
+        stats = dict(_stats)
+    stats["dir"] = _scratch_dir
+    return stats
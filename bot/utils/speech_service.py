@@ -0,0 +1,404 @@
+"""
+Сервис распознавания речи на пуле процессов
+
+- Каждый рабочий процесс один раз при старте загружает модель Vosk,
+  поэтому первое голосовое сообщение не ждёт загрузки модели
+- Декодирование Kaldi выполняется в отдельных процессах и масштабируется по ядрам
+- Ограниченная очередь: при переполнении или если пул не запущен новые
+  задания отклоняются сразу; распознавание никогда не выполняется в потоке
+  обработки обновлений
+- Таймаут на каждое задание (ожидание в очереди + распознавание)
+- submit_transcription возвращает Future, результат доставляется колбэком
+  в отдельном потоке и не блокирует цикл получения обновлений
+- Промежуточный текст длинных сообщений передаётся из рабочих процессов
+  через очередь и доставляется колбэку on_progress
+- Если включён кэш по содержимому, голосовое сначала скачивается во
+  временный файл (в памяти — один кусок) и ищется по SHA-256; повторно
+  пересланные сообщения не распознаются заново, при промахе рабочий процесс
+  читает тот же файл
+"""
+import itertools
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from bot.config import (
+    VOICE_ENABLED,
+    VOICE_WORKERS,
+    VOICE_QUEUE_SIZE,
+    VOICE_JOB_TIMEOUT,
+    CONTENT_CACHE_ENABLED,
+)
+from bot.utils import voice
+from bot.utils.vad import AudioTooLong
+from bot.utils.media_fetch import KIND_AUDIO, MediaTooLarge, save_media
+from bot.utils.scratch import new_scratch_path, remove_scratch
+from bot.utils.voice_commands import load_command_table
+from bot.utils.content_cache import (
+    KIND_TRANSCRIPT,
+    KIND_VOICE_COMMAND,
+    file_digest,
+    cache_get,
+    cache_put,
+)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+_mp_context = multiprocessing.get_context("spawn")
+
+# Промежуточные результаты из рабочих процессов: (job_id, text)
+_progress_queue = None
+_progress_thread = None
+# {job_id: fn(text)}
+_progress_callbacks = {}
+_job_ids = itertools.count(1)
+
+# Слоты очереди: задание занимает слот от постановки до завершения
+_slots = threading.BoundedSemaphore(VOICE_QUEUE_SIZE)
+
+# Колбэки с результатами выполняются здесь, а не в потоке пула процессов
+_callback_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="speech-result")
+# Скачивание голосовых и работа с кэшем (не занимают процессы распознавания)
+_fetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speech-fetch")
+
+
+class SpeechQueueFull(Exception):
+    """Очередь распознавания переполнена"""
+
+_stats = {
+    "submitted": 0,
+    "rejected": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "total_time": 0.0,
+}
+
+
+def _create_executor():
+    # spawn: к моменту запуска пула в боте уже работают потоки, fork небезопасен
+    return ProcessPoolExecutor(
+        max_workers=VOICE_WORKERS,
+        mp_context=_mp_context,
+        initializer=voice.init_worker,
+        initargs=(_progress_queue,),
+    )
+
+
+def _progress_loop():
+    """Доставляет промежуточный текст из рабочих процессов колбэкам"""
+    while True:
+        item = _progress_queue.get()
+        if item is None:
+            break
+
+        job_id, text = item
+        with _lock:
+            callback = _progress_callbacks.get(job_id)
+        if callback is None:
+            continue
+
+        try:
+            callback(text)
+        except Exception as e:
+            logger.error(f"Ошибка обработки промежуточного результата: {e}")
+
+
+def start_speech_service():
+    """Запускает пул процессов и сразу загружает модель в каждом из них"""
+    global _executor, _progress_queue, _progress_thread
+
+    if not VOICE_ENABLED:
+        return False
+
+    # Таблица команд читается до запуска процессов: ошибка в JSON видна сразу
+    load_command_table()
+
+    with _lock:
+        if _executor is not None:
+            logger.warning("Сервис распознавания речи уже запущен")
+            return True
+        _progress_queue = _mp_context.Queue()
+        _progress_thread = threading.Thread(target=_progress_loop, daemon=True)
+        _progress_thread.start()
+        _executor = _create_executor()
+        # Пустые задания заставляют пул запустить все процессы (модель грузится в фоне)
+        for _ in range(VOICE_WORKERS):
+            _executor.submit(voice.worker_ping)
+
+    logger.info(f"🎤 Сервис распознавания речи запущен ({VOICE_WORKERS} процессов, очередь {VOICE_QUEUE_SIZE})")
+    return True
+
+
+def stop_speech_service():
+    """Останавливает пул процессов, отменяя задания из очереди"""
+    global _executor
+
+    with _lock:
+        executor, _executor = _executor, None
+
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        _progress_queue.put(None)
+        logger.info("Сервис распознавания речи остановлен")
+
+
+def _submit_to_pool(fn, *args):
+    """Отправляет задание в пул, пересоздавая пул после падения процесса"""
+    global _executor
+
+    with _lock:
+        executor = _executor
+    if executor is None:
+        return None
+
+    try:
+        return executor.submit(fn, *args)
+    except BrokenProcessPool:
+        logger.error("Пул распознавания речи сломан (процесс завершился аварийно), пересоздаём")
+        with _lock:
+            if _executor is executor:
+                _executor = _create_executor()
+            executor = _executor
+        return executor.submit(fn, *args)
+
+
+def _submit(fn, source, timeout, on_progress=None):
+    """Занимает слот очереди и отправляет задание fn(source, deadline[, job_id])"""
+    if not _slots.acquire(blocking=False):
+        with _lock:
+            _stats["rejected"] += 1
+        logger.warning("Очередь распознавания речи переполнена, задание отклонено")
+        return None
+
+    deadline = time.time() + timeout
+    submitted = time.monotonic()
+    job_id = None
+
+    try:
+        if on_progress is not None:
+            job_id = next(_job_ids)
+            with _lock:
+                _progress_callbacks[job_id] = on_progress
+        future = _submit_to_pool(fn, source, deadline, job_id)
+    except Exception:
+        _slots.release()
+        with _lock:
+            _progress_callbacks.pop(job_id, None)
+        raise
+
+    if future is None:
+        # Пул не запущен: отклоняем, как при переполнении очереди
+        _slots.release()
+        with _lock:
+            _progress_callbacks.pop(job_id, None)
+            _stats["rejected"] += 1
+        logger.warning("Сервис распознавания речи не запущен, задание отклонено")
+        return None
+
+    with _lock:
+        _stats["submitted"] += 1
+
+    future.add_done_callback(lambda f: _on_job_done(f, submitted, job_id))
+    return future
+
+
+def submit_transcription(audio_path, timeout=VOICE_JOB_TIMEOUT, on_progress=None):
+    """
+    Ставит локальный файл в очередь на распознавание
+
+    Args:
+        audio_path: путь к аудио файлу
+        timeout: таймаут задания в секундах
+        on_progress: функция fn(text) для промежуточного текста (вызывается
+                     в фоновом потоке, пока задание выполняется)
+
+    Returns:
+        Future: результат — текст или None; исключение TranscriptionTimeout
+                при превышении таймаута. None, если очередь переполнена
+                или сервис не запущен.
+    """
+    return _submit(voice.transcribe_file, audio_path, timeout, on_progress)
+
+
+def submit_url_transcription(url, timeout=VOICE_JOB_TIMEOUT, on_progress=None):
+    """
+    Ставит голосовое сообщение в очередь на распознавание
+
+    Без кэша рабочий процесс сам скачивает аудио и декодирует его по мере
+    скачивания (см. voice.transcribe_url). С кэшем аудио скачивается во
+    временный файл в фоновом потоке, и распознавание запускается только при промахе;
+    переполнение очереди тогда приходит в Future как SpeechQueueFull.
+
+    Returns:
+        Future или None, если очередь переполнена или сервис не запущен
+        (как submit_transcription)
+    """
+    return _submit_url(url, timeout, on_progress, _TRANSCRIPT_JOB)
+
+
+def submit_url_command(url, timeout=VOICE_JOB_TIMEOUT):
+    """
+    Ставит голосовое сообщение в очередь на распознавание команды
+
+    Используется распознаватель с грамматикой фраз команд
+    (voice.recognize_command_pcm).
+
+    Returns:
+        Future с dict {"text", "confidence", "mode"} или None, если очередь переполнена
+    """
+    return _submit_url(url, timeout, None, _COMMAND_JOB)
+
+
+# Функции заданий и кэш для обычного распознавания и режима команд
+_TRANSCRIPT_JOB = {
+    "url": voice.transcribe_url,
+    "file": voice.transcribe_file,
+    "kind": KIND_TRANSCRIPT,
+    "encode": lambda text: text,
+    "decode": lambda value: value,
+}
+_COMMAND_JOB = {
+    "url": voice.recognize_command_url,
+    "file": voice.recognize_command_file,
+    "kind": KIND_VOICE_COMMAND,
+    "encode": lambda result: json.dumps(result, ensure_ascii=False) if result and result.get("text") else None,
+    "decode": json.loads,
+}
+
+
+def _submit_url(url, timeout, on_progress, job):
+    if not CONTENT_CACHE_ENABLED:
+        return _submit(job["url"], url, timeout, on_progress)
+
+    result = Future()
+    deadline = time.time() + timeout
+    _fetch_executor.submit(_transcribe_cached, url, deadline, on_progress, job, result)
+    return result
+
+
+def _transcribe_cached(url, deadline, on_progress, job, result):
+    """Скачивает голосовое, ищет результат в кэше, при промахе — распознаёт"""
+    path = new_scratch_path("voice")
+    try:
+        save_media(url, path, KIND_AUDIO)
+        with open(path, "rb") as f:
+            digest = file_digest(f)
+        cached = cache_get(job["kind"], digest)
+    except Exception as e:
+        remove_scratch(path)
+        result.set_exception(e)
+        return
+
+    if cached:
+        remove_scratch(path)
+        logger.info(f"Результат распознавания голосового найден в кэше ({digest[:12]})")
+        result.set_result(job["decode"](cached))
+        return
+
+    pending = _submit(job["file"], path, max(0.0, deadline - time.time()), on_progress)
+    if pending is None:
+        remove_scratch(path)
+        result.set_exception(SpeechQueueFull())
+        return
+
+    def done(finished):
+        remove_scratch(path)
+        if finished.cancelled():
+            result.cancel()
+        elif finished.exception() is not None:
+            result.set_exception(finished.exception())
+        else:
+            value = job["encode"](finished.result())
+            if value:
+                _fetch_executor.submit(cache_put, job["kind"], digest, value)
+            result.set_result(finished.result())
+
+    pending.add_done_callback(done)
+
+
+def _on_job_done(future, submitted, job_id):
+    """Освобождает слот очереди и обновляет статистику"""
+    _slots.release()
+
+    with _lock:
+        _progress_callbacks.pop(job_id, None)
+        _stats["total_time"] += time.monotonic() - submitted
+        if future.cancelled():
+            _stats["failed"] += 1
+        elif isinstance(future.exception(), voice.TranscriptionTimeout):
+            _stats["timeouts"] += 1
+        elif future.exception() is not None:
+            _stats["failed"] += 1
+        else:
+            _stats["completed"] += 1
+
+
+def add_transcription_callback(future, callback):
+    """
+    Подписывает колбэк на результат задания
+
+    Args:
+        future: Future из submit_transcription
+        callback: функция fn(text, error); error — None, 'timeout', 'busy',
+                  'too_long' или 'error'.
+                  Для submit_url_command вместо текста передаётся dict.
+    """
+    def run(done):
+        text, error = None, None
+        try:
+            text = done.result()
+        except voice.TranscriptionTimeout:
+            error = 'timeout'
+        except SpeechQueueFull:
+            error = 'busy'
+        except (AudioTooLong, MediaTooLarge):
+            error = 'too_long'
+        except Exception as e:
+            logger.error(f"Ошибка задания распознавания речи: {e}")
+            error = 'error'
+
+        try:
+            callback(text, error)
+        except Exception as e:
+            logger.error(f"Ошибка обработки результата распознавания: {e}", exc_info=True)
+
+    future.add_done_callback(lambda done: _callback_executor.submit(run, done))
+
+
+def transcribe(audio_path, timeout=VOICE_JOB_TIMEOUT):
+    """
+    Синхронное распознавание через пул (блокирует вызывающий поток)
+
+    Returns:
+        str: распознанный текст или None (ошибка, таймаут, очередь
+             переполнена или сервис не запущен)
+    """
+    future = submit_transcription(audio_path, timeout)
+    if future is None:
+        return None
+
+    try:
+        return future.result()
+    except voice.TranscriptionTimeout:
+        logger.warning(f"Распознавание {audio_path} не уложилось в {timeout:.0f} сек")
+        return None
+    except Exception as e:
+        logger.error(f"Ошибка распознавания речи: {e}")
+        return None
+
+
+def get_speech_stats():
+    """Возвращает счётчики сервиса распознавания"""
+    with _lock:
+        stats = dict(_stats)
+        stats["running"] = _executor is not None
+    finished = stats["completed"] + stats["failed"] + stats["timeouts"]
+    stats["avg_time"] = stats.pop("total_time") / finished if finished else 0.0
+    return stats
@@ -0,0 +1,221 @@
+"""
+Хранилище состояний диалогов с TTL
+
+Заменяет словари в обработчиках ("ждём документы", "ждём фото",
+"пишет жалобу" и т.п.):
+- У каждой записи срок жизни: брошенные диалоги не копятся бесконечно
+- Потокобезопасно
+- Бэкенд memory — словарь в памяти процесса с ограничением размера
+- Бэкенд postgres — UNLOGGED таблица conversation_state: состояние
+  переживает перезапуск бота (кроме аварийного падения PostgreSQL) и
+  доступно нескольким процессам
+- Значения — всё, что сериализуется в JSON (строки, словари, числа)
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+from bot.config import (
+    STATE_BACKEND,
+    STATE_DEFAULT_TTL,
+    STATE_MAX_ENTRIES,
+    STATE_SWEEP_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStateBackend:
+    """
+    Состояния в памяти процесса
+
+    Записи хранятся в порядке последнего изменения; при превышении
+    STATE_MAX_ENTRIES вытесняются самые старые.
+    """
+
+    def __init__(self, max_entries=STATE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # {(namespace, key): (value, expires_at)}
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self._last_sweep = 0.0
+
+    def get(self, namespace, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._data[(namespace, key)]
+                return None
+            return entry[0]
+
+    def set(self, namespace, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._data[(namespace, key)] = (value, now + ttl)
+            self._data.move_to_end((namespace, key))
+            if now - self._last_sweep >= STATE_SWEEP_INTERVAL:
+                self._sweep(now)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            entry = self._data.pop((namespace, key), None)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def _sweep(self, now):
+        """Удаляет истёкшие записи (вызывается под _lock)"""
+        self._last_sweep = now
+        expired = [key for key, (_, expires_at) in self._data.items() if expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        if expired:
+            logger.debug(f"Состояния: удалено истёкших записей {len(expired)}")
+
+    def count(self):
+        with self._lock:
+            return len(self._data)
+
+
+class PostgresStateBackend:
+    """
+    Состояния в UNLOGGED таблице conversation_state
+
+    UNLOGGED не пишет WAL: запись быстрее, а при аварийном падении
+    PostgreSQL таблица очищается — для временных состояний диалога это
+    допустимо. Истёкшие записи не возвращаются и удаляются раз в
+    STATE_SWEEP_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._last_sweep = 0.0
+
+    def _execute(self, query, params=(), fetch=False):
+        from database import get_connection, release_connection
+
+        conn = None
+        try:
+            conn = get_connection()
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                result = cur.fetchone() if fetch else cur.rowcount
+            conn.commit()
+            return result
+        except Exception:
+            if conn:
+                conn.rollback()
+            raise
+        finally:
+            if conn:
+                release_connection(conn)
+
+    def get(self, namespace, key):
+        row = self._execute("""
+            SELECT value FROM conversation_state
+            WHERE namespace = %s AND key = %s AND expires_at > NOW()
+        """, (namespace, key), fetch=True)
+        return row[0] if row else None
+
+    def set(self, namespace, key, value, ttl):
+        self._execute("""
+            INSERT INTO conversation_state (namespace, key, value, expires_at)
+            VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+            ON CONFLICT (namespace, key) DO UPDATE
+            SET value = EXCLUDED.value,
+                expires_at = EXCLUDED.expires_at
+        """, (namespace, key, json.dumps(value, ensure_ascii=False), ttl))
+        self._maybe_sweep()
+
+    def delete(self, namespace, key):
+        row = self._execute("""
+            DELETE FROM conversation_state
+            WHERE namespace = %s AND key = %s
+            RETURNING value, expires_at > NOW()
+        """, (namespace, key), fetch=True)
+        return row[0] if row and row[1] else None
+
+    def _maybe_sweep(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < STATE_SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+
+        swept = self._execute("DELETE FROM conversation_state WHERE expires_at <= NOW()")
+        if swept:
+            logger.info(f"Состояния: удалено истёкших записей {swept}")
+
+    def count(self):
+        row = self._execute("SELECT COUNT(*) FROM conversation_state WHERE expires_at > NOW()", fetch=True)
+        return row[0]
+
+
+_backend = None
+_backend_lock = Lock()
+
+
+def get_state_backend():
+    """Бэкенд, выбранный в STATE_BACKEND (создаётся при первом обращении)"""
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            if STATE_BACKEND == "postgres":
+                _backend = PostgresStateBackend()
+            elif STATE_BACKEND == "memory":
+                _backend = MemoryStateBackend()
+            else:
+                raise ValueError(f"Неизвестный STATE_BACKEND: {STATE_BACKEND} (memory | postgres)")
+            logger.info(f"Хранилище состояний диалогов: {STATE_BACKEND}")
+        return _backend
+
+
+class StateStore:
+    """
+    Состояния одного вида (namespace) по ключу, обычно chat_id
+
+    Ключи приводятся к строке: 123 и "123" — один и тот же пользователь.
+
+    Args:
+        namespace: имя вида состояний (до 32 символов)
+        ttl: срок жизни записи по умолчанию, секунды
+    """
+
+    def __init__(self, namespace, ttl=STATE_DEFAULT_TTL):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        """Значение или default, если записи нет или она истекла"""
+        try:
+            value = get_state_backend().get(self.namespace, str(key))
+        except Exception as e:
+            logger.error(f"Ошибка чтения состояния {self.namespace}: {e}")
+            return default
+        return default if value is None else value
+
+    def set(self, key, value, ttl=None):
+        """Сохраняет значение на ttl секунд (по умолчанию — ttl хранилища)"""
+        try:
+            get_state_backend().set(self.namespace, str(key), value, ttl or self.ttl)
+        except Exception as e:
+            logger.error(f"Ошибка записи состояния {self.namespace}: {e}")
+
+    def pop(self, key, default=None):
+        """Удаляет запись и возвращает её значение"""
+        try:
+            value = get_state_backend().delete(self.namespace, str(key))
+        except Exception as e:
+            logger.error(f"Ошибка удаления состояния {self.namespace}: {e}")
+            return default
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
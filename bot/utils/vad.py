@@ -0,0 +1,193 @@
+"""
+Предобработка PCM перед распознаванием
+
+- Ограничение длительности: слишком длинные записи обрезаются или отклоняются
+- Энергетический VAD: тишина в начале и в конце не передаётся в Kaldi
+- Полностью тихие записи не доходят до распознавателя вовсе
+- Статистика: сколько аудио отброшено и сколько процессорного времени
+  это сэкономило
+"""
+import logging
+import math
+import operator
+from array import array
+from bot.config import (
+    VOICE_MAX_DURATION,
+    VOICE_OVERLONG_POLICY,
+    VOICE_VAD_ENABLED,
+    VOICE_VAD_THRESHOLD,
+)
+
+logger = logging.getLogger(__name__)
+
+# PCM 16 кГц, 16 бит, mono
+BYTES_PER_SECOND = 16000 * 2
+# Сколько тихих кусков оставлять перед речью и после неё, чтобы не срезать слова
+PADDING_CHUNKS = 1
+
+# Оценка затрат CPU на секунду аудио до первого измерения в процессе
+DEFAULT_CPU_PER_AUDIO_SECOND = 0.1
+_cpu_per_audio_second = DEFAULT_CPU_PER_AUDIO_SECOND
+
+
+def _sum_of_squares(samples):
+    # math.sumprod появилась в Python 3.12
+    return sum(map(operator.mul, samples, samples))
+
+
+if hasattr(math, "sumprod"):
+    def _sum_of_squares(samples):  # noqa: F811
+        return math.sumprod(samples, samples)
+
+
+class AudioTooLong(Exception):
+    """Запись длиннее VOICE_MAX_DURATION при политике reject"""
+
+
+def _rms(chunk):
+    samples = array("h")
+    samples.frombytes(chunk[:len(chunk) - len(chunk) % 2])
+    if not samples:
+        return 0.0
+    return math.sqrt(_sum_of_squares(samples) / len(samples))
+
+
+def new_stats():
+    """Счётчики одной записи (заполняются prepare_pcm)"""
+    return {
+        "input_seconds": 0.0,
+        "speech_seconds": 0.0,
+        "truncated": False,
+        "silent": True,
+    }
+
+
+def _limit_duration(pcm_chunks, stats):
+    """Обрезает запись по VOICE_MAX_DURATION или отклоняет её"""
+    max_bytes = VOICE_MAX_DURATION * BYTES_PER_SECOND
+
+    if VOICE_OVERLONG_POLICY == "reject":
+        # Декодирование дешёвое: читаем до лимита и только потом отдаём
+        # распознавателю, чтобы не тратить на длинную запись время Kaldi
+        buffered = []
+        total = 0
+        for chunk in pcm_chunks:
+            total += len(chunk)
+            if total > max_bytes:
+                raise AudioTooLong(f"Запись длиннее {VOICE_MAX_DURATION} сек")
+            buffered.append(chunk)
+        stats["input_seconds"] = total / BYTES_PER_SECOND
+        yield from buffered
+        return
+
+    total = 0
+    for chunk in pcm_chunks:
+        if total + len(chunk) > max_bytes:
+            stats["truncated"] = True
+            chunk = chunk[:max_bytes - total]
+            if chunk:
+                total += len(chunk)
+                stats["input_seconds"] = total / BYTES_PER_SECOND
+                yield chunk
+            break
+        total += len(chunk)
+        stats["input_seconds"] = total / BYTES_PER_SECOND
+        yield chunk
+
+
+def _trim_silence(pcm_chunks, stats):
+    """Отбрасывает тишину в начале и в конце записи"""
+    leading = []
+    trailing = []
+    speech_started = False
+
+    for chunk in pcm_chunks:
+        is_speech = _rms(chunk) >= VOICE_VAD_THRESHOLD
+
+        if not speech_started:
+            if not is_speech:
+                leading.append(chunk)
+                del leading[:-PADDING_CHUNKS]
+                continue
+            speech_started = True
+            stats["silent"] = False
+            for padding in leading:
+                stats["speech_seconds"] += len(padding) / BYTES_PER_SECOND
+                yield padding
+
+        if is_speech:
+            # Пауза внутри речи — отдаём её целиком
+            for pause in trailing:
+                stats["speech_seconds"] += len(pause) / BYTES_PER_SECOND
+                yield pause
+            trailing = []
+            stats["speech_seconds"] += len(chunk) / BYTES_PER_SECOND
+            yield chunk
+        else:
+            trailing.append(chunk)
+
+    for padding in trailing[:PADDING_CHUNKS]:
+        stats["speech_seconds"] += len(padding) / BYTES_PER_SECOND
+        yield padding
+
+
+def _count_speech(pcm_chunks, stats):
+    stats["silent"] = False
+    for chunk in pcm_chunks:
+        stats["speech_seconds"] += len(chunk) / BYTES_PER_SECOND
+        yield chunk
+
+
+def prepare_pcm(pcm_chunks, stats):
+    """
+    Ограничивает длительность и обрезает тишину
+
+    Args:
+        pcm_chunks: итератор кусков PCM 16 кГц mono
+        stats: dict из new_stats(), заполняется по мере чтения
+
+    Yields:
+        bytes: куски PCM для распознавателя
+
+    Raises:
+        AudioTooLong: запись длиннее лимита при VOICE_OVERLONG_POLICY=reject
+    """
+    limited = _limit_duration(pcm_chunks, stats)
+    if VOICE_VAD_ENABLED:
+        return _trim_silence(limited, stats)
+    return _count_speech(limited, stats)
+
+
+def report(stats, cpu_seconds):
+    """
+    Пишет в лог, сколько аудио отброшено и сколько CPU это сэкономило
+
+    Экономия оценивается по затратам CPU на секунду аудио, измеренным
+    на уже распознанных записях этого процесса.
+
+    Args:
+        stats: заполненный prepare_pcm dict
+        cpu_seconds: процессорное время, потраченное на распознавание
+
+    Returns:
+        float: оценка сэкономленного процессорного времени, секунды
+    """
+    global _cpu_per_audio_second
+
+    if stats["speech_seconds"] > 1:
+        _cpu_per_audio_second = cpu_seconds / stats["speech_seconds"]
+
+    skipped = max(0.0, stats["input_seconds"] - stats["speech_seconds"])
+    saved = skipped * _cpu_per_audio_second
+
+    if stats["silent"]:
+        logger.info(f"VAD: запись {stats['input_seconds']:.1f} сек без речи, распознавание пропущено")
+    elif skipped or stats["truncated"]:
+        logger.info(
+            f"VAD: вход {stats['input_seconds']:.1f} сек, в распознавание {stats['speech_seconds']:.1f} сек"
+            f"{' (обрезано по лимиту)' if stats['truncated'] else ''}, "
+            f"сэкономлено ~{saved:.2f} сек CPU"
+        )
+    stats["cpu_seconds"] = cpu_seconds
+    stats["cpu_saved_seconds"] = saved
+    return saved
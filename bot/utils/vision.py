@@ -1,191 +1,514 @@
 import os
+import hashlib
+import heapq
 import logging
-from gigachat import GigaChat
-import requests
-from PIL import Image
-import io
-from bot.config import VISION_MODEL_ENABLED, GIGACHAT_API_KEY
+import queue
+import threading
+import time
+from PIL import Image, ImageOps
+from bot.config import (
+    VISION_MODEL_ENABLED,
+    GIGACHAT_API_KEY,
+    VISION_MAX_CONNECTIONS,
+    VISION_TIMEOUT,
+    VISION_MODELS_TTL,
+    VISION_DELETE_MAX_ATTEMPTS,
+    VISION_MAX_EDGE,
+    VISION_JPEG_QUALITY,
+    VISION_MAX_UPLOAD_BYTES,
+    VISION_BACKEND,
+    VISION_STUB_LATENCY,
+    VISION_STUB_JITTER,
+    VISION_STUB_FAILURE_RATE,
+)
+from bot.utils.media_fetch import (
+    KIND_IMAGE,
+    MediaFetchError,
+    fetch_media,
+)
 from io import BytesIO
 
 logger = logging.getLogger(__name__)
 
+# GigaChat нужен только бэкенду "gigachat"; заглушка работает без него
+try:
+    from gigachat import GigaChat
+except ImportError:
+    GigaChat = None
+
 VISION_MODEL = "GigaChat-Pro"
+# Клиент создаётся один раз: токен кэшируется внутри клиента и обновляется
+# по истечении, HTTP-соединения переиспользуются
 vision_client = None
+_client_lock = threading.Lock()
 
+# Список моделей: (ID моделей, время истечения)
+_models = None
+_models_expires_at = 0.0
 
-# ---------- ИНИЦИАЛИЗАЦИЯ GIGACHAT ----------
-
+# Файлы, которые нужно удалить с сервера GigaChat: (file_id, попытка)
+_delete_queue = queue.Queue()
+_cleanup_thread = None
+# Через сколько секунд повторить удаление, если клиент GigaChat ещё не создан
+CLIENT_WAIT_SECONDS = 5
 
-def convert_to_jpeg(image_path):
-    """Конвертирует изображение в RGB JPEG и возвращает BytesIO с именем файла."""
-    try:
-        with Image.open(image_path) as img:
-            logger.info(f"Формат изображения: {img.format}, Режим: {img.mode}")
+# Шаг снижения качества JPEG и нижняя граница, если файл не укладывается в лимит
+JPEG_QUALITY_STEP = 10
+JPEG_MIN_QUALITY = 55
+# Тег EXIF с ориентацией снимка (1 — без поворота)
+EXIF_ORIENTATION = 0x0112
 
-            buffer = BytesIO()
-            img.convert("RGB").save(buffer, format="JPEG", quality=95)
-            buffer.name = "image.jpg"  # <- ВАЖНО! указываем имя файла
-            buffer.seek(0)
-            return buffer
 
-    except Exception as e:
-        logger.error(f"Ошибка конвертации изображения: {e}")
-        raise
+# ---------- ИНИЦИАЛИЗАЦИЯ GIGACHAT ----------
 
 
 def init_vision_model():
-    """Инициализирует GigaChat клиент."""
+    """
+    Инициализирует GigaChat клиент
+
+    Авторизация выполняется сразу, чтобы первое описание не ждало токен.
+    """
     global vision_client
 
     if not VISION_MODEL_ENABLED:
         logger.info("Vision отключён")
         return False
 
+    if VISION_BACKEND != "gigachat":
+        logger.info(f"Vision бэкенд: {get_vision_backend().name}")
+        return True
+
+    if GigaChat is None:
+        logger.error("Установите: pip install gigachat")
+        return False
+
     if not GIGACHAT_API_KEY:
         logger.error("GIGACHAT_API_KEY отсутствует")
         return False
 
-    try:
-        vision_client = GigaChat(
-            credentials=GIGACHAT_API_KEY,
-            verify_ssl_certs=False,
-            model=VISION_MODEL,
-            scope="GIGACHAT_API_PERS",
-        )
-        logger.info("GigaChat Vision клиент инициализирован")
-        return True
+    with _client_lock:
+        if vision_client is not None:
+            return True
+
+        try:
+            client = GigaChat(
+                credentials=GIGACHAT_API_KEY,
+                verify_ssl_certs=False,
+                model=VISION_MODEL,
+                scope="GIGACHAT_API_PERS",
+                timeout=VISION_TIMEOUT,
+                max_connections=VISION_MAX_CONNECTIONS,
+            )
+            client.get_token()
+            vision_client = client
+            logger.info("GigaChat Vision клиент инициализирован")
+
+        except Exception as e:
+            logger.error(f"Ошибка инициализации: {e}")
+            return False
 
-    except Exception as e:
-        logger.error(f"Ошибка инициализации: {e}")
-        return False
+    models = get_vision_models()
+    if models is not None and VISION_MODEL not in models:
+        logger.warning(f"Модель {VISION_MODEL} недоступна, доступны: {', '.join(models)}")
+    return True
+
+
+def get_vision_client():
+    """Возвращает клиент GigaChat, создавая его при первом обращении (или None)"""
+    if vision_client is None and not init_vision_model():
+        return None
+    return vision_client
+
+
+def get_vision_models(force=False):
+    """
+    Список доступных моделей GigaChat (кэшируется на VISION_MODELS_TTL секунд)
 
+    Returns:
+        list: ID моделей или None, если список получить не удалось
+    """
+    global _models, _models_expires_at
 
-# ---------- ВСПОМОГАТЕЛЬНАЯ ФУНКЦИЯ ----------
+    now = time.time()
+    if not force and _models is not None and now < _models_expires_at:
+        return _models
 
+    client = get_vision_client()
+    if client is None:
+        return None
 
-def prepare_image_for_upload(image_path):
-    """Проверяет формат изображения и конвертирует в RGB JPEG, если нужно."""
     try:
-        with Image.open(image_path) as img:
-            logger.info(f"Формат изображения: {img.format}, Режим: {img.mode}")
-
-            # Если не JPEG или PNG или есть альфа-канал — конвертируем в RGB JPEG
-            if img.format not in ["JPEG", "PNG"] or img.mode != "RGB":
-                logger.info("Конвертация изображения в JPEG...")
-                buffer = io.BytesIO()
-                img.convert("RGB").save(buffer, format="JPEG", quality=95)
-                buffer.seek(0)
-                return buffer
-            else:
-                # Открываем обычным файлом
-                buffer = open(image_path, "rb")
-                return buffer
+        models = [model.id_ for model in client.get_models().data]
+    except Exception as e:
+        logger.error(f"Ошибка запроса моделей: {e}")
+        return _models
+
+    _models, _models_expires_at = models, now + VISION_MODELS_TTL
+    return models
+
+
+def close_vision_client():
+    """Удаляет оставшиеся файлы с сервера и закрывает соединения клиента"""
+    global vision_client
+
+    stop_vision_cleanup()
+
+    with _client_lock:
+        client, vision_client = vision_client, None
+    if client is not None:
+        client.close()
+        logger.info("GigaChat Vision клиент закрыт")
 
+
+# ---------- ФОНОВОЕ УДАЛЕНИЕ ФАЙЛОВ ----------
+
+
+def start_vision_cleanup():
+    """Запускает фоновый поток удаления загруженных файлов"""
+    global _cleanup_thread
+
+    with _client_lock:
+        if _cleanup_thread and _cleanup_thread.is_alive():
+            return
+        _cleanup_thread = threading.Thread(target=_cleanup_loop, daemon=True)
+        _cleanup_thread.start()
+    logger.info("Очистка файлов GigaChat запущена")
+
+
+def stop_vision_cleanup(timeout=10):
+    """Дожидается удаления файлов из очереди и останавливает поток"""
+    thread = _cleanup_thread
+    if thread and thread.is_alive():
+        _delete_queue.put(None)
+        thread.join(timeout)
+
+
+def schedule_file_delete(file_id, attempt=1):
+    """Ставит файл в очередь на удаление с сервера GigaChat"""
+    start_vision_cleanup()
+    _delete_queue.put((file_id, attempt))
+
+
+def _cleanup_loop():
+    # Отложенные удаления: куча (время запуска, file_id, попытка). Поток не
+    # спит между повторами, поэтому один сбойный файл не задерживает остальные
+    delayed = []
+
+    while True:
+        if delayed and delayed[0][0] <= time.monotonic():
+            _, file_id, attempt = heapq.heappop(delayed)
+        else:
+            timeout = max(0.0, delayed[0][0] - time.monotonic()) if delayed else None
+            try:
+                item = _delete_queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+
+            if item is None:
+                # Остановка: последняя попытка для отложенных удалений
+                for _, file_id, attempt in delayed:
+                    _delete_file(file_id, VISION_DELETE_MAX_ATTEMPTS)
+                break
+            file_id, attempt = item
+
+        retry = _delete_file(file_id, attempt)
+        if retry:
+            heapq.heappush(delayed, retry)
+
+
+def _delete_file(file_id, attempt):
+    """
+    Удаляет файл с сервера GigaChat
+
+    Returns:
+        tuple: (время запуска, file_id, попытка) для повтора или None
+    """
+    client = vision_client
+    if client is None:
+        if attempt >= VISION_DELETE_MAX_ATTEMPTS:
+            logger.warning(f"Файл {file_id} не удалён с сервера: клиент GigaChat не создан")
+            return None
+        # Клиент ещё не создан: файл не теряем, попытка не расходуется
+        return time.monotonic() + CLIENT_WAIT_SECONDS, file_id, attempt
+
+    try:
+        client.delete_file(file_id)
+        logger.info(f"Файл {file_id} удалён с сервера GigaChat")
+        return None
     except Exception as e:
-        logger.error(f"Ошибка подготовки изображения: {e}")
-        raise
+        if attempt >= VISION_DELETE_MAX_ATTEMPTS:
+            logger.warning(f"Не удалось удалить файл {file_id} с сервера: {e}")
+            return None
+        logger.info(f"Повторим удаление файла {file_id} ({attempt}/{VISION_DELETE_MAX_ATTEMPTS}): {e}")
+        return time.monotonic() + attempt, file_id, attempt + 1
+
+
+# ---------- ПОДГОТОВКА ИЗОБРАЖЕНИЯ В ПАМЯТИ ----------
+
+
+def _flatten_to_rgb(img):
+    """RGB без прозрачности: прозрачные области — белые, а не чёрные"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+
+def _encode_jpeg(img):
+    """Кодирует в JPEG, снижая качество, пока файл больше VISION_MAX_UPLOAD_BYTES"""
+    quality = VISION_JPEG_QUALITY
+    while True:
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= VISION_MAX_UPLOAD_BYTES or quality - JPEG_QUALITY_STEP < JPEG_MIN_QUALITY:
+            return buffer, quality
+        quality -= JPEG_QUALITY_STEP
+
+
+def prepare_image(source):
+    """
+    Готовит изображение к загрузке в GigaChat
+
+    - JPEG декодируется сразу в уменьшенном масштабе (draft), остальное
+      уменьшается через reduce + LANCZOS до VISION_MAX_EDGE по большей стороне
+    - Поворот по EXIF применяется к пикселям (модель не читает EXIF)
+    - Перекодирование в JPEG с качеством, подобранным под VISION_MAX_UPLOAD_BYTES
+    - Небольшой JPEG без поворота загружается как есть
+
+    Args:
+        source: двоичный файловый объект с изображением (буфер fetch_image
+                или открытый файл); исходник целиком в память не читается
+
+    Returns:
+        BytesIO: JPEG с атрибутом name (нужен для upload_file)
+    """
+    started = time.monotonic()
+    source_bytes = source.seek(0, os.SEEK_END)
+    source.seek(0)
+
+    with Image.open(source) as img:
+        source_format, source_size = img.format, img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+
+        if (
+            source_format == "JPEG"
+            and img.mode == "RGB"
+            and max(source_size) <= VISION_MAX_EDGE
+            and orientation == 1
+            and source_bytes <= VISION_MAX_UPLOAD_BYTES
+        ):
+            # Копия не больше VISION_MAX_UPLOAD_BYTES
+            source.seek(0)
+            buffer, quality = BytesIO(source.read()), None
+            result_size = source_size
+        else:
+            # thumbnail сам вызывает draft() для JPEG и reduce() перед ресэмплингом;
+            # рамка квадратная, поэтому уменьшать можно до поворота
+            img.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS, reducing_gap=2.0)
+            img = ImageOps.exif_transpose(img)
+            buffer, quality = _encode_jpeg(_flatten_to_rgb(img))
+            result_size = img.size
+
+    buffer.name = "image.jpg"  # upload_file определяет тип по имени файла
+    buffer.seek(0)
+
+    logger.info(
+        f"Изображение {source_format} {source_size[0]}x{source_size[1]} {source_bytes // 1024} КБ → "
+        f"{result_size[0]}x{result_size[1]} {buffer.getbuffer().nbytes // 1024} КБ"
+        f"{f' (q={quality})' if quality else ' (без перекодирования)'} за {time.monotonic() - started:.2f} сек"
+    )
+    return buffer
 
 
 # ---------- ОСНОВНАЯ ФУНКЦИЯ ----------
 
 
+class VisionError(Exception):
+    """Описание изображения не получено (текст ошибки — для пользователя)"""
+
+
 def describe_image(image_path: str) -> str:
     """
     Описывает изображение через GigaChat Vision.
     Автоматически конвертирует неподдерживаемый формат в JPEG.
+    При ошибке возвращает её текст вместо описания.
     """
-    global vision_client
+    try:
+        return generate_image_description(image_path)
+    except VisionError as e:
+        return str(e)
 
-    headers = {"Authorization": f"Bearer {GIGACHAT_API_KEY}"}
-    url = "https://gigachat.devices.sberbank.ru/api/v1/models"
 
-    response = requests.get(url, headers=headers, verify=False)
-    if response.status_code == 200:
-        models = response.json()
-        for m in models:
-            print(m)
-    else:
-        print("Ошибка запроса моделей:", response.status_code, response.text)
+def generate_image_description(image_path: str) -> str:
+    """
+    Как describe_image, но при ошибке выбрасывает VisionError,
+    чтобы вызывающий код мог отличить описание от ошибки (например, для кэша).
+    """
+    if not os.path.exists(image_path):
+        raise VisionError(f"Файл не найден: {image_path}")
 
-    if not VISION_MODEL_ENABLED:
-        return "Vision отключён"
+    with open(image_path, "rb") as f:
+        return describe_image_file(f)
 
-    if vision_client is None:
-        if not init_vision_model():
-            return "Ошибка инициализации GigaChat"
 
-    if not os.path.exists(image_path):
-        return f"Файл не найден: {image_path}"
+def describe_image_file(source) -> str:
+    """
+    Описывает изображение из двоичного файлового объекта
+
+    Raises:
+        VisionError: описание не получено
+    """
+    if not VISION_MODEL_ENABLED:
+        raise VisionError("Vision отключён")
+
+    backend = get_vision_backend()
 
-    file_id = None
-    image_file = None
     try:
-        # Подготовка изображения
-        logger.info("Подготовка изображения для загрузки...")
-        # image_file = prepare_image_for_upload(image_path)
-        jpeg_buffer = convert_to_jpeg(image_path)
-
-        # Загружаем файл в GigaChat
-        uploaded_file = vision_client.upload_file(jpeg_buffer)
-        file_id = uploaded_file.id_
-        logger.info(f"Файл загружен (ID={file_id})")
-
-        # Формируем сообщение
-        messages = [
-            {
-                "role": "user",
-                "content": "Опиши подробно, что изображено на фотографии. "
-                "Укажи объекты, людей, действия, фон, цвета, эмоции, детали. "
-                "Ответ дай на русском языке.",
-                "attachments": [file_id],
-            }
-        ]
-
-        # Отправляем запрос
-        logger.info("Отправка запроса к Vision...")
-        response = vision_client.chat({"messages": messages, "temperature": 0.1})
-        text = response.choices[0].message.content
-        return text
+        # Уменьшение и перекодирование в памяти
+        jpeg_buffer = prepare_image(source)
+        return backend.describe(jpeg_buffer)
 
+    except VisionError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка Vision: {e}")
-        return f"Ошибка обработки изображения: {e}"
+        raise VisionError(f"Ошибка обработки изображения: {e}")
 
-    finally:
-        # Закрываем файл, если он был открыт
-        if image_file and hasattr(image_file, "close"):
-            image_file.close()
 
-        # Удаляем файл с сервера
-        if file_id:
-            try:
-                vision_client.delete_file(file_id)
-                logger.info(f"Файл {file_id} удалён с сервера GigaChat")
-            except Exception as e:
-                logger.warning(f"Не удалось удалить файл с сервера: {e}")
+# ---------- БЭКЕНДЫ ----------
 
+DESCRIPTION_PROMPT = (
+    "Опиши подробно, что изображено на фотографии. "
+    "Укажи объекты, людей, действия, фон, цвета, эмоции, детали. "
+    "Ответ дай на русском языке."
+)
 
-# ---------- ФУНКЦИЯ СКАЧИВАНИЯ ----------
 
+class VisionBackend:
+    """
+    Модель, которая описывает изображение
 
-def download_image(url, save_path):
-    """Скачивает изображение по URL."""
-    try:
-        response = requests.get(url, timeout=30, verify=False)
-        if response.status_code != 200:
-            logger.error(f"Ошибка скачивания: {response.status_code}")
-            return False
+    Бэкенд выбирается через VISION_BACKEND (см. get_vision_backend).
+    """
 
-        if not response.headers.get("content-type", "").startswith("image/"):
-            logger.error("URL не ведет к изображению")
-            return False
+    name = None
 
-        with open(save_path, "wb") as f:
-            f.write(response.content)
+    def describe(self, jpeg_buffer):
+        """
+        Args:
+            jpeg_buffer: BytesIO с JPEG после prepare_image
 
-        logger.info(f"Изображение сохранено: {save_path}")
-        return True
+        Returns:
+            str: описание на русском языке
+
+        Raises:
+            VisionError: описание не получено (текст — для пользователя)
+        """
+        raise NotImplementedError
+
+
+class GigaChatVisionBackend(VisionBackend):
+    """GigaChat Vision: загрузка файла, запрос описания, удаление файла в фоне"""
+
+    name = "gigachat"
+
+    def describe(self, jpeg_buffer):
+        client = get_vision_client()
+        if client is None:
+            raise VisionError("Ошибка инициализации GigaChat")
 
+        file_id = None
+        try:
+            # Загружаем файл в GigaChat
+            uploaded_file = client.upload_file(jpeg_buffer)
+            file_id = uploaded_file.id_
+            logger.info(f"Файл загружен (ID={file_id})")
+
+            # Отправляем запрос
+            logger.info("Отправка запроса к Vision...")
+            messages = [{"role": "user", "content": DESCRIPTION_PROMPT, "attachments": [file_id]}]
+            response = client.chat({"messages": messages, "temperature": 0.1})
+            return response.choices[0].message.content
+
+        finally:
+            # Удаление с сервера не задерживает ответ пользователю
+            if file_id:
+                schedule_file_delete(file_id)
+
+
+class StubVisionBackend(VisionBackend):
+    """
+    Локальная заглушка для нагрузочного тестирования без облака
+
+    Результат детерминирован: описание, задержка и ошибка зависят только
+    от содержимого изображения, поэтому прогоны можно повторять и сравнивать.
+
+    Args:
+        latency: базовая задержка ответа, секунды
+        jitter: добавка к задержке от 0 до jitter секунд
+        failure_rate: доля изображений (0.0-1.0), на которых бэкенд падает
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=VISION_STUB_LATENCY, jitter=VISION_STUB_JITTER, failure_rate=VISION_STUB_FAILURE_RATE):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+    def describe(self, jpeg_buffer):
+        digest = hashlib.sha256(jpeg_buffer.getbuffer()).digest()
+        # Две независимые «случайные» величины из хэша: задержка и ошибка
+        delay_fraction = int.from_bytes(digest[:4], "big") / 2 ** 32
+        failure_fraction = int.from_bytes(digest[4:8], "big") / 2 ** 32
+
+        time.sleep(self.latency + self.jitter * delay_fraction)
+
+        if failure_fraction < self.failure_rate:
+            raise VisionError("Ошибка обработки изображения: тестовый сбой заглушки")
+
+        return f"Тестовое описание изображения {digest.hex()[:12]} ({jpeg_buffer.getbuffer().nbytes // 1024} КБ)."
+
+
+_BACKENDS = {
+    GigaChatVisionBackend.name: GigaChatVisionBackend,
+    StubVisionBackend.name: StubVisionBackend,
+}
+_backend = None
+
+
+def get_vision_backend():
+    """Бэкенд, выбранный в VISION_BACKEND (создаётся при первом обращении)"""
+    global _backend
+
+    with _client_lock:
+        if _backend is None:
+            backend_class = _BACKENDS.get(VISION_BACKEND)
+            if backend_class is None:
+                raise ValueError(f"Неизвестный VISION_BACKEND: {VISION_BACKEND} (доступны: {', '.join(_BACKENDS)})")
+            _backend = backend_class()
+        return _backend
+
+
+# ---------- ФУНКЦИЯ СКАЧИВАНИЯ ----------
+
+
+def fetch_image(url):
+    """
+    Скачивает изображение во временный буфер (размер ограничен MEDIA_MAX_IMAGE_BYTES)
+
+    В памяти держится не больше MEDIA_SPOOL_BYTES, остальное — во временном файле.
+
+    Returns:
+        SpooledTemporaryFile: буфер (закрыть после использования) или None при ошибке
+    """
+    try:
+        return fetch_media(url, KIND_IMAGE)
+    except MediaFetchError as e:
+        logger.error(f"Изображение отклонено: {e}")
     except Exception as e:
         logger.error(f"Ошибка скачивания: {e}")
-        return False
+    return None
+
@@ -0,0 +1,218 @@
+"""
+Очередь заданий распознавания изображений
+
+- Скачивание, загрузка в GigaChat и запрос описания выполняются в пуле
+  фоновых потоков, цикл получения обновлений не блокируется
+- Ограничение на число заданий одного пользователя (в очереди + в работе),
+  поэтому серия фото от одного человека не задерживает остальных
+- Позиция в очереди возвращается сразу, чтобы показать её пользователю
+- Таймаут задания: задание, не дождавшееся своей очереди вовремя,
+  не выполняется; функции задания передаётся deadline для проверок
+"""
+import logging
+import threading
+import time
+from collections import deque
+from bot.config import (
+    VISION_WORKERS,
+    VISION_QUEUE_SIZE,
+    VISION_USER_LIMIT,
+    VISION_JOB_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+_stop_flag = False
+_workers = []
+
+# Ожидающие задания: dict {"chat_id", "fn", "on_timeout", "deadline", "enqueued"}
+_queue = deque()
+_lock = threading.Lock()
+_ready = threading.Condition(_lock)
+# Сколько заданий каждого пользователя в очереди или в работе: {chat_id: count}
+_user_jobs = {}
+_busy = 0
+
+_stats = {
+    "submitted": 0,
+    "rejected": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "total_wait": 0.0,
+}
+
+
+class VisionQueueFull(Exception):
+    """Очередь распознавания изображений переполнена"""
+
+
+class VisionUserLimit(Exception):
+    """У пользователя уже VISION_USER_LIMIT заданий в работе"""
+
+
+class VisionJobTimeout(Exception):
+    """Задание не уложилось в VISION_JOB_TIMEOUT"""
+
+
+def check_deadline(deadline):
+    """Выбрасывает VisionJobTimeout, если deadline прошёл (для функций заданий)"""
+    if deadline is not None and time.time() > deadline:
+        raise VisionJobTimeout("Превышено время обработки изображения")
+
+
+def start_vision_service():
+    """Запускает потоки обработки изображений"""
+    global _stop_flag
+
+    with _lock:
+        if any(worker.is_alive() for worker in _workers):
+            logger.warning("Сервис распознавания изображений уже запущен")
+            return
+        _stop_flag = False
+        _workers.clear()
+        for i in range(VISION_WORKERS):
+            worker = threading.Thread(target=_worker_loop, name=f"vision-{i + 1}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+    logger.info(f"🖼 Сервис распознавания изображений запущен ({VISION_WORKERS} потоков, очередь {VISION_QUEUE_SIZE})")
+
+
+def stop_vision_service():
+    """Останавливает потоки; задания из очереди не выполняются"""
+    global _stop_flag
+
+    with _lock:
+        _stop_flag = True
+        dropped = len(_queue)
+        _queue.clear()
+        _user_jobs.clear()
+        _ready.notify_all()
+
+    if dropped:
+        logger.warning(f"Сервис распознавания изображений остановлен, отменено заданий: {dropped}")
+    else:
+        logger.info("Сервис распознавания изображений остановлен")
+
+
+def submit_vision_job(chat_id, fn, on_timeout=None):
+    """
+    Ставит задание в очередь
+
+    Args:
+        chat_id: ID чата пользователя (для ограничения на пользователя)
+        fn: функция fn(deadline), выполняется в фоновом потоке; может
+            выбрасывать VisionJobTimeout (см. check_deadline)
+        on_timeout: функция без аргументов, вызывается, если задание
+                    не уложилось в VISION_JOB_TIMEOUT
+
+    Returns:
+        int: сколько заданий впереди (0 — задание начнёт выполняться сразу)
+
+    Raises:
+        VisionUserLimit: у пользователя слишком много заданий
+        VisionQueueFull: очередь переполнена
+    """
+    now = time.time()
+    job = {
+        "chat_id": chat_id,
+        "fn": fn,
+        "on_timeout": on_timeout,
+        "deadline": now + VISION_JOB_TIMEOUT,
+        "enqueued": now,
+    }
+
+    with _lock:
+        running = any(worker.is_alive() for worker in _workers) and not _stop_flag
+        if running:
+            if _user_jobs.get(chat_id, 0) >= VISION_USER_LIMIT:
+                _stats["rejected"] += 1
+                raise VisionUserLimit()
+            if len(_queue) >= VISION_QUEUE_SIZE:
+                _stats["rejected"] += 1
+                logger.warning("Очередь распознавания изображений переполнена, задание отклонено")
+                raise VisionQueueFull()
+
+            _user_jobs[chat_id] = _user_jobs.get(chat_id, 0) + 1
+            _queue.append(job)
+            _stats["submitted"] += 1
+            ahead = max(0, len(_queue) - (VISION_WORKERS - _busy))
+            _ready.notify()
+            return ahead
+
+        _stats["submitted"] += 1
+
+    # Сервис не запущен — выполняем в текущем потоке
+    _run_job(job)
+    return 0
+
+
+def _worker_loop():
+    global _busy
+
+    while True:
+        with _lock:
+            while not _queue and not _stop_flag:
+                _ready.wait()
+            if _stop_flag:
+                return
+            job = _queue.popleft()
+            _busy += 1
+
+        try:
+            _run_job(job)
+        finally:
+            with _lock:
+                _busy -= 1
+                count = _user_jobs.get(job["chat_id"], 0) - 1
+                if count > 0:
+                    _user_jobs[job["chat_id"]] = count
+                else:
+                    _user_jobs.pop(job["chat_id"], None)
+
+
+def _run_job(job):
+    started = time.time()
+    with _lock:
+        _stats["total_wait"] += started - job["enqueued"]
+
+    try:
+        check_deadline(job["deadline"])
+        job["fn"](job["deadline"])
+        counter = "completed"
+    except VisionJobTimeout:
+        logger.warning(f"Изображение от {job['chat_id']} не обработано за {VISION_JOB_TIMEOUT:.0f} сек")
+        counter = "timeouts"
+        if job["on_timeout"]:
+            try:
+                job["on_timeout"]()
+            except Exception as e:
+                logger.error(f"Ошибка уведомления о таймауте: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка задания распознавания изображения: {e}", exc_info=True)
+        counter = "failed"
+
+    with _lock:
+        _stats[counter] += 1
+
+
+def get_queue_position(chat_id):
+    """Сколько заданий в очереди перед первым заданием пользователя (None — нет в очереди)"""
+    with _lock:
+        for index, job in enumerate(_queue):
+            if job["chat_id"] == chat_id:
+                return index
+    return None
+
+
+def get_vision_stats():
+    """Возвращает счётчики сервиса распознавания изображений"""
+    with _lock:
+        stats = dict(_stats)
+        stats["queued"] = len(_queue)
+        stats["busy"] = _busy
+        stats["running"] = any(worker.is_alive() for worker in _workers) and not _stop_flag
+    started = stats["completed"] + stats["failed"] + stats["timeouts"]
+    stats["avg_wait"] = stats.pop("total_wait") / started if started else 0.0
+    return stats
@@ -1,30 +1,50 @@
 """
 Модуль для работы с голосовыми сообщениями
 - Распознавание речи (Speech-to-Text) с помощью Vosk (офлайн, без OpenAI!)
+- Потоковое декодирование: HTTP → ffmpeg (pipe) → PCM → Vosk, без временных файлов
+- Режим команд: распознавание по грамматике известных фраз с запасным полным распознаванием
 - Определение команды из текста
 """
 import os
 import json
+import itertools
 import logging
-import requests
-import wave
+import time
+import subprocess
+import threading
 from bot.config import VOICE_ENABLED, MODELS_DIR
+from bot.utils.voice_commands import match_command, get_command_phrases
+from bot.utils import vad
+from bot.utils.media_fetch import KIND_AUDIO, MediaTooLarge, iter_media
 
 logger = logging.getLogger(__name__)
 
 # Глобальная переменная для модели Vosk
 vosk_model = None
-vosk_recognizer = None
+
+# Формат PCM, который ожидает Vosk: 16 кГц, mono, 16 бит
+SAMPLE_RATE = 16000
+# 4000 сэмплов = 0.25 сек аудио
+PCM_CHUNK_BYTES = 8000
+HTTP_CHUNK_BYTES = 16384
+# Как часто рабочий процесс отправляет промежуточную гипотезу (PartialResult), секунды
+PARTIAL_RESULT_INTERVAL = 1.0
+
+# Очередь промежуточных результатов в основной процесс (задаётся в init_worker)
+_progress_queue = None
+
+# Команды длиннее этого не распознаются по грамматике (сразу полное распознавание)
+COMMAND_MAX_SECONDS = 15
+_command_grammar = None
 
 # Импортируем библиотеки только если голосовое управление включено
 if VOICE_ENABLED:
     try:
         from vosk import Model, KaldiRecognizer
-        from pydub import AudioSegment
         logger.info("Vosk библиотека успешно загружена")
     except ImportError as e:
         logger.error(f"Ошибка импорта Vosk: {e}")
-        logger.error("Установите: pip install vosk pydub")
+        logger.error("Установите: pip install vosk (и ffmpeg в системе)")
 else:
     logger.info("Voice control отключено (VOICE_ENABLED=false)")
 
@@ -58,168 +78,397 @@ def init_vosk_model():
         logger.error(f"Ошибка загрузки модели Vosk: {e}", exc_info=True)
         return False
 
-def convert_to_wav(input_path, output_path):
-    """Конвертирует аудио в WAV формат для Vosk"""
-    try:
-        # Загружаем аудио (поддерживает ogg, mp3, m4a и т.д.)
-        audio = AudioSegment.from_file(input_path)
+class TranscriptionTimeout(Exception):
+    """Задание распознавания не уложилось в отведённое время"""
 
-        # Конвертируем в mono 16kHz WAV (требование Vosk)
-        audio = audio.set_channels(1)  # Mono
-        audio = audio.set_frame_rate(16000)  # 16kHz
 
-        # Экспортируем в WAV
-        audio.export(output_path, format="wav")
-        logger.info(f"Аудио сконвертировано в WAV: {output_path}")
-        return True
+def _check_deadline(deadline):
+    if deadline is not None and time.time() > deadline:
+        raise TranscriptionTimeout("Превышено время распознавания")
 
-    except Exception as e:
-        logger.error(f"Ошибка конвертации аудио: {e}")
-        return False
 
-def transcribe_voice(audio_path):
+def _iter_file(audio_path):
+    with open(audio_path, "rb") as f:
+        while True:
+            chunk = f.read(HTTP_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def transcribe_file(audio_path, deadline=None, job_id=None):
     """
-    Распознаёт речь из аудио файла
+    Распознаёт речь из локального аудио файла в текущем процессе
+
+    Файл декодируется через ffmpeg в память (без промежуточного WAV).
+    Используется рабочими процессами сервиса распознавания
+    (bot.utils.speech_service).
 
     Args:
         audio_path: путь к аудио файлу
+        deadline: время (time.time()), после которого распознавание прерывается
 
     Returns:
         str: распознанный текст или None при ошибке
+
+    Raises:
+        TranscriptionTimeout: если истёк deadline
     """
-    global vosk_model
+    logger.info(f"Распознаём речь из файла: {audio_path}")
+    return _transcribe_stream(_iter_file(audio_path), deadline, _report_progress(job_id))
+
+
+def transcribe_url(url, deadline=None, job_id=None):
+    """
+    Скачивает и распознаёт голосовое сообщение потоково, без временных файлов
+
+    HTTP-ответ → ffmpeg (pipe) → PCM → KaldiRecognizer. Декодирование идёт
+    параллельно со скачиванием. Выполняется в рабочем процессе сервиса
+    распознавания.
+
+    Args:
+        url: URL голосового сообщения
+        deadline: время (time.time()), после которого распознавание прерывается
+        job_id: ID задания сервиса; если задан, промежуточный текст
+                отправляется в основной процесс по мере готовности
+
+    Returns:
+        str: распознанный текст или None при ошибке
+
+    Raises:
+        TranscriptionTimeout: если истёк deadline
+    """
+    return _transcribe_stream(iter_http_body(url), deadline, _report_progress(job_id))
+
+
+def _transcribe_stream(chunks, deadline, on_partial=None):
+    """Общая часть transcribe_file / transcribe_url"""
+    text = _run_pipeline(chunks, deadline, lambda pcm: recognize_pcm(pcm, deadline, on_partial))
+    return text if text else None
 
-    if not VOICE_ENABLED:
-        logger.info("Voice control отключено")
-        return "🔧 Голосовое управление отключено. Включите VOICE_ENABLED=true в .env"
 
+def _run_pipeline(chunks, deadline, recognize):
+    """
+    Декодирует аудио в PCM и передаёт его функции recognize(pcm)
+
+    Перед распознавателем PCM проходит через vad.prepare_pcm: тишина в
+    начале и в конце отбрасывается, длинные записи обрезаются или
+    отклоняются. Запись без речи не распознаётся вовсе.
+
+    Returns:
+        результат recognize или None при ошибке / отсутствии речи
+
+    Raises:
+        TranscriptionTimeout: если истёк deadline
+        vad.AudioTooLong: запись длиннее VOICE_MAX_DURATION (политика reject)
+        MediaTooLarge: файл больше MEDIA_MAX_AUDIO_BYTES
+    """
     # Загружаем модель если ещё не загружена
     if vosk_model is None:
         logger.info("Модель не загружена, инициализируем...")
         if not init_vosk_model():
             return None
 
-    try:
-        logger.info(f"Распознаём речь из файла: {audio_path}")
+    _check_deadline(deadline)
 
-        # Конвертируем в WAV если нужно
-        wav_path = audio_path
-        if not audio_path.endswith('.wav'):
-            wav_path = audio_path.rsplit('.', 1)[0] + '_converted.wav'
-            if not convert_to_wav(audio_path, wav_path):
+    try:
+        started = time.monotonic()
+        stats = vad.new_stats()
+        pcm = stream_pcm(chunks)
+        try:
+            speech = vad.prepare_pcm(pcm, stats)
+            # Первый кусок речи читаем до создания распознавателя:
+            # для тишины и отклонённых записей Kaldi не запускается
+            first = next(speech, None)
+            if first is None:
+                vad.report(stats, 0.0)
                 return None
 
-        # Открываем WAV файл
-        wf = wave.open(wav_path, "rb")
+            cpu_started = time.process_time()
+            result = recognize(itertools.chain((first,), speech))
+            vad.report(stats, time.process_time() - cpu_started)
+        finally:
+            pcm.close()
 
-        # Проверяем формат
-        if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getframerate() not in [8000, 16000, 32000, 48000]:
-            logger.error("Аудио файл должен быть mono PCM WAV")
-            return None
+        logger.info(f"Результат распознавания ({time.monotonic() - started:.1f} сек): {result}")
+        return result
 
-        # Создаём распознаватель
-        rec = KaldiRecognizer(vosk_model, wf.getframerate())
-        rec.SetWords(True)
+    except (TranscriptionTimeout, vad.AudioTooLong, MediaTooLarge):
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка распознавания речи: {e}", exc_info=True)
+        return None
 
-        # Распознаём речь
-        results = []
-        while True:
-            data = wf.readframes(4000)
-            if len(data) == 0:
-                break
-            if rec.AcceptWaveform(data):
-                result = json.loads(rec.Result())
-                if 'text' in result:
-                    results.append(result['text'])
 
-        # Получаем финальный результат
-        final_result = json.loads(rec.FinalResult())
-        if 'text' in final_result:
-            results.append(final_result['text'])
+def iter_http_body(url):
+    """
+    Отдаёт тело голосового сообщения кусками по мере скачивания
 
-        # Объединяем весь текст
-        text = ' '.join(results).strip()
+    Размер ограничен MEDIA_MAX_AUDIO_BYTES, тип проверяется по первым байтам
+    (см. media_fetch.iter_media).
+    """
+    return iter_media(url, KIND_AUDIO)
 
-        # Удаляем временный WAV файл если создавали
-        if wav_path != audio_path:
+
+def stream_pcm(chunks):
+    """
+    Декодирует поток аудио любого формата в PCM 16 кГц mono через ffmpeg
+
+    Входные куски пишутся в stdin ffmpeg из отдельного потока, поэтому
+    декодирование идёт параллельно со скачиванием. Временные файлы не создаются.
+
+    Args:
+        chunks: итератор байтов (например, iter_http_body)
+
+    Yields:
+        bytes: куски PCM по PCM_CHUNK_BYTES
+    """
+    process = subprocess.Popen(
+        [
+            "ffmpeg", "-loglevel", "error", "-nostdin",
+            "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+            "pipe:1",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    feed_error = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg завершился раньше (ошибка формата или прервали чтение)
+            pass
+        except Exception as e:
+            feed_error.append(e)
+        finally:
             try:
-                os.remove(wav_path)
-            except:
+                process.stdin.close()
+            except OSError:
                 pass
 
-        logger.info(f"Распознанный текст: {text}")
-        return text if text else None
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
 
-    except Exception as e:
-        logger.error(f"Ошибка распознавания речи: {e}", exc_info=True)
+    completed = False
+    try:
+        while True:
+            data = process.stdout.read(PCM_CHUNK_BYTES)
+            if not data:
+                break
+            yield data
+        completed = True
+    finally:
+        # Чтение прервали (таймаут, ошибка распознавания) — останавливаем ffmpeg
+        if not completed and process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        feeder.join(timeout=1)
+
+    if feed_error:
+        raise feed_error[0]
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg завершился с кодом {process.returncode}")
+
+
+def recognize_pcm(pcm_chunks, deadline=None, on_partial=None):
+    """
+    Распознаёт речь из потока PCM 16 кГц mono
+
+    Args:
+        pcm_chunks: итератор кусков PCM
+        deadline: время (time.time()), после которого распознавание прерывается
+        on_partial: функция fn(text), получает накопленный текст, когда
+                    очередной сегмент завершён (Result) и не чаще раза в
+                    PARTIAL_RESULT_INTERVAL — текущую гипотезу (PartialResult)
+
+    Returns:
+        str: распознанный текст (может быть пустым)
+
+    Raises:
+        TranscriptionTimeout: если истёк deadline
+    """
+    rec = KaldiRecognizer(vosk_model, SAMPLE_RATE)
+    rec.SetWords(True)
+
+    results = []
+    last_partial = time.monotonic()
+    for data in pcm_chunks:
+        _check_deadline(deadline)
+        if rec.AcceptWaveform(data):
+            result = json.loads(rec.Result())
+            if result.get('text'):
+                results.append(result['text'])
+                if on_partial:
+                    on_partial(' '.join(results))
+                    last_partial = time.monotonic()
+        elif on_partial and time.monotonic() - last_partial >= PARTIAL_RESULT_INTERVAL:
+            partial = json.loads(rec.PartialResult()).get('partial')
+            if partial:
+                on_partial(' '.join(results + [partial]))
+            last_partial = time.monotonic()
+
+    final_result = json.loads(rec.FinalResult())
+    if final_result.get('text'):
+        results.append(final_result['text'])
+
+    return ' '.join(results).strip()
+
+
+def _report_progress(job_id):
+    """Колбэк промежуточного текста, пересылающий его в основной процесс"""
+    if job_id is None or _progress_queue is None:
         return None
+    return lambda text: _progress_queue.put((job_id, text))
+
+
+def get_command_grammar():
+    """
+    JSON-грамматика Vosk из фраз таблицы команд (bot/voice_commands.json)
+
+    В грамматику попадают только фразы из кириллических слов (латиница
+    отсутствует в словаре русской модели) и служебный "[unk]" для всего
+    остального.
+    """
+    global _command_grammar
+
+    if _command_grammar is None:
+        phrases = set()
+        for keywords in get_command_phrases().values():
+            for keyword in keywords:
+                phrase = keyword.lower().strip()
+                if phrase and all(word.isalpha() and not word.isascii() for word in phrase.split()):
+                    phrases.add(phrase)
+        _command_grammar = json.dumps(sorted(phrases) + ["[unk]"], ensure_ascii=False)
+    return _command_grammar
+
+
+def _collect_words(result, words):
+    for word in result.get('result', []):
+        if word.get('word') and word['word'] != '[unk]':
+            words.append(word)
+
+
+def recognize_command_pcm(pcm_chunks, deadline=None):
+    """
+    Распознаёт голосовую команду: сначала по грамматике известных фраз
+
+    Распознаватель с грамматикой выбирает только из фраз команд, поэтому
+    работает быстрее и точнее на коротких фразах. Если он не узнал ни одного
+    слова (только "[unk]") или запись слишком длинная, тот же PCM
+    распознаётся полностью.
+
+    Returns:
+        dict: {"text": str, "confidence": 0.0-1.0 или None, "mode": "grammar" | "full"}
+
+    Raises:
+        TranscriptionTimeout: если истёк deadline
+    """
+    rec = KaldiRecognizer(vosk_model, SAMPLE_RATE, get_command_grammar())
+    rec.SetWords(True)
+
+    max_bytes = COMMAND_MAX_SECONDS * SAMPLE_RATE * 2
+    buffered = []
+    buffered_bytes = 0
+    words = []
+    too_long = False
+
+    for data in pcm_chunks:
+        _check_deadline(deadline)
+        buffered.append(data)
+        buffered_bytes += len(data)
+        if buffered_bytes > max_bytes:
+            too_long = True
+            break
+        if rec.AcceptWaveform(data):
+            _collect_words(json.loads(rec.Result()), words)
+
+    if not too_long:
+        _collect_words(json.loads(rec.FinalResult()), words)
+        if words:
+            return {
+                "text": ' '.join(word['word'] for word in words),
+                "confidence": sum(word.get('conf', 0.0) for word in words) / len(words),
+                "mode": "grammar",
+            }
+
+    # [unk] или длинная запись — полное распознавание уже прочитанного и остатка
+    text = recognize_pcm(itertools.chain(buffered, pcm_chunks), deadline)
+    return {"text": text, "confidence": None, "mode": "full"}
+
+
+def recognize_command_url(url, deadline=None, job_id=None):
+    """
+    Скачивает голосовое и распознаёт команду (см. recognize_command_pcm)
+
+    Returns:
+        dict или None при ошибке
+    """
+    return _run_pipeline(iter_http_body(url), deadline, lambda pcm: recognize_command_pcm(pcm, deadline))
+
+
+def recognize_command_file(audio_path, deadline=None, job_id=None):
+    """Как recognize_command_url, для локального аудио файла"""
+    return _run_pipeline(_iter_file(audio_path), deadline, lambda pcm: recognize_command_pcm(pcm, deadline))
+
+
+def init_worker(progress_queue=None):
+    """
+    Инициализатор рабочего процесса: загружает модель один раз при старте
+
+    Args:
+        progress_queue: multiprocessing.Queue для промежуточных результатов
+    """
+    global _progress_queue
+    _progress_queue = progress_queue
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - [stt-worker] %(message)s")
+    init_vosk_model()
+
+
+def worker_ping():
+    """Пустое задание: заставляет пул запустить процесс и загрузить модель"""
+    return vosk_model is not None
+
+
+def transcribe_voice(audio_path):
+    """
+    Распознаёт речь из аудио файла
+
+    Задание выполняется в пуле процессов сервиса распознавания, вызывающий
+    поток ждёт результат не дольше VOICE_JOB_TIMEOUT; если сервис не запущен
+    или очередь переполнена, возвращается None. Обработчики,
+    которые не должны блокироваться, используют
+    bot.utils.speech_service.submit_transcription напрямую.
+
+    Args:
+        audio_path: путь к аудио файлу
+
+    Returns:
+        str: распознанный текст или None при ошибке
+    """
+    if not VOICE_ENABLED:
+        logger.info("Voice control отключено")
+        return "🔧 Голосовое управление отключено. Включите VOICE_ENABLED=true в .env"
+
+    from bot.utils.speech_service import transcribe
+    return transcribe(audio_path)
 
 def parse_voice_command(text):
     """
     Определяет команду из распознанного текста
 
+    Сопоставление выполняет скомпилированный автомат по основам слов
+    (bot.utils.voice_commands), таблица команд загружается из JSON.
+
     Args:
         text: распознанный текст
 
     Returns:
         dict: {"command": "название_команды", "confidence": 0.0-1.0}
     """
-    if not text:
-        return {"command": None, "confidence": 0.0}
-
-    text_lower = text.lower()
-
-    # Словарь команд и ключевых слов
-    commands = {
-        "request_call": [
-            "позвони", "звонок", "волонтёр", "волонтер", "помощь", "нужна помощь",
-            "свяжитесь", "связаться", "позвоните", "нужен звонок"
-        ],
-        "image_to_text": [
-            "изображение", "картинка", "фото", "распознай", "что на фото",
-            "опиши картинку", "что на картинке", "что изображено"
-        ],
-        "sos": [
-            "sos", "сос", "срочно", "экстренно", "помогите", "спасите",
-            "чрезвычайная", "авария", "беда"
-        ],
-        "menu": [
-            "меню", "функции", "возможности", "что умеешь", "команды",
-            "покажи меню", "открой меню"
-        ]
-    }
-
-    # Ищем совпадения
-    best_match = None
-    max_matches = 0
-
-    for command, keywords in commands.items():
-        matches = sum(1 for keyword in keywords if keyword in text_lower)
-        if matches > max_matches:
-            max_matches = matches
-            best_match = command
-
-    # Вычисляем уверенность (confidence)
-    if best_match and max_matches > 0:
-        # Чем больше совпадений, тем выше уверенность
-        confidence = min(1.0, max_matches / 2)  # Максимум 1.0
-        return {"command": best_match, "confidence": confidence, "text": text}
-
-    # Если ничего не нашли
-    return {"command": None, "confidence": 0.0, "text": text}
-
-def download_voice(url, save_path):
-    """Скачивает голосовое сообщение по URL"""
-    try:
-        response = requests.get(url, timeout=30)
-        if response.status_code == 200:
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
-            logger.info(f"Голосовое сообщение сохранено: {save_path}")
-            return True
-        else:
-            logger.error(f"Ошибка скачивания голосового: {response.status_code}")
-            return False
-    except Exception as e:
-        logger.error(f"Ошибка при скачивании голосового: {e}")
-        return False
+    return match_command(text)
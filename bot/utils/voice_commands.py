@@ -0,0 +1,283 @@
+"""
+Сопоставление распознанного текста с голосовыми командами
+
+- Таблица команд загружается из JSON при старте (VOICE_COMMANDS_FILE)
+- Текст и фразы нормализуются: нижний регистр, ё → е, стемминг
+  (упрощённый Snowball для русского), поэтому "позвоните", "позвонить"
+  и "позвони" дают одну основу
+- Все фразы компилируются в автомат Ахо–Корасик по основам слов:
+  текст просматривается за один проход независимо от размера словаря
+- У каждой фразы свой вес; уверенность = сумма весов / MATCH_SCORE_FOR_FULL_CONFIDENCE
+"""
+import json
+import logging
+import re
+from collections import deque
+from functools import lru_cache
+from threading import Lock
+from bot.config import VOICE_COMMANDS_FILE
+
+logger = logging.getLogger(__name__)
+
+# Сумма весов, при которой уверенность равна 1.0 (две фразы с весом 1)
+MATCH_SCORE_FOR_FULL_CONFIDENCE = 2.0
+
+_TOKEN_RE = re.compile(r"\w+")
+_VOWELS = "аеиоуыэюя"
+
+# Несклоняемые слова: стемминг их только портит ("меню" и "меня" дали бы одну основу)
+_INDECLINABLE = {"меню", "фото", "кафе", "метро", "такси", "радио", "видео"}
+
+# Окончания Snowball (русский), от длинных к коротким внутри групп
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")
+_PERFECTIVE_GERUND_2 = ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв")
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому",
+    "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+    "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_REFLEXIVE = ("ся", "сь")
+_VERB_1 = ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н")
+_VERB_2 = (
+    "ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено",
+    "ует", "уют", "ены", "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым",
+    "ен", "ят", "ит", "ыт", "ую", "ю",
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях",
+    "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой", "ий", "ям", "ем", "ам", "ом",
+    "ах", "ях", "ию", "ью", "ия", "ья",
+    "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+)
+_SUPERLATIVE = ("ейше", "ейш")
+
+
+def _strip_ending(word, endings, after_a_ya=False):
+    """Снимает первое подходящее окончание; None если ни одно не подошло"""
+    for ending in endings:
+        if word.endswith(ending):
+            stem = word[:-len(ending)]
+            if after_a_ya and not stem.endswith(("а", "я")):
+                continue
+            return stem
+    return None
+
+
+@lru_cache(maxsize=10000)
+def stem(word):
+    """
+    Основа русского слова (упрощённый алгоритм Snowball, без шага R2)
+
+    Args:
+        word: слово в нижнем регистре, ё уже заменена на е
+
+    Returns:
+        str: основа слова
+    """
+    if word in _INDECLINABLE:
+        return word
+
+    for i, char in enumerate(word):
+        if char in _VOWELS:
+            prefix, rv = word[:i + 1], word[i + 1:]
+            break
+    else:
+        return word
+
+    # Шаг 1
+    stripped = _strip_ending(rv, _PERFECTIVE_GERUND_1, after_a_ya=True)
+    if stripped is None:
+        stripped = _strip_ending(rv, _PERFECTIVE_GERUND_2)
+    if stripped is not None:
+        rv = stripped
+    else:
+        reflexive = _strip_ending(rv, _REFLEXIVE)
+        if reflexive is not None:
+            rv = reflexive
+        adjective = _strip_ending(rv, _ADJECTIVE)
+        if adjective is not None:
+            participle = _strip_ending(adjective, _PARTICIPLE_1, after_a_ya=True)
+            if participle is None:
+                participle = _strip_ending(adjective, _PARTICIPLE_2)
+            rv = participle if participle is not None else adjective
+        else:
+            verb = _strip_ending(rv, _VERB_1, after_a_ya=True)
+            if verb is None:
+                verb = _strip_ending(rv, _VERB_2)
+            if verb is None:
+                verb = _strip_ending(rv, _NOUN)
+            if verb is not None:
+                rv = verb
+
+    # Шаг 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Шаг 4
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        superlative = _strip_ending(rv, _SUPERLATIVE)
+        if superlative is not None:
+            rv = superlative[:-1] if superlative.endswith("нн") else superlative
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def normalize(text):
+    """Текст → кортеж основ слов"""
+    text = text.lower().replace("ё", "е")
+    return tuple(stem(token) for token in _TOKEN_RE.findall(text))
+
+
+class CommandMatcher:
+    """
+    Автомат Ахо–Корасик по основам слов
+
+    Узлы хранятся в списках: переходы, ссылка неудачи и выход —
+    [(команда, вес, фраза как кортеж основ)].
+    """
+
+    def __init__(self, table):
+        """
+        Args:
+            table: {command: {phrase: weight}} — порядок команд задаёт
+                   приоритет при равной сумме весов
+        """
+        self.commands = list(table)
+        self.phrases = {command: list(phrases) for command, phrases in table.items()}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for command, phrases in table.items():
+            for phrase, weight in phrases.items():
+                tokens = normalize(phrase)
+                if tokens:
+                    self._add(tokens, command, float(weight))
+        self._build_failure_links()
+
+    def _add(self, tokens, command, weight):
+        node = 0
+        for token in tokens:
+            next_node = self._goto[node].get(token)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][token] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((command, weight, tokens))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(token, 0)
+                if self._fail[child] == child:
+                    self._fail[child] = 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def scores(self, text):
+        """
+        Суммы весов найденных фраз по командам (каждая фраза учитывается один раз)
+
+        Returns:
+            dict: {command: score}
+        """
+        found = set()
+        node = 0
+        for token in normalize(text):
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            for command, weight, phrase in self._output[node]:
+                found.add((command, phrase, weight))
+
+        result = {}
+        for command, _, weight in found:
+            result[command] = result.get(command, 0.0) + weight
+        return result
+
+    def match(self, text):
+        """
+        Определяет команду
+
+        Returns:
+            dict: {"command": str или None, "confidence": 0.0-1.0, "text": text}
+        """
+        if not text:
+            return {"command": None, "confidence": 0.0}
+
+        scores = self.scores(text)
+        best_match = None
+        best_score = 0.0
+        for command in self.commands:
+            score = scores.get(command, 0.0)
+            if score > best_score:
+                best_match, best_score = command, score
+
+        if best_match is None:
+            return {"command": None, "confidence": 0.0, "text": text}
+
+        confidence = min(1.0, best_score / MATCH_SCORE_FOR_FULL_CONFIDENCE)
+        return {"command": best_match, "confidence": confidence, "text": text}
+
+
+_matcher = None
+_lock = Lock()
+
+
+def load_command_table(path=VOICE_COMMANDS_FILE):
+    """
+    Загружает таблицу команд из JSON и компилирует автомат
+
+    Формат файла: {"commands": {"menu": {"покажи меню": 1.5, "меню": 1.0}, ...}}
+
+    Returns:
+        CommandMatcher
+    """
+    global _matcher
+
+    with open(path, encoding="utf-8") as f:
+        table = json.load(f)["commands"]
+
+    matcher = CommandMatcher(table)
+    with _lock:
+        _matcher = matcher
+
+    phrases = sum(len(p) for p in table.values())
+    logger.info(f"Загружено голосовых команд: {len(table)}, фраз: {phrases} ({path})")
+    return matcher
+
+
+def get_matcher():
+    """Скомпилированный автомат (таблица загружается при первом обращении)"""
+    with _lock:
+        matcher = _matcher
+    return matcher or load_command_table()
+
+
+def match_command(text):
+    """Определяет команду по тексту (см. CommandMatcher.match)"""
+    return get_matcher().match(text)
+
+
+def get_command_phrases():
+    """
+    Фразы команд в исходном виде (для грамматики распознавателя)
+
+    Returns:
+        dict: {command: [phrase, ...]}
+    """
+    return get_matcher().phrases
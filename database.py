@@ -13,12 +13,28 @@ logger = logging.getLogger(__name__)
 # Connection pool для эффективной работы с БД
 connection_pool = None
 
+# Функции listener(user_id), вызываемые после изменения роли, статуса
+# верификации или блокировки пользователя (сброс кэша меню)
+_user_change_listeners = []
+
+def add_user_change_listener(listener):
+    """Подписывает listener(user_id) на изменения роли и статуса пользователей"""
+    _user_change_listeners.append(listener)
+
+def _notify_user_changed(user_id):
+    for listener in _user_change_listeners:
+        try:
+            listener(str(user_id))
+        except Exception as e:
+            logger.error(f"Ошибка обработчика изменения пользователя {user_id}: {e}")
+
 def init_db_pool():
     """Инициализирует пул подключений к базе данных"""
     global connection_pool
 
     try:
-        connection_pool = psycopg2.pool.SimpleConnectionPool(
+        # ThreadedConnectionPool: к БД обращаются фоновые потоки (волны, освобождение чатов)
+        connection_pool = psycopg2.pool.ThreadedConnectionPool(
             1, 10,  # минимум 1, максимум 10 подключений
             host=os.getenv("DB_HOST", "localhost"),
             port=os.getenv("DB_PORT", "5432"),
@@ -138,6 +154,7 @@ def save_user(chat_id, role, username=None, user_id=None, **kwargs):
 
             conn.commit()
             logger.debug(f"Пользователь {chat_id} сохранён")
+            _notify_user_changed(chat_id)
             return True
 
     except Exception as e:
@@ -305,6 +322,55 @@ def get_active_requests():
         if conn:
             release_connection(conn)
 
+def set_request_chat_queued(request_id, queued):
+    """
+    Отмечает, что заявка ждёт свободный групповой чат (или больше не ждёт)
+
+    По этой отметке очередь ожидания восстанавливается после перезапуска
+    """
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE requests
+                SET chat_queued_at = CASE WHEN %s THEN COALESCE(chat_queued_at, CURRENT_TIMESTAMP) END
+                WHERE id = %s
+            """, (queued, str(request_id)))
+
+            conn.commit()
+            return True
+
+    except Exception as e:
+        logger.error(f"Ошибка отметки очереди чатов для запроса {request_id}: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            release_connection(conn)
+
+def get_requests_waiting_for_chat():
+    """Получает активные заявки, ожидающие групповой чат, в порядке постановки в очередь"""
+    conn = None
+    try:
+        conn = get_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT * FROM requests
+                WHERE chat_queued_at IS NOT NULL
+                AND status = 'active'
+                AND chat_room_id IS NULL
+                ORDER BY chat_queued_at
+            """)
+            return [dict(r) for r in cur.fetchall()]
+    except Exception as e:
+        logger.error(f"Ошибка получения заявок, ожидающих чат: {e}")
+        return []
+    finally:
+        if conn:
+            release_connection(conn)
+
 def get_active_request_for_user(chat_id):
     """Получает активную заявку нуждающегося (если есть)"""
     conn = None
@@ -499,6 +565,7 @@ def create_verification_request(volunteer_id, document_urls, comment=""):
             request_id = cur.fetchone()[0]
             conn.commit()
             logger.info(f"Создана заявка на верификацию {request_id} для волонтера {volunteer_id}")
+            _notify_user_changed(volunteer_id)
             return request_id
 
     except Exception as e:
@@ -567,6 +634,7 @@ def approve_verification_request(request_id, moderator_id, comment=""):
 
             conn.commit()
             logger.info(f"Заявка {request_id} одобрена модератором {moderator_id}")
+            _notify_user_changed(volunteer_id)
             return True
 
     except Exception as e:
@@ -613,6 +681,7 @@ def reject_verification_request(request_id, moderator_id, comment=""):
 
             conn.commit()
             logger.info(f"Заявка {request_id} отклонена модератором {moderator_id}")
+            _notify_user_changed(volunteer_id)
             return True
 
     except Exception as e:
@@ -697,6 +766,7 @@ def resolve_complaint(complaint_id, moderator_id, action, comment=""):
             """, (str(moderator_id), action, comment, complaint_id))
 
             # Если действие = блокировка, блокируем волонтера
+            blocked = []
             if action == "block":
                 cur.execute("""
                     UPDATE volunteers v
@@ -705,10 +775,14 @@ def resolve_complaint(complaint_id, moderator_id, action, comment=""):
                         blocked_at = CURRENT_TIMESTAMP
                     FROM complaints c
                     WHERE c.id = %s AND v.user_id = c.accused_id
+                    RETURNING v.user_id
                 """, (f"Жалоба #{complaint_id}: {comment}", complaint_id))
+                blocked = [row[0] for row in cur.fetchall()]
 
             conn.commit()
             logger.info(f"Жалоба {complaint_id} разрешена модератором {moderator_id}")
+            for volunteer_id in blocked:
+                _notify_user_changed(volunteer_id)
             return True
 
     except Exception as e:
@@ -34,6 +34,8 @@ CREATE TABLE IF NOT EXISTS chat_rooms (
     chat_id BIGINT UNIQUE NOT NULL,
     chat_title VARCHAR(200),
     is_occupied BOOLEAN DEFAULT FALSE,
+    occupied_at TIMESTAMP,
+    lease_expires_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -49,7 +51,8 @@ CREATE TABLE IF NOT EXISTS requests (
     current_wave INTEGER DEFAULT 0,
     notified_volunteers TEXT[],
     last_wave_sent_at TIMESTAMP,
-    chat_room_id INTEGER -- добавим FK позже
+    chat_room_id INTEGER, -- добавим FK позже
+    chat_queued_at TIMESTAMP -- заявка ждёт свободный групповой чат
 );
 
 -- Таблица reviews
@@ -115,19 +118,55 @@ CREATE TABLE IF NOT EXISTS audit_log (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Таблица content_cache (результаты распознавания по хэшу содержимого файла)
+CREATE TABLE IF NOT EXISTS content_cache (
+    kind VARCHAR(32) NOT NULL,
+    digest CHAR(64) NOT NULL,
+    value TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (kind, digest)
+);
+
+-- Таблица conversation_state (состояния диалогов с TTL; UNLOGGED — без WAL, очищается при сбое PostgreSQL)
+CREATE UNLOGGED TABLE IF NOT EXISTS conversation_state (
+    namespace VARCHAR(32) NOT NULL,
+    key VARCHAR(64) NOT NULL,
+    value JSONB NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+
+-- Таблица debounce_actions (последние нажатия критичных кнопок, общая для процессов бота)
+CREATE UNLOGGED TABLE IF NOT EXISTS debounce_actions (
+    key TEXT PRIMARY KEY,
+    expires_at TIMESTAMP NOT NULL
+);
+
 -- ----------------------------
 -- 2. Добавляем внешние ключи после создания таблиц
+-- (идемпотентно: файл целиком выполняется при каждом запуске бота)
 -- ----------------------------
-ALTER TABLE requests
-ADD CONSTRAINT fk_requests_chat_room
-FOREIGN KEY (chat_room_id) REFERENCES chat_rooms(id) ON DELETE SET NULL;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_requests_chat_room') THEN
+        ALTER TABLE requests
+        ADD CONSTRAINT fk_requests_chat_room
+        FOREIGN KEY (chat_room_id) REFERENCES chat_rooms(id) ON DELETE SET NULL;
+    END IF;
+END $$;
 
 ALTER TABLE chat_rooms
-ADD COLUMN current_request_id VARCHAR(100);
+ADD COLUMN IF NOT EXISTS current_request_id VARCHAR(100);
 
-ALTER TABLE chat_rooms
-ADD CONSTRAINT fk_chat_rooms_request
-FOREIGN KEY (current_request_id) REFERENCES requests(id) ON DELETE SET NULL;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_chat_rooms_request') THEN
+        ALTER TABLE chat_rooms
+        ADD CONSTRAINT fk_chat_rooms_request
+        FOREIGN KEY (current_request_id) REFERENCES requests(id) ON DELETE SET NULL;
+    END IF;
+END $$;
 
 -- ----------------------------
 -- 3. Индексы
@@ -151,3 +190,14 @@ CREATE INDEX IF NOT EXISTS idx_reviews_volunteer ON reviews(volunteer_id);
 CREATE INDEX IF NOT EXISTS idx_chat_rooms_occupied ON chat_rooms(is_occupied);
 CREATE INDEX IF NOT EXISTS idx_chat_rooms_request ON chat_rooms(current_request_id);
 CREATE INDEX IF NOT EXISTS idx_requests_chat_room ON requests(chat_room_id);
+CREATE INDEX IF NOT EXISTS idx_content_cache_expires ON content_cache(expires_at);
+CREATE INDEX IF NOT EXISTS idx_conversation_state_expires ON conversation_state(expires_at);
+
+-- ----------------------------
+-- 4. Миграции существующих баз
+-- ----------------------------
+ALTER TABLE chat_rooms ADD COLUMN IF NOT EXISTS occupied_at TIMESTAMP;
+ALTER TABLE chat_rooms ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_chat_rooms_lease ON chat_rooms(lease_expires_at) WHERE is_occupied = TRUE;
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS chat_queued_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_requests_chat_queued ON requests(chat_queued_at) WHERE chat_queued_at IS NOT NULL;
@@ -6,7 +6,6 @@ Max.ru Bot - Главный файл
 import logging
 import time
 import sys
-import os
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,7 +20,7 @@ logger = logging.getLogger(__name__)
 
 # Импорт конфигурации
 try:
-    from bot.config import MAX_TOKEN, VISION_MODEL_ENABLED, DOWNLOADS_DIR
+    from bot.config import MAX_TOKEN, VISION_MODEL_ENABLED
 except ImportError as e:
     logger.error(f"Ошибка импорта конфигурации: {e}")
     logger.error("Убедитесь, что файл .env настроен правильно")
@@ -41,7 +40,23 @@ from bot.handlers.callbacks import handle_callback
 from bot.wave_sender import start_wave_sender, stop_wave_sender
 
 # Импорт chat pool initializer
-from bot.chat_pool_initializer import sync_chat_pool
+from bot.chat_pool_initializer import start_chat_pool_sync, stop_chat_pool_sync
+
+# Импорт фонового освобождения чатов
+from bot.chat_room_releaser import start_chat_room_releaser, stop_chat_room_releaser
+
+# Импорт сервиса распознавания речи
+from bot.utils.speech_service import start_speech_service, stop_speech_service
+
+# Импорт клиента GigaChat Vision
+from bot.utils.vision import init_vision_model, close_vision_client
+from bot.utils.vision_service import start_vision_service, stop_vision_service
+
+# Импорт сервиса обработки нажатий на кнопки
+from bot.utils.callback_service import start_callback_service, stop_callback_service
+
+# Импорт уборщика временных файлов
+from bot.utils.scratch import start_scratch_janitor, stop_scratch_janitor
 
 logger.info(
     f"Vision Model: {'ENABLED' if VISION_MODEL_ENABLED else 'DISABLED (using stubs)'}"
@@ -57,8 +72,8 @@ def main():
         logger.error("Не удалось подключиться к PostgreSQL. Проверьте настройки в .env")
         return
 
-    # Создаём папку для загрузок
-    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    # Создаём папку для временных файлов и убираем оставшиеся после прошлого запуска
+    start_scratch_janitor()
 
     # Получаем информацию о боте
     bot_info = get_bot_info()
@@ -71,14 +86,31 @@ def main():
         close_db_pool()
         return
 
-    # Синхронизируем пул групповых чатов
-    sync_chat_pool()
+    # Запускаем процессы распознавания речи до фоновых потоков,
+    # модель Vosk загружается в каждом процессе один раз
+    start_speech_service()
+
+    # Авторизуемся в GigaChat один раз при запуске, а не при первом фото
+    if VISION_MODEL_ENABLED:
+        init_vision_model()
+
+    # Фото обрабатываются в фоновых потоках, не блокируя получение обновлений
+    start_vision_service()
+
+    # Нажатия на кнопки обрабатываются в фоне, ответ на callback — сразу
+    start_callback_service()
+
+    # Синхронизируем пул групповых чатов в фоне (не блокирует запуск)
+    start_chat_pool_sync()
 
     logger.info("Ожидание сообщений...")
 
     # Запускаем фоновый поток для отправки волн
     start_wave_sender()
 
+    # Запускаем фоновое освобождение чатов и сборщик зависших чатов
+    start_chat_room_releaser()
+
     marker = None
     error_count = 0
     max_errors = 5
@@ -146,6 +178,13 @@ def main():
 
     finally:
         stop_wave_sender()
+        stop_chat_room_releaser()
+        stop_chat_pool_sync()
+        stop_speech_service()
+        stop_vision_service()
+        stop_callback_service()
+        close_vision_client()
+        stop_scratch_janitor()
         close_db_pool()
         logger.info("Бот остановлен")
 